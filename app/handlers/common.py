@@ -1,4 +1,3 @@
-import asyncio
 import datetime
 import random
 import urllib.parse
@@ -17,10 +16,11 @@ from aiogram.types import Message, CallbackQuery, KeyboardButtonRequestUsers, Ke
 from config import BOT_TOKEN
 from logger import logger
 from ..services import db
+from ..services.outbox import outbox
 from ..services import msg_templates
 from ..keyboards.markups import get_main_markup
-from ..services.models import Session, User
-from ..services.namaz_api import get_namaz, get_next, NAMAZ
+from ..services.namaz_api import get_namaz, get_next, timings_to_utc, NAMAZ
+from ..services.timezones import local_now
 
 common_router = Router()
 MAIN_MARKUP = get_main_markup()
@@ -40,66 +40,47 @@ async def cmd_start_help(message: Message, state: FSMContext):
         time_now_utc = datetime.datetime.now(datetime.timezone.utc)
 
         # Локальная дата для запроса к API (сегодня по местному времени)
-        local_datetime = time_now_utc + timedelta(hours=city[3])
+        local_datetime = local_now(city[4], time_now_utc)
         date = local_datetime.strftime('%d-%m-%Y')
 
         # Получаем расписание на сегодня
-        for i in range(3):
-            timings = await get_namaz(date, city[1], city[2])
-            if timings:
-                break
-            await asyncio.sleep(0.5)
+        timings = await get_namaz(date, city[1], city[2], city[4])
 
         if not timings:
             # В случае ошибки API просто выходим, ничего не обновляем
             return
 
-        # Для каждой молитвы вычисляем UTC-время и решаем, что записать в БД
-        prayer_updates = {}
-        for prayer in NAMAZ:  # NAMAZ импортирован из namaz_api
-            prayer_time_str = timings.get(prayer)
-            if not prayer_time_str:
-                continue
-
-            # Локальное время молитвы (naive)
-            local_prayer = datetime.datetime.strptime(f"{date} {prayer_time_str}", "%d-%m-%Y %H:%M")
-
-            # Переводим в UTC (naive) и делаем aware
-            prayer_utc_naive = local_prayer - timedelta(hours=city[3])
-            prayer_utc = prayer_utc_naive.replace(tzinfo=datetime.timezone.utc)
-            if time_now_utc > prayer_utc:
-                prayer_updates[f"time_{prayer.lower()}"] = None
-            else:
-                prayer_updates[f"time_{prayer.lower()}"] = prayer_utc
-            prayer_updates['date_now'] = local_datetime.date()
-        if prayer_updates:
-            await db.update_user_prayers(message.from_user.id, prayer_updates)
+        # Для каждой молитвы вычисляем UTC-время (с учётом летнего времени зоны)
+        prayer_times = timings_to_utc(date, timings, city[4])
+        # Уже прошедшие намазы записываются без уведомлений
+        await db.update_user_prayers(message.from_user.id, local_datetime.date(), prayer_times,
+                                     sent_before=time_now_utc)
     msg = msg_templates.get_text_main(message.chat.username, city[0].split(',')[0])
-    await message.answer(text=msg, reply_markup=MAIN_MARKUP)
+    await outbox.send(message.answer(text=msg, reply_markup=MAIN_MARKUP))
 
 
 @common_router.message(F.text.startswith(('🕌', '🕋')))
 async def day_handler(message: Message):
     city = await db.get_user_city(message.from_user.id)
-    timestamp = message.date + timedelta(hours=city[3])
+    timestamp = local_now(city[4], message.date)
     if message.text.startswith('🕋'):
         timestamp += timedelta(days=1)
     date = timestamp.strftime('%d-%m-%Y')
-    timings = await get_namaz(date, city[1], city[2])
+    timings = await get_namaz(date, city[1], city[2], city[4])
     if timings is None:
         msg = 'Ошибка загрузки данных, попробуйте еще раз.\nСпасибо.'
     else:
         msg = msg_templates.get_text_day(city[0].split(',')[0], date, timings)
-    await message.answer(text=msg, reply_markup=MAIN_MARKUP)
+    await outbox.send(message.answer(text=msg, reply_markup=MAIN_MARKUP))
 
 
 @common_router.message(F.text.startswith('⏰'))
 async def next_handler(message: Message):
     city = await db.get_user_city(message.from_user.id)
-    timestamp = message.date + timedelta(hours=city[3])
-    namaz = await get_next(timestamp, city[1], city[2])
+    timestamp = local_now(city[4], message.date)
+    namaz = await get_next(timestamp, city[1], city[2], city[4])
     msg = msg_templates.get_text_next(city[0].split(",")[0], namaz)
-    await message.answer(text=msg, reply_markup=MAIN_MARKUP)
+    await outbox.send(message.answer(text=msg, reply_markup=MAIN_MARKUP))
 
 
 @common_router.callback_query(F.data.startswith('yesna'))
@@ -108,15 +89,13 @@ async def namaz_yes(callback: CallbackQuery):
     name_namaz = callback.data.replace('yesna_', '').lower()
     await callback.answer()
 
-    # Получаем объект пользователя из БД
-    async with Session() as session:
-        from sqlalchemy import select
-        result = await session.execute(select(User).where(User.user_id == callback.from_user.id))
-        user = result.scalar_one_or_none()
+    # Получаем пользователя и его расписание на текущую дату из БД
+    user = await db.get_user(callback.from_user.id)
 
     if not user:
-        await callback.message.answer("Пользователь не найден. Попробуйте /start")
+        await outbox.send(callback.message.answer("Пользователь не найден. Попробуйте /start"))
         return
+    prayer_times = {event.prayer: event.utc_time for event in await db.get_user_events(user.user_id, user.date_now)}
 
     # Русские названия намазов в порядке, соответствующем NAMAZ
     prayer_names_ru = {
@@ -133,19 +112,19 @@ async def namaz_yes(callback: CallbackQuery):
     try:
         selected_index = order.index(name_namaz)
     except ValueError:
-        await callback.message.answer("Неизвестный намаз")
+        await outbox.send(callback.message.answer("Неизвестный намаз"))
         return
 
     # Формируем строки для каждого намаза
     lines = []
     for idx, prayer in enumerate(order):
-        # Получаем время из модели (поле time_<prayer>)
-        time_attr = getattr(user, f"time_{prayer}", None)
+        # Получаем время из расписания (prayer_events)
+        time_attr = prayer_times.get(prayer)
         if time_attr is None:
             time_str = "--:--"
         else:
             # Конвертируем UTC в локальное время пользователя
-            local_time = time_attr + timedelta(hours=user.timezone)
+            local_time = local_now(db.user_tz(user), time_attr)
             time_str = local_time.strftime("%H:%M")
 
         # Определяем статус
@@ -178,6 +157,6 @@ async def namaz_yes(callback: CallbackQuery):
     ])
 
     # Отправляем сообщение с этой клавиатурой
-    sent_msg = await callback.message.answer(msg_text, reply_markup=keyboard, parse_mode='HTML')
+    sent_msg = await outbox.send(callback.message.answer(msg_text, reply_markup=keyboard, parse_mode='HTML'))
 
 
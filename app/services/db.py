@@ -1,109 +1,222 @@
-from app.services.models import Session, User, create_tables, engine, Base
-from sqlalchemy import select, update, inspect
+from app.services.models import Session, User, PrayerEvent, PrayerSchedule, GeocodeResult, FsmRecord, ShardLease, \
+    WorkerHeartbeat, PRAYERS, create_tables, engine, Base
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import select, update, delete, insert, or_, and_, func, true
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.services import metrics
+from app.services.cache import TTLCache
+from app.services.db_writer import db_writer
+from app.services.timezones import local_now, utc_offset_hours
+from config import NOTIFIER_SHARDS, PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL
 from logger import logger
 
-# Город по умолчанию – теперь просто кортеж данных
+# Город по умолчанию – теперь просто кортеж данных (название, широта, долгота, смещение, зона IANA)
 DEFAULT_CITY = (
     'Москва, Центральный федеральный округ, Россия',
     55.7504461,
     37.6174943,
-    3
+    3,
+    'Europe/Moscow'
 )
 
+# Профили активных пользователей: user_id -> (city_name, latitude, longitude, часовой пояс).
+# Меняются только в set_user_city / delete_user / fill_missing_tz_names, которые сбрасывают запись.
+profile_cache = TTLCache(maxsize=PROFILE_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+metrics.register_cache('profile', profile_cache)
+
+# Ограничение числа параметров в одном запросе SQLite
+_CHUNK = 500
+
+# Подписчики на изменение данных пользователя (например, планировщик уведомлений).
+# Вызываются синхронно с user_id после успешной записи в БД.
+_user_change_listeners = []
+
+
+def on_user_changed(callback) -> None:
+    """Регистрирует callback(user_id), вызываемый после изменения города или расписания пользователя."""
+    _user_change_listeners.append(callback)
+
+
+def _user_changed(user_id: int) -> None:
+    for callback in _user_change_listeners:
+        try:
+            callback(user_id)
+        except Exception as e:
+            logger.exception(f"User change listener failed for {user_id}: {e}")
+
+
+# Подписчики на смену города (например, планировщик смены даты, которому нужен часовой пояс).
+# Вызываются синхронно с user_id и часовым поясом (см. user_tz) только из set_user_city.
+_city_change_listeners = []
+
+
+def on_city_changed(callback) -> None:
+    """Регистрирует callback(user_id, tz), вызываемый после того, как пользователь выбрал город."""
+    _city_change_listeners.append(callback)
+
+
+def _city_changed(user_id: int, tz) -> None:
+    for callback in _city_change_listeners:
+        try:
+            callback(user_id, tz)
+        except Exception as e:
+            logger.exception(f"City change listener failed for {user_id}: {e}")
+
 
 async def init_db(force: bool = False):
     """Инициализация БД: создание таблиц (данные по умолчанию не вставляются, так как нет отдельной таблицы городов)."""
     if force:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
+        profile_cache.clear()
     await create_tables()
 
 
-async def set_user_city(user_id: int, city_name: str, lat: float, lon: float, tz: int) -> None:
+async def set_user_city(user_id: int, city_name: str, lat: float, lon: float, tz: float,
+                        tz_name: str = None) -> None:
     """
     Сохраняет или обновляет город пользователя.
     Если пользователь уже существует – обновляет его поля, иначе создаёт новую запись.
-    """
-    async with Session() as session:
-        stmt = select(User).where(User.user_id == user_id)
-        result = await session.execute(stmt)
-        user = result.scalar_one_or_none()
 
-        user.city_name = city_name
-        user.latitude = lat
-        user.longitude = lon
-        user.timezone = tz
+    :param tz: текущее смещение от UTC в часах
+    :param tz_name: имя зоны IANA
+    """
+    async def write(session):
+        await session.execute(update(User).where(User.user_id == user_id).values(
+            city_name=city_name, latitude=lat, longitude=lon, timezone=tz, tz_name=tz_name))
 
-        await session.commit()
+    await db_writer.write(write)
+    profile_cache.invalidate(user_id)
+    _user_changed(user_id)
+    _city_changed(user_id, tz_name or tz)
 
 
 async def add_user(user_id: int) -> tuple:
-    async with Session() as session:
-        user = User(
-            user_id=user_id,
-            city_name=DEFAULT_CITY[0],
-            latitude=DEFAULT_CITY[1],
-            longitude=DEFAULT_CITY[2],
-            timezone=DEFAULT_CITY[3]
-        )
+    user = User(
+        user_id=user_id,
+        city_name=DEFAULT_CITY[0],
+        latitude=DEFAULT_CITY[1],
+        longitude=DEFAULT_CITY[2],
+        timezone=DEFAULT_CITY[3],
+        tz_name=DEFAULT_CITY[4]
+    )
+
+    async def write(session):
         session.add(user)
-        await session.commit()
-        return DEFAULT_CITY
+
+    await db_writer.write(write)
+    _remember_profile(user)
+    return user_city(user)
+
+
+def user_tz(user):
+    """Часовой пояс пользователя: имя зоны IANA, а для старых записей - смещение в часах."""
+    return user.tz_name or user.timezone
+
+
+def user_city(user) -> tuple:
+    """Кортеж (city_name, latitude, longitude, текущее смещение в часах, часовой пояс - см. user_tz)."""
+    return _city_tuple((user.city_name, user.latitude, user.longitude, user_tz(user)))
+
+
+def _city_tuple(profile: tuple) -> tuple:
+    # Смещение считается при каждом обращении: у зоны IANA оно меняется с переходом на летнее время
+    city_name, lat, lon, tz = profile
+    return city_name, lat, lon, utc_offset_hours(tz), tz
+
+
+def _remember_profile(user) -> None:
+    profile_cache.set(user.user_id, (user.city_name, user.latitude, user.longitude, user_tz(user)))
 
 
 async def get_user_city(user_id: int) -> tuple:
     """
-    Возвращает кортеж (city_name, latitude, longitude, timezone) для пользователя.
-    Если пользователя нет, создаёт его с городом по умолчанию и возвращает данные по умолчанию.
+    Возвращает кортеж (city_name, latitude, longitude, смещение, часовой пояс) для пользователя (см. user_city).
+    Если пользователя нет, возвращает None. Повторные обращения обслуживаются из profile_cache.
     """
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return _city_tuple(profile)
     async with Session() as session:
         stmt = select(User).where(User.user_id == user_id)
         result = await session.execute(stmt)
         user = result.scalar_one_or_none()
         if user:
-            return (user.city_name, user.latitude, user.longitude, user.timezone)
+            _remember_profile(user)
+            return user_city(user)
         return None
 
 
 async def delete_user(user_id: int) -> None:
     """Удаляет запись пользователя."""
-    async with Session() as session:
-        stmt = select(User).where(User.user_id == user_id)
-        result = await session.execute(stmt)
-        user = result.scalar_one_or_none()
-        if user:
-            await session.delete(user)
-            await session.commit()
+    async def write(session):
+        await session.execute(delete(User).where(User.user_id == user_id))
+        await session.execute(delete(PrayerEvent).where(PrayerEvent.user_id == user_id))
+
+    await db_writer.write(write)
+    profile_cache.invalidate(user_id)
+    _user_changed(user_id)
 
 
-async def update_user_prayers(user_id: int, updates: dict) -> None:
+async def update_user_prayers(user_id: int, local_date: date, times: dict, sent_before: datetime = None,
+                              only_if_stale: bool = False) -> bool:
     """
-    Обновляет поля времени молитв для пользователя с помощью прямого UPDATE.
+    Записывает расписание пользователя на местную дату в prayer_events и обновляет users.date_now.
+    События за эту и предыдущие даты заменяются новыми (флаги уведомлений сбрасываются).
 
     :param user_id: Telegram ID пользователя
-    :param updates: словарь вида {'time_fajr': datetime/None, ...}
-    """
-    # Получаем список допустимых колонок модели User (исключая первичный ключ и другие системные)
-    mapper = inspect(User)
-    valid_columns = {c.key for c in mapper.attrs}
-    # Оставляем только те ключи, которые есть в модели
-    filtered_updates = {k: v for k, v in updates.items() if k in valid_columns}
-    if not filtered_updates:
-        logger.warning(f"No valid columns to update for user {user_id}")
-        return
+    :param local_date: местная дата расписания
+    :param times: словарь вида {'fajr': datetime UTC, ...}
+    :param sent_before: намазы раньше этого момента сразу помечаются как уведомлённые
+                        (чтобы не слать уведомления о уже прошедших)
+    :param only_if_stale: записывать, только если date_now ещё меньше local_date (смена даты:
+                          повторный вызов из другого воркера ничего не меняет и флаги не сбрасывает)
+    :return: True, если расписание записано
+    """
+    if sent_before is not None:
+        sent_before = _naive_utc(sent_before)
+    rows = []
+    for prayer, utc_time in times.items():
+        if prayer not in PRAYERS or utc_time is None:
+            continue
+        utc_time = _naive_utc(utc_time)
+        passed = sent_before is not None and utc_time <= sent_before
+        rows.append({'user_id': user_id, 'prayer': prayer, 'utc_time': utc_time,
+                     'alarm_sent': passed, 'push_sent': passed, 'local_date': local_date})
 
-    async with Session() as session:
-        stmt = (
-            update(User)
-            .where(User.user_id == user_id)
-            .values(**filtered_updates)
-        )
-        result = await session.execute(stmt)
-        await session.commit()
+    condition = User.user_id == user_id
+    if only_if_stale:
+        condition = and_(condition, or_(User.date_now.is_(None), User.date_now < local_date))
+
+    async def write(session) -> bool:
+        result = await session.execute(update(User).where(condition).values(date_now=local_date))
         if result.rowcount == 0:
+            return False
+        await session.execute(
+            delete(PrayerEvent).where(PrayerEvent.user_id == user_id, PrayerEvent.local_date <= local_date)
+        )
+        if rows:
+            await session.execute(insert(PrayerEvent), rows)
+        return True
+
+    if not await db_writer.write(write):
+        if not only_if_stale:
             logger.warning(f"User {user_id} not found for update")
-        else:
-            logger.info(f"Новое время молитв сохранено в БД (прямой UPDATE)")
+        return False
+    logger.debug("Новое время молитв пользователя %s сохранено в БД (%s событий)", user_id, len(rows))
+    _user_changed(user_id)
+    return True
+
+
+async def get_user_events(user_id: int, local_date: date = None) -> list:
+    """Возвращает события (намазы) пользователя, по умолчанию за все даты, по возрастанию времени."""
+    stmt = select(PrayerEvent).where(PrayerEvent.user_id == user_id)
+    if local_date is not None:
+        stmt = stmt.where(PrayerEvent.local_date == local_date)
+    async with Session() as session:
+        result = await session.execute(stmt.order_by(PrayerEvent.utc_time))
+        return result.scalars().all()
 
 
 async def get_all_users():
@@ -111,3 +224,440 @@ async def get_all_users():
     async with Session() as session:
         result = await session.execute(select(User))
         return result.scalars().all()
+
+
+async def get_user(user_id: int):
+    """Возвращает объект пользователя или None."""
+    async with Session() as session:
+        result = await session.execute(select(User).where(User.user_id == user_id))
+        return result.scalar_one_or_none()
+
+
+def _naive_utc(moment: datetime) -> datetime:
+    """В SQLite время молитв хранится как naive UTC."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def user_shard(user_id: int) -> int:
+    """Шард пользователя для воркеров уведомлений."""
+    return user_id % NOTIFIER_SHARDS
+
+
+def _shard_condition(column, shards):
+    # shards=None - все пользователи (уведомления в процессе бота)
+    if shards is None:
+        return true()
+    return (column % NOTIFIER_SHARDS).in_(sorted(shards))
+
+
+async def get_due_events(now: datetime, alarm_before: timedelta, push_after: timedelta, shards=None) -> list:
+    """
+    Возвращает только события с неотправленным уведомлением в окне:
+    - намаз в ближайшие alarm_before и alarm_sent не установлен;
+    - намаз был раньше чем push_after назад и push_sent не установлен.
+    Оба условия - диапазоны по utc_time.
+
+    :param shards: только пользователи этих шардов (см. user_shard)
+    """
+    now = _naive_utc(now)
+    stmt = select(PrayerEvent).where(or_(
+        and_(PrayerEvent.alarm_sent == False,  # noqa: E712
+             PrayerEvent.utc_time > now, PrayerEvent.utc_time <= now + alarm_before),
+        and_(PrayerEvent.push_sent == False,  # noqa: E712
+             PrayerEvent.utc_time < now - push_after),
+    ), _shard_condition(PrayerEvent.user_id, shards))
+    async with Session() as session:
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+
+async def get_pending_events(user_ids=None, shards=None) -> list:
+    """
+    Возвращает события, по которым ещё не отправлено хотя бы одно уведомление.
+
+    :param user_ids: только события этих пользователей (по умолчанию - всех)
+    """
+    stmt = select(PrayerEvent).where(or_(PrayerEvent.alarm_sent == False,  # noqa: E712
+                                         PrayerEvent.push_sent == False),  # noqa: E712
+                                     _shard_condition(PrayerEvent.user_id, shards))
+    async with Session() as session:
+        if user_ids is None:
+            return (await session.execute(stmt)).scalars().all()
+        user_ids = sorted(user_ids)
+        events = []
+        for i in range(0, len(user_ids), _CHUNK):
+            result = await session.execute(stmt.where(PrayerEvent.user_id.in_(user_ids[i:i + _CHUNK])))
+            events.extend(result.scalars().all())
+        return events
+
+
+async def get_new_events(after_id: int, shards=None) -> list:
+    """
+    События, добавленные после события after_id (id растут с каждой записью расписания
+    и не переиспользуются - таблица с AUTOINCREMENT).
+    Так воркер узнаёт о расписаниях, записанных другими процессами.
+    """
+    stmt = select(PrayerEvent).where(PrayerEvent.id > after_id, _shard_condition(PrayerEvent.user_id, shards))
+    async with Session() as session:
+        result = await session.execute(stmt.order_by(PrayerEvent.id))
+        return result.scalars().all()
+
+
+async def get_max_event_id() -> int:
+    async with Session() as session:
+        return (await session.execute(select(func.max(PrayerEvent.id)))).scalar() or 0
+
+
+async def claim_event_flags(claims: list) -> set:
+    """
+    Атомарно занимает уведомления перед отправкой: флаг ставится, только если он ещё не установлен.
+    Уведомление отправляет тот, кто его занял, - даже если событие одновременно обрабатывают
+    два процесса (например, при переходе шарда к другому воркеру), сообщение уходит один раз.
+
+    :param claims: список пар (event_id, 'alarm_sent' / 'push_sent')
+    :return: множество занятых пар
+    """
+    async def write(session) -> set:
+        claimed = set()
+        for flag in ('alarm_sent', 'push_sent'):
+            ids = [event_id for event_id, kind in claims if kind == flag]
+            column = getattr(PrayerEvent, flag)
+            for i in range(0, len(ids), _CHUNK):
+                result = await session.execute(
+                    update(PrayerEvent)
+                    .where(PrayerEvent.id.in_(ids[i:i + _CHUNK]), column == False)  # noqa: E712
+                    .values({flag: True})
+                    .returning(PrayerEvent.id)
+                )
+                claimed.update((event_id, flag) for event_id in result.scalars().all())
+        return claimed
+
+    return await db_writer.write(write)
+
+
+async def release_event_flags(claims: list) -> int:
+    """Снимает флаги занятых, но не доставленных уведомлений (они будут отправлены повторно)."""
+    if not claims:
+        return 0
+
+    async def write(session):
+        for flag in ('alarm_sent', 'push_sent'):
+            ids = [event_id for event_id, kind in claims if kind == flag]
+            for i in range(0, len(ids), _CHUNK):
+                await session.execute(
+                    update(PrayerEvent).where(PrayerEvent.id.in_(ids[i:i + _CHUNK])).values({flag: False})
+                )
+
+    await db_writer.write(write)
+    return len(claims)
+
+
+async def get_events_by_ids(event_ids) -> list:
+    """Возвращает события с указанными id."""
+    event_ids = list(event_ids)
+    if not event_ids:
+        return []
+    async with Session() as session:
+        result = await session.execute(select(PrayerEvent).where(PrayerEvent.id.in_(event_ids)))
+        return result.scalars().all()
+
+
+async def get_timezones() -> list:
+    """
+    Возвращает различные часовые пояса пользователей (см. user_tz): имена зон IANA
+    и смещения тех, у кого имя зоны не известно.
+    """
+    async with Session() as session:
+        names = await session.execute(select(User.tz_name).where(User.tz_name.isnot(None)).distinct())
+        offsets = await session.execute(select(User.timezone).where(User.tz_name.is_(None)).distinct())
+        return names.scalars().all() + offsets.scalars().all()
+
+
+def _tz_condition(tz):
+    if isinstance(tz, str):
+        return User.tz_name == tz
+    return and_(User.tz_name.is_(None), User.timezone == tz)
+
+
+async def get_users_with_stale_date(now: datetime, timezones: list = None, shards=None) -> list:
+    """
+    Возвращает пользователей, у которых date_now не совпадает с текущей местной датой.
+    Местная дата считается отдельно для каждого часового пояса, чтобы запрос шёл по индексам
+    (tz_name, date_now) и (timezone, date_now).
+
+    :param timezones: ограничить выборку этими часовыми поясами (по умолчанию - все)
+    :param shards: только пользователи этих шардов (см. user_shard)
+    """
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=timezone.utc)
+    if timezones is None:
+        timezones = await get_timezones()
+    users = []
+    async with Session() as session:
+        for tz in timezones:
+            local_date = local_now(tz, now).date()
+            stmt = select(User).where(
+                _tz_condition(tz),
+                or_(User.date_now.is_(None), User.date_now != local_date),
+                _shard_condition(User.user_id, shards)
+            )
+            users.extend((await session.execute(stmt)).scalars().all())
+    return users
+
+
+async def fill_missing_tz_names(resolve_zone) -> int:
+    """
+    Заполняет tz_name у записей, созданных до появления колонки.
+
+    :param resolve_zone: async-функция (lat, lon) -> имя зоны или False
+    :return: количество обновлённых пользователей
+    """
+    async with Session() as session:
+        result = await session.execute(select(User.user_id, User.latitude, User.longitude)
+                                       .where(User.tz_name.is_(None)))
+        rows = result.all()
+    updates = []
+    for user_id, lat, lon in rows:
+        zone = await resolve_zone(lat, lon)
+        if zone:
+            updates.append({'user_id': user_id, 'tz_name': zone, 'timezone': utc_offset_hours(zone)})
+    if updates:
+        async def write(session):
+            for item in updates:
+                await session.execute(update(User).where(User.user_id == item['user_id'])
+                                      .values(tz_name=item['tz_name'], timezone=item['timezone']))
+
+        await db_writer.write(write)
+        for item in updates:
+            profile_cache.invalidate(item['user_id'])
+        logger.info(f"Часовые пояса IANA заполнены для {len(updates)} пользователей")
+    return len(updates)
+
+
+async def get_geocode(query: str, now: datetime = None):
+    """
+    Возвращает закэшированный ответ геокодера для нормализованного запроса.
+
+    :return: (ответ в формате get_loc_geocode, время истечения naive UTC) или None, если записи нет или она устарела
+    """
+    now = _naive_utc(now or datetime.now(timezone.utc))
+    async with Session() as session:
+        result = await session.execute(
+            select(GeocodeResult).where(GeocodeResult.query == query, GeocodeResult.expires_at > now)
+        )
+        row = result.scalar_one_or_none()
+    if row is None:
+        return None
+    response = {'status': row.status}
+    if row.status == 'Success':
+        response.update({'display_name': row.display_name, 'lat': row.lat, 'lon': row.lon})
+    return response, row.expires_at
+
+
+async def save_geocode(query: str, response: dict, expires_at: datetime) -> None:
+    """Сохраняет (или заменяет) ответ геокодера до момента expires_at."""
+    values = {
+        'query': query,
+        'status': response.get('status'),
+        'display_name': response.get('display_name'),
+        'lat': response.get('lat'),
+        'lon': response.get('lon'),
+        'expires_at': _naive_utc(expires_at),
+    }
+    stmt = sqlite_insert(GeocodeResult).values(**values)
+    stmt = stmt.on_conflict_do_update(index_elements=[GeocodeResult.query],
+                                      set_={k: v for k, v in values.items() if k != 'query'})
+
+    async def write(session):
+        await session.execute(stmt)
+
+    await db_writer.write(write)
+
+
+async def delete_expired_geocodes(now: datetime = None) -> int:
+    """Удаляет устаревшие записи кэша геокодера; возвращает их количество."""
+    now = _naive_utc(now or datetime.now(timezone.utc))
+
+    async def write(session) -> int:
+        result = await session.execute(delete(GeocodeResult).where(GeocodeResult.expires_at <= now))
+        return result.rowcount
+
+    return await db_writer.write(write)
+
+
+async def get_fsm_record(key: str, updated_after: datetime):
+    """Возвращает (state, data JSON, updated_at) для ключа FSM или None, если записи нет или она устарела."""
+    async with Session() as session:
+        result = await session.execute(
+            select(FsmRecord.state, FsmRecord.data, FsmRecord.updated_at)
+            .where(FsmRecord.key == key, FsmRecord.updated_at > _naive_utc(updated_after))
+        )
+        return result.one_or_none()
+
+
+async def save_fsm_records(upserts: list, deleted: list) -> None:
+    """
+    Записывает накопленные изменения FSM одной транзакцией.
+
+    :param upserts: список словарей {'key', 'state', 'data', 'updated_at'}
+    :param deleted: ключи, состояние которых очищено
+    """
+    async def write(session):
+        if upserts:
+            stmt = sqlite_insert(FsmRecord)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[FsmRecord.key],
+                set_={'state': stmt.excluded.state, 'data': stmt.excluded.data, 'updated_at': stmt.excluded.updated_at}
+            )
+            await session.execute(stmt, upserts)
+        if deleted:
+            await session.execute(delete(FsmRecord).where(FsmRecord.key.in_(deleted)))
+
+    await db_writer.write(write)
+
+
+async def delete_expired_fsm_records(updated_before: datetime) -> int:
+    """Удаляет состояния FSM, не менявшиеся с updated_before; возвращает их количество."""
+    async def write(session) -> int:
+        result = await session.execute(delete(FsmRecord).where(FsmRecord.updated_at <= _naive_utc(updated_before)))
+        return result.rowcount
+
+    return await db_writer.write(write)
+
+
+async def get_schedule(keys: list) -> dict:
+    """
+    Читает расписания из prayer_schedule.
+
+    :param keys: список кортежей (cell, local_date, method, utc_offset)
+    :return: {ключ: PrayerSchedule} для найденных ключей
+    """
+    wanted = set(keys)
+    found = {}
+    cells = sorted({key[0] for key in wanted})
+    dates = sorted({key[1] for key in wanted})
+    async with Session() as session:
+        for i in range(0, len(cells), _CHUNK):
+            stmt = select(PrayerSchedule).where(PrayerSchedule.cell.in_(cells[i:i + _CHUNK]),
+                                                PrayerSchedule.local_date.in_(dates))
+            for row in (await session.execute(stmt)).scalars():
+                key = (row.cell, row.local_date, row.method, row.utc_offset)
+                if key in wanted:
+                    found[key] = row
+    return found
+
+
+async def save_schedule(rows: list) -> None:
+    """Добавляет строки prayer_schedule (словари с колонками таблицы); существующие ключи не меняются."""
+    if not rows:
+        return
+
+    async def write(session):
+        await session.execute(sqlite_insert(PrayerSchedule).on_conflict_do_nothing(), rows)
+
+    await db_writer.write(write)
+
+
+async def get_schedule_horizon() -> dict:
+    """Возвращает {cell: последняя местная дата, на которую есть расписание}."""
+    async with Session() as session:
+        result = await session.execute(
+            select(PrayerSchedule.cell, func.max(PrayerSchedule.local_date)).group_by(PrayerSchedule.cell)
+        )
+        return dict(result.all())
+
+
+async def delete_schedule_before(day: date) -> int:
+    """Удаляет расписания на даты раньше day; возвращает количество строк."""
+    async def write(session) -> int:
+        result = await session.execute(delete(PrayerSchedule).where(PrayerSchedule.local_date < day))
+        return result.rowcount
+
+    return await db_writer.write(write)
+
+
+async def get_user_locations() -> list:
+    """Возвращает различные места пользователей: [(latitude, longitude, часовой пояс - см. user_tz)]."""
+    async with Session() as session:
+        result = await session.execute(
+            select(User.latitude, User.longitude, User.tz_name, User.timezone).distinct()
+        )
+        return [(lat, lon, tz_name or offset) for lat, lon, tz_name, offset in result.all()]
+
+
+async def init_shard_leases(shards: int = NOTIFIER_SHARDS) -> None:
+    """Создаёт строки аренды для всех шардов (существующие не трогает)."""
+    async def write(session):
+        await session.execute(sqlite_insert(ShardLease).on_conflict_do_nothing(),
+                              [{'shard': shard} for shard in range(shards)])
+
+    await db_writer.write(write)
+
+
+async def renew_leases(owner: str, expires_at: datetime) -> set:
+    """Отмечает воркер живым и продлевает его аренды; возвращает шарды, которые всё ещё за ним."""
+    heartbeat = sqlite_insert(WorkerHeartbeat).values(owner=owner, expires_at=_naive_utc(expires_at))
+    heartbeat = heartbeat.on_conflict_do_update(index_elements=[WorkerHeartbeat.owner],
+                                                set_={'expires_at': heartbeat.excluded.expires_at})
+    async def write(session) -> set:
+        await session.execute(heartbeat)
+        result = await session.execute(
+            update(ShardLease).where(ShardLease.owner == owner)
+            .values(expires_at=_naive_utc(expires_at)).returning(ShardLease.shard)
+        )
+        return set(result.scalars().all())
+
+    return await db_writer.write(write)
+
+
+async def get_lease_state(now: datetime) -> tuple:
+    """Возвращает (свободные или просроченные шарды, число живых воркеров)."""
+    now = _naive_utc(now)
+    async with Session() as session:
+        free = await session.execute(
+            select(ShardLease.shard).where(or_(ShardLease.owner.is_(None), ShardLease.expires_at <= now))
+            .order_by(ShardLease.shard)
+        )
+        workers = await session.execute(
+            select(func.count()).select_from(WorkerHeartbeat).where(WorkerHeartbeat.expires_at > now)
+        )
+        return free.scalars().all(), workers.scalar()
+
+
+async def count_live_workers(now: datetime) -> int:
+    """Число воркеров уведомлений, отметившихся живыми (аренда heartbeat не истекла)."""
+    async with Session() as session:
+        result = await session.execute(
+            select(func.count()).select_from(WorkerHeartbeat).where(WorkerHeartbeat.expires_at > _naive_utc(now))
+        )
+        return result.scalar()
+
+
+async def acquire_lease(shard: int, owner: str, now: datetime, expires_at: datetime) -> bool:
+    """Забирает шард, если он свободен или аренда просрочена (владелец упал)."""
+    async def write(session) -> bool:
+        result = await session.execute(
+            update(ShardLease)
+            .where(ShardLease.shard == shard,
+                   or_(ShardLease.owner.is_(None), ShardLease.expires_at <= _naive_utc(now)))
+            .values(owner=owner, expires_at=_naive_utc(expires_at))
+        )
+        return result.rowcount == 1
+
+    return await db_writer.write(write)
+
+
+async def release_leases(owner: str, shards=None) -> None:
+    """Освобождает аренды владельца; без shards - все, и воркер больше не считается живым."""
+    condition = ShardLease.owner == owner
+    if shards is not None:
+        condition = and_(condition, ShardLease.shard.in_(sorted(shards)))
+
+    async def write(session):
+        await session.execute(update(ShardLease).where(condition).values(owner=None, expires_at=None))
+        if shards is None:
+            await session.execute(delete(WorkerHeartbeat).where(WorkerHeartbeat.owner == owner))
+
+    await db_writer.write(write)
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from app.services import metrics
+from app.services.models import WriteSession
+from config import DB_FLUSH_INTERVAL, DB_WRITE_BATCH
+from logger import logger
+
+
+class DBWriter:
+    """
+    Единственный писатель SQLite в процессе.
+
+    Операции записи - async-функции operation(session), которые только выполняют запросы
+    (commit делает писатель). Они ставятся в очередь, и одна задача выполняет всё, что накопилось
+    за flush_interval секунд (не больше max_batch операций), одной транзакцией: один BEGIN IMMEDIATE,
+    один commit и одна запись в WAL на пачку вместо отдельной транзакции на каждого пользователя.
+    Каждая операция выполняется в своём SAVEPOINT: её ошибка откатывает только её и возвращается
+    вызывающему, остальные операции пачки записываются.
+
+    write(operation) возвращает результат операции после commit - данные уже в БД.
+    """
+
+    def __init__(self, flush_interval: float = DB_FLUSH_INTERVAL, max_batch: int = DB_WRITE_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+
+    def start(self) -> None:
+        # Задача прошлого цикла событий (повторный asyncio.run) уже завершена
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Записывает уже поставленные в очередь операции и останавливает писателя."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        logger.info('DB writer stopped')
+
+    def submit(self, operation) -> asyncio.Future:
+        """Ставит операцию в очередь; future получает её результат после commit."""
+        if self._task is None or self._task.done():
+            # Запуск вне бота (скрипты, бенчмарки) - писатель создаётся по требованию
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((operation, future))
+        metrics.DB_WRITE_QUEUE_SIZE.set(self._queue.qsize())
+        return future
+
+    async def write(self, operation):
+        """Выполняет операцию в ближайшей транзакции и ждёт её commit."""
+        return await self.submit(operation)
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            # Даём накопиться операциям, пришедшим почти одновременно
+            if self.flush_interval > 0:
+                await asyncio.sleep(self.flush_interval)
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            metrics.DB_WRITE_QUEUE_SIZE.set(self._queue.qsize())
+            await self._commit(batch)
+            if stopping:
+                # Операции, поставленные после сигнала остановки, тоже записываются
+                rest = []
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None:
+                        rest.append(item)
+                if rest:
+                    await self._commit(rest)
+                return
+
+    async def _commit(self, batch: list) -> None:
+        results = []
+        started = time.perf_counter()
+        try:
+            async with WriteSession() as session:
+                async with session.begin():
+                    for operation, _ in batch:
+                        try:
+                            async with session.begin_nested():
+                                results.append((True, await operation(session)))
+                        except Exception as e:
+                            results.append((False, e))
+        except Exception as e:
+            logger.exception(f'DB write transaction failed ({len(batch)} operations): {e}')
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        metrics.DB_WRITE_COMMIT_SECONDS.observe(time.perf_counter() - started)
+        metrics.DB_WRITE_BATCH_SIZE.observe(len(batch))
+        for (_, future), (ok, value) in zip(batch, results):
+            # Вызывающий мог перестать ждать - запись всё равно выполнена
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+db_writer = DBWriter()
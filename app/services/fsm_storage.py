@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from app.services import db
+from config import FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL, FSM_TTL
+from logger import logger
+
+# Как часто удалять из БД брошенные состояния (сек)
+CLEANUP_INTERVAL = 3600
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'updated')
+
+    def __init__(self, state: Optional[str] = None, data: dict = None, updated: datetime = None):
+        self.state = state
+        self.data = data or {}
+        self.updated = updated or datetime.now(timezone.utc)
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM aiogram в таблице fsm_states.
+
+    Чтение и запись идут через кэш в памяти (LRU на cache_size записей): запись в БД
+    откладывается и выполняется пачкой раз в flush_interval секунд (write-behind),
+    промах кэша читает одну строку из БД. Состояния, не менявшиеся дольше ttl секунд,
+    считаются брошенными: не читаются и периодически удаляются из БД.
+    Перед остановкой бота нужно вызвать close() - несохранённые изменения записываются.
+    """
+
+    def __init__(self, cache_size: int = FSM_CACHE_SIZE, flush_interval: float = FSM_FLUSH_INTERVAL,
+                 ttl: float = FSM_TTL, key_builder: KeyBuilder = None):
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.ttl = timedelta(seconds=ttl)
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: OrderedDict = OrderedDict()
+        self._dirty = set()
+        self._task: asyncio.Task = None
+        self._last_cleanup = 0.0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def _expired(self, record: _Record) -> bool:
+        return record.updated < datetime.now(timezone.utc) - self.ttl
+
+    async def _get(self, key: StorageKey) -> _Record:
+        db_key = self.key_builder.build(key)
+        record = self._cache.get(db_key)
+        if record is None:
+            row = await db.get_fsm_record(db_key, datetime.now(timezone.utc) - self.ttl)
+            # Пока шёл запрос, запись могла появиться в кэше
+            record = self._cache.get(db_key)
+            if record is None:
+                if row is None:
+                    record = _Record()
+                else:
+                    state, data, updated = row
+                    record = _Record(state, json.loads(data) if data else {}, updated.replace(tzinfo=timezone.utc))
+                self._remember(db_key, record)
+        elif self._expired(record):
+            record.state, record.data = None, {}
+        self._cache.move_to_end(db_key)
+        return record
+
+    def _remember(self, db_key: str, record: _Record) -> None:
+        self._cache[db_key] = record
+        self._cache.move_to_end(db_key)
+        self._trim()
+
+    def _trim(self) -> None:
+        if len(self._cache) <= self.cache_size:
+            return
+        # Вытесняем давно не используемые записи, кроме ещё не сохранённых в БД и самой свежей
+        newest = next(reversed(self._cache))
+        for old_key in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if old_key not in self._dirty and old_key != newest:
+                del self._cache[old_key]
+
+    def _touch(self, key: StorageKey, record: _Record) -> None:
+        record.updated = datetime.now(timezone.utc)
+        self._dirty.add(self.key_builder.build(key))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = await self._get(key)
+        record.data = data.copy()
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._get(key)).data.copy()
+
+    async def flush(self) -> int:
+        """Записывает изменённые записи в БД одной транзакцией; возвращает их количество."""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        upserts = []
+        deleted = []
+        for db_key in dirty:
+            record = self._cache.get(db_key)
+            if record is None or record.empty:
+                deleted.append(db_key)
+            else:
+                upserts.append({
+                    'key': db_key,
+                    'state': record.state,
+                    'data': json.dumps(record.data, ensure_ascii=False, default=str),
+                    'updated_at': record.updated.replace(tzinfo=None),
+                })
+        try:
+            await db.save_fsm_records(upserts, deleted)
+        except Exception as e:
+            # Повторим при следующем сбросе
+            self._dirty |= dirty
+            logger.exception(f"FSM storage flush failed: {e}")
+            return 0
+        self._trim()
+        return len(dirty)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+                self._last_cleanup = time.monotonic()
+                try:
+                    removed = await db.delete_expired_fsm_records(datetime.now(timezone.utc) - self.ttl)
+                    if removed:
+                        logger.info(f"FSM storage: removed {removed} expired states")
+                except Exception as e:
+                    logger.exception(f"FSM storage cleanup failed: {e}")
+                # Брошенные состояния вытесняются и из памяти
+                for db_key in [k for k, r in self._cache.items() if k not in self._dirty and self._expired(r)]:
+                    del self._cache[db_key]
@@ -0,0 +1,270 @@
+"""
+Офлайн-справочник населённых пунктов (GeoNames) для поиска города без обращения к TomTom.
+
+Индекс строится один раз из выгрузки GeoNames (cities15000.txt, cities5000.txt, ...):
+
+    python -m app.services.gazetteer build cities15000.txt gazetteer.idx \
+        [--admin1 admin1CodesASCII.txt] [--countries countryInfo.txt]
+
+и открывается через mmap: в памяти процесса ничего не копируется, поиск по префиксу -
+двоичный поиск по отсортированной таблице нормализованных названий.
+
+Формат файла (little-endian):
+    заголовок   '<4sIIIII'   magic, число городов, число ключей, смещения таблиц городов, ключей и строк
+    город       '<ffIIH2x'   lat, lon, население, смещение и длина строки 'регион, страна'
+    ключ        '<IHIHI'     смещение и длина нормализованного названия, смещение и длина исходного
+                             названия, номер города; ключи отсортированы по (название, -население)
+    строки      UTF-8
+"""
+import argparse
+import mmap
+import struct
+import unicodedata
+from bisect import bisect_left
+
+from logger import logger
+
+MAGIC = b'GAZ1'
+HEADER = struct.Struct('<4sIIIII')
+CITY = struct.Struct('<ffIIH2x')
+KEY = struct.Struct('<IHIHI')
+
+MAX_KEY_BYTES = 64
+# Сколько ключей с подходящим префиксом просматривать (короткие префиксы вроде "м" совпадают с тысячами)
+MAX_SCAN = 2000
+# Во сколько раз самый крупный город с точным совпадением названия должен превосходить следующий,
+# чтобы считаться однозначным ответом ("Москва" - Россия, а не Айдахо)
+DOMINANCE = 10
+
+
+def normalize(text: str) -> str:
+    """Название для сравнения: без регистра, диакритики ('ё' -> 'е', 'é' -> 'e') и лишних пробелов."""
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(stripped.replace('-', ' ').split())
+
+
+class _Keys:
+    """Последовательность нормализованных названий из mmap для bisect."""
+
+    def __init__(self, gazetteer: 'Gazetteer'):
+        self._gazetteer = gazetteer
+
+    def __len__(self) -> int:
+        return self._gazetteer.n_keys
+
+    def __getitem__(self, index: int) -> bytes:
+        return self._gazetteer.key_bytes(index)
+
+
+class Gazetteer:
+    """Индекс городов, открытый через mmap (см. формат в описании модуля)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_cities, self.n_keys, self._cities_off, self._keys_off, self._strings_off = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f'{path}: not a gazetteer index')
+        self._keys = _Keys(self)
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def _string(self, offset: int, length: int) -> bytes:
+        start = self._strings_off + offset
+        return self._mm[start:start + length]
+
+    def _key(self, index: int) -> tuple:
+        return KEY.unpack_from(self._mm, self._keys_off + index * KEY.size)
+
+    def key_bytes(self, index: int) -> bytes:
+        key_off, key_len, *_ = self._key(index)
+        return self._string(key_off, key_len)
+
+    def city(self, index: int, name: str) -> dict:
+        lat, lon, population, region_off, region_len = CITY.unpack_from(
+            self._mm, self._cities_off + index * CITY.size)
+        # Название - так, как его ввёл пользователь (например, по-русски), дальше регион и страна
+        region = self._string(region_off, region_len).decode('utf-8')
+        display_name = f'{name}, {region}' if region else name
+        return {'display_name': display_name, 'lat': round(lat, 5), 'lon': round(lon, 5), 'population': population}
+
+    def _matches(self, prefix: bytes) -> list:
+        """Города, у которых какое-либо название начинается с prefix: [(город, название, точное совпадение)]."""
+        found = {}
+        start = bisect_left(self._keys, prefix)
+        for index in range(start, min(start + MAX_SCAN, self.n_keys)):
+            key_off, key_len, name_off, name_len, city = self._key(index)
+            key = self._string(key_off, key_len)
+            if not key.startswith(prefix):
+                break
+            exact = key == prefix
+            if city not in found or (exact and not found[city][1]):
+                found[city] = (self._string(name_off, name_len).decode('utf-8'), exact)
+        return [(city, name, exact) for city, (name, exact) in found.items()]
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """
+        Подсказки по префиксу: города, отсортированные по населению.
+        Уточнение через запятую ("Казань, Татарстан") фильтрует по региону и стране.
+        """
+        name, *qualifiers = [normalize(part) for part in query.split(',')]
+        if not name:
+            return []
+        qualifiers = [q for q in qualifiers if q]
+        results = []
+        for city, matched_name, exact in self._matches(name.encode('utf-8')[:MAX_KEY_BYTES]):
+            item = self.city(city, matched_name)
+            if qualifiers:
+                region = normalize(item['display_name'])
+                if not all(q in region for q in qualifiers):
+                    continue
+            item['exact'] = exact
+            results.append(item)
+        results.sort(key=lambda item: (not item['exact'], -item['population']))
+        return results[:limit]
+
+    def geocode(self, query: str) -> dict:
+        """
+        Поиск города в формате get_loc_geocode: {'status', 'display_name', 'lat', 'lon'}.
+        status: 'Success' - однозначный результат, 'Multiple' - несколько вариантов, None - ничего не найдено.
+        """
+        candidates = self.search(query, limit=MAX_SCAN)
+        exact = [item for item in candidates if item['exact']]
+        if exact:
+            candidates = exact
+        if not candidates:
+            return {'status': None}
+        if len(candidates) > 1 and candidates[0]['population'] < DOMINANCE * max(candidates[1]['population'], 1):
+            return {'status': 'Multiple'}
+        best = candidates[0]
+        return {'status': 'Success', 'display_name': best['display_name'], 'lat': best['lat'], 'lon': best['lon']}
+
+
+def _read_codes(path: str, key_columns: int, name_column: int) -> dict:
+    codes = {}
+    if not path:
+        return codes
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) > name_column:
+                codes['.'.join(cols[:key_columns])] = cols[name_column]
+    return codes
+
+
+def _names(cols: list) -> set:
+    names = {cols[1], cols[2]}
+    for alt in cols[3].split(','):
+        # Альтернативные названия GeoNames содержат коды аэропортов и ссылки - их пропускаем
+        if not alt or alt.startswith('http') or (len(alt) <= 4 and alt.isupper()):
+            continue
+        names.add(alt)
+    return {name for name in names if name}
+
+
+def build_index(cities_path: str, index_path: str, admin1_path: str = None, countries_path: str = None) -> int:
+    """
+    Строит файл индекса из выгрузки GeoNames.
+
+    :param admin1_path: admin1CodesASCII.txt - названия регионов для display_name (необязательно)
+    :param countries_path: countryInfo.txt - названия стран (иначе используется код страны)
+    :return: количество городов в индексе
+    """
+    admin1 = _read_codes(admin1_path, 1, 1)
+    countries = _read_codes(countries_path, 1, 4)
+    strings = bytearray()
+    interned = {}
+
+    def intern(data: bytes) -> tuple:
+        # Одинаковые строки (регионы, названия) хранятся один раз
+        if data not in interned:
+            interned[data] = len(strings)
+            strings.extend(data)
+        return interned[data], len(data)
+
+    cities = []
+    keys = []
+    with open(cities_path, encoding='utf-8') as f:
+        for line in f:
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) < 15 or cols[6] != 'P':
+                continue
+            country = cols[8]
+            parts = [admin1.get(f'{country}.{cols[10]}'), countries.get(country, country)]
+            region = ', '.join(dict.fromkeys(part for part in parts if part))
+            population = int(cols[14] or 0)
+            index = len(cities)
+            cities.append((float(cols[4]), float(cols[5]), population, *intern(region.encode('utf-8'))))
+            for name in _names(cols):
+                key = normalize(name).encode('utf-8')[:MAX_KEY_BYTES]
+                if key:
+                    keys.append((key, -population, name, index))
+
+    keys.sort()
+    # Одно и то же название города встречается среди альтернативных несколько раз
+    unique = []
+    for key, _, name, index in keys:
+        if unique and unique[-1][0] == key and unique[-1][3] == index:
+            continue
+        unique.append((key, None, name, index))
+
+    key_table = bytearray()
+    for key, _, name, index in unique:
+        key_table.extend(KEY.pack(*intern(key), *intern(name.encode('utf-8')), index))
+
+    city_table = b''.join(CITY.pack(*city) for city in cities)
+    cities_off = HEADER.size
+    keys_off = cities_off + len(city_table)
+    strings_off = keys_off + len(key_table)
+    with open(index_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(cities), len(unique), cities_off, keys_off, strings_off))
+        f.write(city_table)
+        f.write(key_table)
+        f.write(strings)
+    logger.info(f'Gazetteer index {index_path}: {len(cities)} cities, {len(unique)} names')
+    return len(cities)
+
+
+gazetteer: Gazetteer = None
+
+
+def load_gazetteer(path: str):
+    """Открывает индекс при старте бота; без файла поиск городов идёт только через TomTom."""
+    global gazetteer
+    if gazetteer is not None:
+        return gazetteer
+    try:
+        gazetteer = Gazetteer(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f'Gazetteer is not available ({e}), city search uses TomTom only')
+        return None
+    logger.info(f'Gazetteer loaded: {gazetteer.n_cities} cities, {gazetteer.n_keys} names')
+    return gazetteer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='GeoNames gazetteer index')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='build an index from a GeoNames cities dump')
+    build.add_argument('cities')
+    build.add_argument('index')
+    build.add_argument('--admin1')
+    build.add_argument('--countries')
+    find = sub.add_parser('search', help='prefix search in an index')
+    find.add_argument('index')
+    find.add_argument('query')
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_index(args.cities, args.index, args.admin1, args.countries)
+    else:
+        g = Gazetteer(args.index)
+        for item in g.search(args.query):
+            print(item)
+        print(g.geocode(args.query))
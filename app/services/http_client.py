@@ -0,0 +1,98 @@
+import asyncio
+import random
+import time
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from yarl import URL
+
+from app.services import metrics
+from config import HTTP_LIMIT_PER_HOST, HTTP_POOL_LIMIT, HTTP_RETRIES, HTTP_TIMEOUT
+from logger import logger
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpError(Exception):
+    """Запрос к внешнему API не удался (после всех повторов)."""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+def backoff_delay(attempt: int, base: float = 0.3, cap: float = 5.0) -> float:
+    """Экспоненциальная задержка с полным джиттером: random(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class HttpClient:
+    """
+    Общий HTTP-клиент для внешних API (геокодер TomTom).
+
+    Одна ClientSession на весь процесс: keep-alive пул соединений, кэш DNS,
+    ограничение одновременных соединений на хост, таймауты и повторы с backoff.
+    Создаётся при старте бота (start) и закрывается при остановке (close).
+    """
+
+    def __init__(self, limit: int = HTTP_POOL_LIMIT, limit_per_host: int = HTTP_LIMIT_PER_HOST,
+                 timeout: float = HTTP_TIMEOUT, retries: int = HTTP_RETRIES):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self._session: ClientSession = None
+
+    async def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+        connector = TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        self._session = ClientSession(connector=connector, timeout=ClientTimeout(total=self.timeout))
+        logger.info('HTTP client started')
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info('HTTP client closed')
+        self._session = None
+
+    async def get_json(self, url: str, params: dict = None, retries: int = None):
+        """
+        GET-запрос с разбором JSON.
+        Сетевые ошибки, таймауты и статусы из RETRY_STATUSES повторяются с экспоненциальной задержкой.
+
+        :raises HttpError: если ответ так и не получен или статус не 200
+        """
+        if self._session is None or self._session.closed:
+            # Запуск вне бота (скрипты, отладка) - создаём сессию по требованию
+            await self.start()
+        retries = self.retries if retries is None else retries
+        host = URL(url).host
+        last_error = None
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            try:
+                async with self._session.get(url, params=params) as resp:
+                    if resp.status == 200:
+                        data = await resp.json(content_type=None)
+                        metrics.EXTERNAL_API_SECONDS.observe(time.perf_counter() - started, host=host)
+                        return data
+                    metrics.EXTERNAL_API_ERRORS.inc(host=host, reason=str(resp.status))
+                    if resp.status not in RETRY_STATUSES:
+                        raise HttpError(f'{url}: HTTP {resp.status}', resp.status)
+                    last_error = HttpError(f'{url}: HTTP {resp.status}', resp.status)
+            except (ClientError, asyncio.TimeoutError) as e:
+                metrics.EXTERNAL_API_ERRORS.inc(
+                    host=host, reason='timeout' if isinstance(e, asyncio.TimeoutError) else type(e).__name__)
+                last_error = HttpError(f'{url}: {e!r}')
+            if attempt < retries:
+                await asyncio.sleep(backoff_delay(attempt))
+        raise last_error
+
+
+http_client = HttpClient()
@@ -1,12 +1,28 @@
-from geopy.adapters import AioHTTPAdapter
-from geopy.geocoders import TomTom
+from urllib.parse import quote
 
-from config import TOMTOM_API_KEY
+from app.services import db, gazetteer, metrics
+from app.services.http_client import HttpError, http_client
+from app.services.cache import TTLCache
+from app.services.timezones import utc_offset_hours
+from config import GEOCODE_CACHE_TTL, GEOCODE_MEMORY_SIZE, GEOCODE_NEGATIVE_TTL, TOMTOM_API_KEY, ZONE_CACHE_SIZE, \
+    ZONE_CACHE_TTL
 import asyncio
-from datetime import datetime
-import pytz
+from datetime import datetime, timedelta, timezone
 from timezonefinder import TimezoneFinder
 
+from logger import logger
+
+TOMTOM_GEOCODE_URL = 'https://api.tomtom.com/search/2/geocode/{query}.json'
+
+# Общий на процесс TimezoneFinder (см. preload_timezone_finder) и кэш "ячейка координат -> зона IANA"
+TZ_CACHE_PRECISION = 2
+_timezone_finder: TimezoneFinder = None
+zone_cache = TTLCache(maxsize=ZONE_CACHE_SIZE, ttl=ZONE_CACHE_TTL)
+# Горячие запросы геокодера ("москва", "казань") - без обращения к БД
+geocode_cache = TTLCache(maxsize=GEOCODE_MEMORY_SIZE, ttl=GEOCODE_CACHE_TTL)
+metrics.register_cache('zone', zone_cache)
+metrics.register_cache('geocode', geocode_cache)
+
 async def format_location(location: dict) -> dict:
     """
     :param location: raw location dictionary
@@ -23,7 +39,49 @@ async def format_location(location: dict) -> dict:
     return {'display_name': display_name, 'lat': location['position']['lat'], 'lon': location['position']['lon']}
 
 
+def normalize_query(address: str) -> str:
+    """Ключ кэша геокодера: регистр, 'ё' и лишние пробелы не влияют на результат поиска."""
+    return ' '.join(address.casefold().replace('ё', 'е').split())
+
+
 async def get_loc_geocode(address: str) -> dict:
+    """
+    Поиск города: сначала офлайн-справочник GeoNames (см. gazetteer), если он загружен и что-то нашёл;
+    иначе геокодирование TomTom с кэшем: память (LRU) -> таблица geocode_cache -> запрос к API.
+    Найденные результаты хранятся GEOCODE_CACHE_TTL, "ничего не найдено" - GEOCODE_NEGATIVE_TTL,
+    ошибки не кэшируются.
+
+    :return: см. fetch_loc_geocode
+    """
+    if gazetteer.gazetteer is not None:
+        response = gazetteer.gazetteer.geocode(address)
+        if response['status'] is not None:
+            return response
+
+    query = normalize_query(address)
+    response = geocode_cache.get(query)
+    if response is not None:
+        return dict(response)
+
+    now = datetime.now(timezone.utc)
+    cached = await db.get_geocode(query, now)
+    if cached is not None:
+        response, expires_at = cached
+        geocode_cache.set(query, response, ttl=(expires_at - now.replace(tzinfo=None)).total_seconds())
+        return dict(response)
+
+    response = await fetch_loc_geocode(address)
+    if response['status'] != 'Error':
+        ttl = GEOCODE_NEGATIVE_TTL if response['status'] is None else GEOCODE_CACHE_TTL
+        geocode_cache.set(query, dict(response), ttl=ttl)
+        try:
+            await db.save_geocode(query, response, now + timedelta(seconds=ttl))
+        except Exception as e:
+            logger.warning(f"Ошибка при сохранении кэша геокодера: {e}")
+    return response
+
+
+async def fetch_loc_geocode(address: str) -> dict:
     """
     :param address: The address or query you wish to geocode.
     :return: status:
@@ -36,16 +94,19 @@ async def get_loc_geocode(address: str) -> dict:
             lon
     """
     response = {'status': None}
-    async with TomTom(TOMTOM_API_KEY, adapter_factory=AioHTTPAdapter) as locator:
-        try:
-            find_locations = await locator.geocode(address, exactly_one=False, typeahead=True)
-        except Exception as e:
-            print(e)
-            find_locations = None
-            response['status'] = 'Error'
+    # Запрос через общий HTTP-клиент (пул соединений, повторы с backoff)
+    url = TOMTOM_GEOCODE_URL.format(query=quote(address.encode('utf-8')))
+    params = {'key': TOMTOM_API_KEY or '', 'typeahead': 'true'}
+    try:
+        data = await http_client.get_json(url, params=params)
+        find_locations = data.get('results') or []
+    except (HttpError, AttributeError) as e:
+        logger.warning(f"Geocoding failed: {e}")
+        find_locations = None
+        response['status'] = 'Error'
     if find_locations is not None:
-        locations = [loc for x in find_locations if
-                     (loc := x.raw)['type'] == 'Geography' and loc['entityType'] == 'Municipality']
+        locations = [loc for loc in find_locations if
+                     loc.get('type') == 'Geography' and loc.get('entityType') == 'Municipality']
         count = len(locations)
         if count == 1:
             response['status'] = 'Success'
@@ -55,37 +116,55 @@ async def get_loc_geocode(address: str) -> dict:
     return response
 
 
-async def get_loc_timezone(lat: float, lon: float) -> int:
+def preload_timezone_finder() -> TimezoneFinder:
+    """Загружает полигоны часовых поясов в память один раз на процесс (вызывается при старте бота)."""
+    global _timezone_finder
+    if _timezone_finder is None:
+        _timezone_finder = TimezoneFinder(in_memory=True)
+    return _timezone_finder
+
+
+async def get_loc_zone(lat: float, lon: float):
     """
     :param lat: Latitude. min/max: -90 to +90
     :param lon: Longitude. min/max: -180 to +180
-    :return: time zone offset in hours (integer, fractional part is truncated)
-             or False if timezone cannot be determined.
+    :return: IANA time zone name (e.g. 'Europe/Moscow') or False if timezone cannot be determined.
     """
-    tf = TimezoneFinder()
+    # Мемоизация по ячейке координат ~1 км: соседние точки почти всегда в одной зоне
+    key = (round(lat, TZ_CACHE_PRECISION), round(lon, TZ_CACHE_PRECISION))
+    timezone_str = zone_cache.get(key)
+    if timezone_str is not None:
+        return timezone_str
+    if _timezone_finder is None:
+        await asyncio.to_thread(preload_timezone_finder)
     try:
-        # Поиск названия временной зоны по координатам (синхронный вызов в потоке)
-        timezone_str = await asyncio.to_thread(tf.timezone_at, lng=lon, lat=lat)
+        # Поиск названия временной зоны по координатам (полигоны уже в памяти, поиск - микросекунды)
+        timezone_str = _timezone_finder.timezone_at(lng=lon, lat=lat)
     except Exception as e:
-        print(f"Ошибка при поиске временной зоны: {e}")
+        logger.warning(f"Ошибка при поиске временной зоны: {e}")
         return False
 
     if timezone_str is None:
         # Например, координаты в океане
         return False
+    zone_cache.set(key, timezone_str)
+    return timezone_str
 
+
+async def get_loc_timezone(lat: float, lon: float):
+    """
+    :param lat: Latitude. min/max: -90 to +90
+    :param lon: Longitude. min/max: -180 to +180
+    :return: current time zone offset in hours (float, e.g. 5.5 for India)
+             or False if timezone cannot be determined.
+    """
+    timezone_str = await get_loc_zone(lat, lon)
+    if not timezone_str:
+        return False
     try:
-        tz = pytz.timezone(timezone_str)
-        # Текущее время в этой зоне (с учётом летнего времени)
-        now = datetime.now(tz)
-        offset = now.utcoffset()
-        if offset is None:
-            return False
-        # Перевод timedelta в часы (целое число, отбрасывая дробную часть)
-        offset_hours = int(offset.total_seconds() / 3600)
-        return offset_hours
+        return utc_offset_hours(timezone_str)
     except Exception as e:
-        print(f"Ошибка при получении смещения: {e}")
+        logger.warning(f"Ошибка при получении смещения: {e}")
         return False
 
 if __name__ == '__main__':
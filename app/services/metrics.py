@@ -0,0 +1,195 @@
+"""
+Счётчики и гистограммы в текстовом формате Prometheus (без внешних зависимостей).
+
+Метрики регистрируются при импорте модуля и отдаются на http://METRICS_HOST:METRICS_PORT/metrics
+(см. start_metrics_server). Метки передаются именованными аргументами: MESSAGES.inc(kind='alarm').
+"""
+import bisect
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+from sqlalchemy import event
+
+from logger import logger
+
+_registry = []
+
+# Границы по умолчанию, секунды: от миллисекунд (запросы к БД) до минут (задержка уведомлений)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield self.name, _format_labels(self.labels, key), value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{name}{labels} {value}' for name, labels, value in self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение; можно задать функцией, которая вызывается при каждом чтении метрик."""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), function=None):
+        super().__init__(name, documentation, labels)
+        self._function = function
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self._function is not None:
+            # function() -> {кортеж значений меток: значение}
+            self._values = dict(self._function())
+        return super()._samples()
+
+
+class CallbackCounter(Gauge):
+    """Счётчик, который ведётся в другом объекте (например, TTLCache.hits) и читается функцией."""
+    type = 'counter'
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [счётчики по корзинам..., сумма, количество]
+            state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def totals(self) -> dict:
+        """{кортеж значений меток: (количество наблюдений, сумма)}."""
+        return {key: (state[-1], state[-2]) for key, state in self._values.items()}
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f'{self.name}_bucket', _format_labels(self.labels, key, f'le="{bound}"'), cumulative
+            yield f'{self.name}_bucket', _format_labels(self.labels, key, 'le="+Inf"'), state[-1]
+            yield f'{self.name}_sum', _format_labels(self.labels, key), state[-2]
+            yield f'{self.name}_count', _format_labels(self.labels, key), state[-1]
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+# Уведомления
+NOTIFIER_TICK_SECONDS = Histogram('notifier_tick_seconds', 'Duration of a check_notifications call')
+NOTIFIER_EVENTS_SCANNED = Counter('notifier_events_scanned_total', 'Prayer events checked by check_notifications')
+NOTIFIER_MESSAGES = Counter('notifier_messages_total', 'Notifications by kind and result', ('kind', 'result'))
+NOTIFIER_LAG_SECONDS = Histogram('notifier_delivery_lag_seconds', 'Delay between due time and delivery',
+                                 ('kind', 'prayer'))
+# Смена даты
+ROLLOVER_RUN_SECONDS = Histogram('rollover_run_seconds', 'Duration of an hourly_date_check run')
+ROLLOVER_NOTICES = Counter('rollover_notices_total', 'Date change notices by delivery result', ('result',))
+ROLLOVER_USERS = Counter('rollover_users_total', 'Users handled by date rollover by result', ('result',))
+# Внешние API и БД
+EXTERNAL_API_SECONDS = Histogram('external_api_request_seconds', 'External API request latency', ('host',))
+EXTERNAL_API_ERRORS = Counter('external_api_errors_total', 'Failed external API attempts', ('host', 'reason'))
+DB_QUERY_SECONDS = Histogram('db_query_seconds', 'SQL statement execution time', ('statement',))
+DB_WRITE_BATCH_SIZE = Histogram('db_write_batch_size', 'Write operations committed in one transaction',
+                                buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+DB_WRITE_COMMIT_SECONDS = Histogram('db_write_commit_seconds', 'Duration of a batched write transaction')
+DB_WRITE_QUEUE_SIZE = Gauge('db_write_queue_size', 'Write operations waiting for the writer')
+# Очередь сообщений
+OUTBOX_MESSAGES = Counter('outbox_messages_total', 'Telegram API calls made by the outbox', ('result',))
+OUTBOX_QUEUE_SIZE = Gauge('outbox_queue_size', 'Messages waiting in the outbox queue')
+OUTBOX_RATE_LIMIT = Gauge('outbox_rate_limit', 'Messages per second this process may send')
+
+
+def register_cache(name: str, cache) -> None:
+    """Метрики попаданий и промахов TTLCache."""
+    CallbackCounter(f'cache_{name}_hits_total', f'Hits of the {name} cache', function=lambda: {(): cache.hits})
+    CallbackCounter(f'cache_{name}_misses_total', f'Misses of the {name} cache', function=lambda: {(): cache.misses})
+    Gauge(f'cache_{name}_size', f'Entries in the {name} cache', function=lambda: {(): len(cache)})
+
+
+def instrument_engine(engine) -> None:
+    """Время выполнения SQL-запросов (по типу запроса) через события SQLAlchemy."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement=statement.split(None, 1)[0].upper())
+
+
+async def _handle(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """
+    Запускает HTTP-сервер с /metrics; возвращает runner для остановки (runner.cleanup)
+    или None, если порт занят - работа процесса от метрик не зависит.
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', _handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=host, port=port).start()
+    except OSError as e:
+        logger.warning(f'Metrics server is not started on {host}:{port}: {e}')
+        await runner.cleanup()
+        return None
+    logger.info(f'Metrics available at http://{host}:{port}/metrics')
+    return runner
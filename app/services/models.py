@@ -1,10 +1,49 @@
-from sqlalchemy import Column, Integer, String, Float, BigInteger, DateTime, Boolean, Date
+from sqlalchemy import Column, Integer, String, Float, BigInteger, DateTime, Boolean, Date, Index, Text, \
+    PrimaryKeyConstraint, UniqueConstraint, event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
 
-DB_URL = "sqlite+aiosqlite:///db.sqlite3"
-engine = create_async_engine(DB_URL, echo=False)
-Session = async_sessionmaker(engine, expire_on_commit=False)
+from app.services import metrics
+from config import DB_BUSY_TIMEOUT, DB_READ_CONNECTIONS, DB_SYNCHRONOUS, DB_URL
+
+# Запись - через одно соединение (им пользуется только db_writer, а также создание таблиц),
+# чтение - через отдельный пул соединений только для чтения: в режиме WAL читатели не ждут писателя
+engine = create_async_engine(DB_URL, echo=False, pool_size=1, max_overflow=0)
+read_engine = create_async_engine(DB_URL, echo=False, pool_size=DB_READ_CONNECTIONS,
+                                  max_overflow=DB_READ_CONNECTIONS)
+WriteSession = async_sessionmaker(engine, expire_on_commit=False)
+Session = async_sessionmaker(read_engine, expire_on_commit=False)
+
+
+def _setup_connection(engine, readonly: bool) -> None:
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        # Транзакции начинаем сами (см. _begin): иначе драйвер sqlite3 ломает SAVEPOINT
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+        cursor.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.execute('PRAGMA cache_size = -16000')
+        if readonly:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+    @event.listens_for(sync_engine, 'begin')
+    def _begin(conn):
+        # Писатель сразу берёт блокировку записи: транзакция не упадёт посередине из-за другого процесса
+        conn.exec_driver_sql('BEGIN' if readonly else 'BEGIN IMMEDIATE')
+
+    metrics.instrument_engine(engine)
+
+
+_setup_connection(engine, readonly=False)
+_setup_connection(read_engine, readonly=True)
+
+PRAYERS = ('fajr', 'sunrise', 'dhuhr', 'asr', 'maghrib', 'isha')
 
 
 class Base(DeclarativeBase, AsyncAttrs):
@@ -19,28 +58,175 @@ class User(Base):
     city_name = Column(String, nullable=False)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
-    timezone = Column(Integer, nullable=False)
-    time_fajr = Column(DateTime, nullable=True)
-    alarm_fajr = Column(Boolean, default=False)
-    push_fajr = Column(Boolean, default=False)
-    time_sunrise = Column(DateTime, nullable=True)
-    alarm_sunrise = Column(Boolean, default=False)
-    push_sunrise = Column(Boolean, default=False)
-    time_dhuhr = Column(DateTime, nullable=True)
-    alarm_dhuhr = Column(Boolean, default=False)
-    push_dhuhr = Column(Boolean, default=False)
-    time_asr = Column(DateTime, nullable=True)
-    alarm_asr = Column(Boolean, default=False)
-    push_asr = Column(Boolean, default=False)
-    time_maghrib = Column(DateTime, nullable=True)
-    alarm_maghrib = Column(Boolean, default=False)
-    push_maghrib = Column(Boolean, default=False)
-    time_isha = Column(DateTime, nullable=True)
-    alarm_isha = Column(Boolean, default=False)
-    push_isha = Column(Boolean, default=False)
+    # Смещение от UTC в часах на момент выбора города; используется, только если tz_name не известен
+    timezone = Column(Float, nullable=False)
+    # Имя зоны IANA ('Europe/Moscow'): смещение считается на каждую дату с учётом летнего времени
+    tz_name = Column(String, nullable=True)
+    # Местная дата, на которую записано текущее расписание (prayer_events)
     date_now = Column(Date, nullable=True)
 
+    __table_args__ = (
+        # Поиск пользователей, у которых сменилась местная дата (по каждому часовому поясу)
+        Index('ix_users_timezone_date_now', 'timezone', 'date_now'),
+        Index('ix_users_tz_name_date_now', 'tz_name', 'date_now'),
+    )
+
+
+class PrayerEvent(Base):
+    """Один намаз пользователя на одну местную дату и флаги отправленных уведомлений."""
+    __tablename__ = "prayer_events"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=False)
+    prayer = Column(String, nullable=False)  # 'fajr', 'sunrise', ... (см. PRAYERS)
+    utc_time = Column(DateTime, nullable=False)
+    alarm_sent = Column(Boolean, default=False, nullable=False)
+    push_sent = Column(Boolean, default=False, nullable=False)
+    local_date = Column(Date, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'local_date', 'prayer', name='uq_prayer_events_user_date_prayer'),
+        Index('ix_prayer_events_utc_time', 'utc_time'),
+        # Окна уведомлений: неотправленный флаг + диапазон времени
+        Index('ix_prayer_events_alarm_sent_utc_time', 'alarm_sent', 'utc_time'),
+        Index('ix_prayer_events_push_sent_utc_time', 'push_sent', 'utc_time'),
+        # id не переиспользуются после удаления строк: воркеры находят новые события по id > последнего
+        # (db.get_new_events), а без AUTOINCREMENT SQLite выдаёт освободившиеся максимальные id повторно
+        {'sqlite_autoincrement': True},
+    )
+
+
+class PrayerSchedule(Base):
+    """
+    Расписание намазов по ячейке H3 на местную дату (местное время 'HH:MM', None - время не наступает).
+    Заполняется сразу на месяц вперёд для каждого места (см. namaz_api.fill_schedule).
+    """
+    __tablename__ = "prayer_schedule"
+
+    cell = Column(String, nullable=False)
+    local_date = Column(Date, nullable=False)
+    method = Column(Integer, nullable=False)
+    utc_offset = Column(Float, nullable=False)
+    fajr = Column(String, nullable=True)
+    sunrise = Column(String, nullable=True)
+    dhuhr = Column(String, nullable=True)
+    asr = Column(String, nullable=True)
+    maghrib = Column(String, nullable=True)
+    isha = Column(String, nullable=True)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('cell', 'local_date', 'method', 'utc_offset'),
+        Index('ix_prayer_schedule_local_date', 'local_date'),
+    )
+
+
+class ShardLease(Base):
+    """Аренда шарда пользователей (user_id % NOTIFIER_SHARDS) воркером уведомлений (см. shards.ShardLeases)."""
+    __tablename__ = "shard_leases"
+
+    shard = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+
+
+class WorkerHeartbeat(Base):
+    """Живые воркеры уведомлений: по их числу шарды делятся поровну."""
+    __tablename__ = "workers"
+
+    owner = Column(String, primary_key=True)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class GeocodeResult(Base):
+    """Кэш ответов геокодера: нормализованный запрос -> результат get_loc_geocode."""
+    __tablename__ = "geocode_cache"
+
+    query = Column(String, primary_key=True)
+    status = Column(String, nullable=True)  # 'Success' / 'Multiple' / None - ничего не найдено
+    display_name = Column(String, nullable=True)
+    lat = Column(Float, nullable=True)
+    lon = Column(Float, nullable=True)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_geocode_cache_expires_at', 'expires_at'),
+    )
+
+
+class FsmRecord(Base):
+    """Состояние FSM aiogram (см. fsm_storage.SQLiteStorage): ключ чата/пользователя -> состояние и данные."""
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_fsm_states_updated_at', 'updated_at'),
+    )
+
+
+def _migrate_prayer_columns(conn) -> None:
+    """
+    Миграция со старой схемы: 18 колонок time_*/alarm_*/push_* в users -> строки prayer_events.
+    После переноса колонки и их индексы удаляются (DROP COLUMN требует SQLite >= 3.35).
+    """
+    columns = {c['name'] for c in inspect(conn).get_columns('users')}
+    legacy = [p for p in PRAYERS if f'time_{p}' in columns]
+    if not legacy:
+        return
+    for prayer in legacy:
+        conn.execute(text(
+            f"INSERT OR IGNORE INTO prayer_events (user_id, prayer, utc_time, alarm_sent, push_sent, local_date) "
+            f"SELECT user_id, '{prayer}', time_{prayer}, COALESCE(alarm_{prayer}, 0), COALESCE(push_{prayer}, 0), "
+            f"COALESCE(date_now, date(time_{prayer})) FROM users WHERE time_{prayer} IS NOT NULL"
+        ))
+    for index in inspect(conn).get_indexes('users'):
+        if any(col.startswith(('time_', 'alarm_', 'push_')) for col in index['column_names']):
+            conn.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+    for prayer in legacy:
+        for prefix in ('time', 'alarm', 'push'):
+            if f'{prefix}_{prayer}' in columns:
+                conn.execute(text(f'ALTER TABLE users DROP COLUMN {prefix}_{prayer}'))
+
+
+def _rebuild_prayer_events_autoincrement(conn) -> None:
+    """Пересоздаёт prayer_events, созданную без AUTOINCREMENT (ALTER TABLE не умеет его добавить)."""
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'prayer_events'")).scalar()
+    if sql is None or 'AUTOINCREMENT' in sql.upper():
+        return
+    conn.execute(text('ALTER TABLE prayer_events RENAME TO prayer_events_old'))
+    # Индексы переехали вместе с таблицей - освобождаем их имена
+    for index in inspect(conn).get_indexes('prayer_events_old'):
+        conn.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+    PrayerEvent.__table__.create(conn)
+    columns = ', '.join(column.name for column in PrayerEvent.__table__.columns)
+    conn.execute(text(f'INSERT INTO prayer_events ({columns}) SELECT {columns} FROM prayer_events_old'))
+    conn.execute(text('DROP TABLE prayer_events_old'))
+
+
+def _add_missing_columns(conn) -> None:
+    """Добавляет в существующие таблицы новые nullable-колонки модели (ALTER TABLE ADD COLUMN)."""
+    for table in Base.metadata.sorted_tables:
+        existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                column_type = column.type.compile(dialect=conn.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def _create_all(conn):
+    Base.metadata.create_all(conn)
+    _add_missing_columns(conn)
+    _rebuild_prayer_events_autoincrement(conn)
+    _migrate_prayer_columns(conn)
+    # create_all не добавляет индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
 
 async def create_tables():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(_create_all)
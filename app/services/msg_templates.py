@@ -11,6 +11,8 @@ def get_text_main(user: str, city: str) -> str:
 
 
 def get_text_day(city: str, date: str, timings: dict) -> str:
+    # Время может быть не определено в расписаниях, сохранённых до расчёта полярных дня/ночи
+    timings = {name: value or '--:--' for name, value in timings.items()}
     t = f'<strong>{city} {date}</strong>\n' \
         f'<code>ФАДЖР  - {timings["Fajr"]}</code>\n' \
         f'<code>ШУРУК  - {timings["Sunrise"]}</code>\n' \
@@ -1,40 +1,222 @@
-from datetime import datetime, timedelta
-from pprint import pprint
+import asyncio
+from datetime import date, datetime, timedelta, timezone
 
-from aiohttp import ClientSession
+import h3
+import numpy as np
+
+from app.services import db, metrics
+from app.services.cache import TTLCache
+from app.services.prayer_calc import calc_namaz_batch, DEFAULT_METHOD
+from app.services.timezones import local_now, local_to_utc, resolve_offset
+from config import H3_RESOLUTION, NAMAZ_CACHE_SIZE, NAMAZ_CACHE_TTL, PREWARM_AHEAD_HOURS, PREWARM_CHUNK, \
+    SCHEDULE_DAYS, SCHEDULE_MIN_AHEAD
+from logger import logger
 
-URL_MAIN = 'http://api.aladhan.com/v1/timings'
 NAMAZ = ('Fajr', 'Sunrise', 'Dhuhr', 'Asr', 'Maghrib', 'Isha')
 
+# Расписание на (ячейка H3, местная дата, метод, смещение) - одно на всех соседей по ячейке.
+# Смещение в ключе нужно для ячеек на границе часовых поясов.
+timetable_cache = TTLCache(maxsize=NAMAZ_CACHE_SIZE, ttl=NAMAZ_CACHE_TTL)
+metrics.register_cache('timetable', timetable_cache)
+
+
+def _cache_key(date: str, lat: float, lon: float, tz, method: int = DEFAULT_METHOD) -> tuple:
+    # Имя зоны заменяем смещением на эту дату: соседи по ячейке с одной зоной делят запись
+    tz = resolve_offset(tz, datetime.strptime(date, '%d-%m-%Y').date())
+    return h3.latlng_to_cell(lat, lon, H3_RESOLUTION), date, method, tz
+
+
+async def get_namaz(date: str, lat: float, lon: float, tz):
+    """
+    Расписание намазов на дату в формате aladhan: {'Fajr': 'HH:MM', ...}.
+    Читается из prayer_schedule, при отсутствии - считается локально сразу на месяц вперёд (см. get_namaz_many).
+
+    :param date: дата 'dd-mm-YYYY' (местная)
+    :param tz: имя зоны IANA или смещение часового пояса в часах
+    """
+    return (await get_namaz_many([(date, lat, lon, tz)]))[0]
+
+
+def _db_key(key: tuple) -> tuple:
+    cell, date, method, offset = key
+    return cell, datetime.strptime(date, '%d-%m-%Y').date(), method, offset
+
+
+def _compute_timings(keys: list) -> dict:
+    """Локальный расчёт для центров ячеек одним вызовом calc_namaz_batch: {ключ: расписание}."""
+    if not keys:
+        return {}
+    centers = [h3.cell_to_latlng(key[0]) for key in keys]
+    dates = [datetime.strptime(key[1], '%d-%m-%Y').date() for key in keys]
+    offsets = np.array([key[3] for key in keys], dtype=np.float64)
+    utc_times = calc_namaz_batch(
+        np.array([c[0] for c in centers]),
+        np.array([c[1] for c in centers]),
+        offsets,
+        np.array(dates, dtype='datetime64[D]'),
+    )
+    # Переводим обратно в местное время 'HH:MM', как в ответе aladhan
+    local_times = utc_times + (np.round(offsets * 60).astype(np.int64)[:, None]).astype('timedelta64[m]')
+    return {
+        key: {name: None if np.isnat(value) else value.astype(datetime).strftime('%H:%M')
+              for name, value in zip(NAMAZ, row)}
+        for key, row in zip(keys, local_times)
+    }
+
+
+async def fill_schedule(locations, start, days: int = SCHEDULE_DAYS) -> dict:
+    """
+    Считает и сохраняет в prayer_schedule расписания мест на days дней начиная с местной даты start.
+
+    :param locations: итерируемое из (lat, lon, tz), tz - имя зоны или смещение
+    :return: {ключ кэша: расписание} для всех посчитанных дат
+    """
+    keys = list(dict.fromkeys(
+        _cache_key((start + timedelta(days=i)).strftime('%d-%m-%Y'), lat, lon, tz)
+        for lat, lon, tz in locations
+        for i in range(days)
+    ))
+    computed = _compute_timings(keys)
+    rows = []
+    for key, timings in computed.items():
+        cell, local_date, method, offset = _db_key(key)
+        row = {'cell': cell, 'local_date': local_date, 'method': method, 'utc_offset': offset}
+        row.update({name.lower(): timings[name] for name in NAMAZ})
+        rows.append(row)
+    await db.save_schedule(rows)
+    return computed
+
+
+async def get_namaz_many(items: list) -> list:
+    """
+    Пакетный вариант get_namaz для мест с известным часовым поясом.
+
+    :param items: список кортежей (date 'dd-mm-YYYY', lat, lon, tz), tz - имя зоны или смещение
+    :return: список расписаний в том же порядке. Порядок поиска: кэш в памяти -> prayer_schedule
+             (один запрос на все промахи) -> локальный расчёт на месяц вперёд для мест, которых нет в таблице
+    """
+    keys = [_cache_key(date, lat, lon, tz) for date, lat, lon, tz in items]
+    found = {}
+    missing = []
+    for key in keys:
+        if key in found:
+            continue
+        timings = timetable_cache.get(key)
+        found[key] = timings
+        if timings is None:
+            missing.append(key)
+
+    if missing:
+        rows = await db.get_schedule([_db_key(key) for key in missing])
+        for key in missing:
+            row = rows.get(_db_key(key))
+            if row is not None:
+                found[key] = {name: getattr(row, name.lower()) for name in NAMAZ}
+        # Мест нет в таблице - считаем и сохраняем сразу на месяц вперёд (один расчёт на каждую начальную дату)
+        groups = {}
+        pending = set()
+        for (date, lat, lon, tz), key in zip(items, keys):
+            if found[key] is None and key not in pending:
+                pending.add(key)
+                groups.setdefault(date, []).append((lat, lon, tz))
+        for date, locations in groups.items():
+            computed = await fill_schedule(locations, datetime.strptime(date, '%d-%m-%Y').date())
+            found.update({key: timings for key, timings in computed.items() if key in found})
+        for key in missing:
+            timetable_cache.set(key, found[key])
+
+    return [found[key] for key in keys]
+
+
+async def extend_schedule_horizon(today: date = None, min_ahead: int = SCHEDULE_MIN_AHEAD,
+                                  days: int = SCHEDULE_DAYS) -> int:
+    """
+    Фоновая задача: продлевает prayer_schedule для мест пользователей, у которых расписание
+    заканчивается раньше чем через min_ahead дней, и удаляет прошедшие даты.
+
+    :return: количество мест, для которых расписание посчитано заново
+    """
+    today = today or datetime.now(timezone.utc).date()
+    horizon = await db.get_schedule_horizon()
+    need = [
+        (lat, lon, tz) for lat, lon, tz in await db.get_user_locations()
+        if horizon.get(h3.latlng_to_cell(lat, lon, H3_RESOLUTION), date.min) < today + timedelta(days=min_ahead)
+    ]
+    if need:
+        # Местная дата отличается от даты UTC не больше чем на сутки
+        await fill_schedule(need, today - timedelta(days=1), days)
+    removed = await db.delete_schedule_before(today - timedelta(days=2))
+    logger.info(f"Prayer schedule extended for {len(need)} locations, {removed} old rows removed")
+    return len(need)
+
+
+async def prewarm_tomorrow(now: datetime = None, ahead_hours: float = PREWARM_AHEAD_HOURS,
+                           chunk: int = PREWARM_CHUNK) -> int:
+    """
+    Фоновая задача (раз в час): загружает в timetable_cache расписания на завтра для мест пользователей,
+    у которых местная полночь наступит в ближайшие ahead_hours часов. Пояса получают свою очередь
+    в разное время суток, а смена даты и кнопка "Завтра" берут расписание из памяти.
+
+    :return: количество подготовленных мест
+    """
+    now = now or datetime.now(timezone.utc)
+    items = []
+    for lat, lon, tz in await db.get_user_locations():
+        local = local_now(tz, now)
+        midnight = datetime.combine(local.date() + timedelta(days=1), datetime.min.time(), local.tzinfo)
+        if midnight - local <= timedelta(hours=ahead_hours):
+            items.append((midnight.strftime('%d-%m-%Y'), lat, lon, tz))
+    for i in range(0, len(items), chunk):
+        await get_namaz_many(items[i:i + chunk])
+        # Отдаём цикл событий обработчикам между порциями
+        await asyncio.sleep(0)
+    if items:
+        logger.info(f"Prewarmed tomorrow's timetables for {len(items)} locations")
+    return len(items)
+
+
+def timings_to_utc(date: str, timings: dict, tz) -> dict:
+    """
+    Переводит расписание в формате aladhan в UTC.
+    'HH:MM' не содержит дня, поэтому он восстанавливается по порядку намазов от Зухра: Магриб и Иша
+    раньше предыдущего намаза - уже после местной полуночи (летом на высоких широтах), Фаджр и восход
+    позже следующего - ещё до неё.
 
-async def get_namaz(date: str, lat: float, lon: float):
-    url = f'{URL_MAIN}/{date}?latitude={lat}&longitude={lon}&method=3'
-    try:
-        async with ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    return None
-                r = await resp.json()
-                return r['data']['timings']
-    except Exception as e:
-        print(f"Error fetching namaz times: {e}")
-        return None
+    :param date: местная дата 'dd-mm-YYYY'
+    :param tz: имя зоны IANA или смещение в часах
+    :return: {'fajr': aware datetime UTC, ...} (намазы без времени пропускаются)
+    """
+    local_times = {prayer: datetime.strptime(f"{date} {timings[prayer]}", "%d-%m-%Y %H:%M")
+                   for prayer in NAMAZ if timings.get(prayer)}
+    noon = NAMAZ.index('Dhuhr')
+    for order, days in ((NAMAZ[noon:], 1), (NAMAZ[noon::-1], -1)):
+        previous = None
+        for prayer in order:
+            if prayer not in local_times:
+                continue
+            # Шаг против порядка намазов - переход через полночь
+            if previous is not None and (local_times[prayer] - previous).total_seconds() * days < 0:
+                local_times[prayer] += timedelta(days=days)
+            previous = local_times[prayer]
+    return {prayer.lower(): local_to_utc(local, tz) for prayer, local in local_times.items()}
 
 
-async def get_next(timestamp: datetime, lat: float, lon: float) -> tuple:
+async def get_next(timestamp: datetime, lat: float, lon: float, tz) -> tuple:
     # Если timestamp содержит информацию о часовом поясе, делаем его naive
     if timestamp.tzinfo is not None:
         timestamp = timestamp.replace(tzinfo=None)
 
     date = timestamp.strftime('%d-%m-%Y')
-    timings = await get_namaz(date, lat, lon)
+    timings = await get_namaz(date, lat, lon, tz)
     for k in NAMAZ:
+        if not timings.get(k):
+            continue
         t = datetime.strptime(f'{timings[k]} {date}', '%H:%M %d-%m-%Y')
         if t > timestamp:
             return k, timings[k], date
     timestamp += timedelta(days=1)
     date = timestamp.strftime('%d-%m-%Y')
-    timings = await get_namaz(date, lat, lon)
+    timings = await get_namaz(date, lat, lon, tz)
     return 'Fajr', timings['Fajr'], date
 
 
@@ -1,164 +1,588 @@
 import asyncio
+import heapq
 import logging
+import time
 from datetime import datetime, timezone, timedelta
-from pprint import pprint
 
-from aiogram import Bot
-from aiogram.client.default import DefaultBotProperties
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 
-from app.keyboards.markups import create_kb, keyboard_namaz
-from app.services import db
-from app.services.namaz_api import get_namaz, NAMAZ
-from config import BOT_TOKEN
+from app.keyboards.markups import keyboard_namaz
+from app.services import db, metrics
+from app.services.namaz_api import get_namaz_many, timetable_cache, timings_to_utc
+from app.services.outbox import ChatUnavailable, Priority, outbox
+from app.services.timezones import get_zone, local_now
+from config import ROLLOVER_CONCURRENCY, ROLLOVER_RETRY_DELAY, ROLLOVER_RETRY_MAX
+from logger import sampled
 
 logger = logging.getLogger(__name__)
 
 # Соответствие английских названий молитв русским (для уведомлений)
 PRAYER_NAMES = {
-    'time_fajr': ('Фаджр', 'alarm_fajr', 'push_fajr'),
-    'time_sunrise': ('Шурук', 'alarm_sunrise', 'push_sunrise'),
-    'time_dhuhr': ('Зухр', 'alarm_dhuhr', 'push_dhuhr'),
-    'time_asr': ('Аср', 'alarm_asr', 'push_asr'),
-    'time_maghrib': ('Магриб', 'alarm_maghrib', 'push_maghrib'),
-    'time_isha': ('Иша', 'alarm_isha', 'push_isha')
+    'fajr': 'Фаджр',
+    'sunrise': 'Шурук',
+    'dhuhr': 'Зухр',
+    'asr': 'Аср',
+    'maghrib': 'Магриб',
+    'isha': 'Иша'
 }
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
 
-async def check_notifications(bot: Bot):
+# Окна уведомлений: "скоро намаз" за ALARM_BEFORE до молитвы, "совершили?" через PUSH_AFTER после
+ALARM_BEFORE = timedelta(minutes=20)
+PUSH_AFTER = timedelta(minutes=10)
+# Через сколько повторить событие, если отправка не удалась
+RETRY_DELAY = timedelta(minutes=1)
+# Максимальный сон планировщика между проверками очереди, сек
+MAX_SLEEP = 300
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+
+def _delivery_observer(event, flag: str):
+    """Колбэк future отправки: считает результат и задержку от момента, когда его полагалось отправить."""
+    kind = 'alarm' if flag == 'alarm_sent' else 'push'
+    due = _aware(event.utc_time) + (-ALARM_BEFORE if kind == 'alarm' else PUSH_AFTER)
+
+    def observe(future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            unavailable = not future.cancelled() and isinstance(future.exception(), ChatUnavailable)
+            metrics.NOTIFIER_MESSAGES.inc(kind=kind, result='chat_unavailable' if unavailable else 'failed')
+            return
+        metrics.NOTIFIER_MESSAGES.inc(kind=kind, result='sent')
+        lag = (datetime.now(timezone.utc) - due).total_seconds()
+        metrics.NOTIFIER_LAG_SECONDS.observe(max(lag, 0.0), kind=kind, prayer=event.prayer)
+
+    return observe
+
+
+# Фоновые задачи, ждущие результатов отправки (ссылки держим, чтобы задачи не собрал GC)
+_collectors = set()
+
+
+def _track(coro) -> asyncio.Task:
+    task = asyncio.get_running_loop().create_task(coro)
+    _collectors.add(task)
+    task.add_done_callback(_collectors.discard)
+    return task
+
+
+async def wait_deliveries() -> None:
+    """Ждёт, пока будут обработаны результаты всех поставленных в очередь уведомлений (при остановке, в бенчмарке)."""
+    while _collectors:
+        await asyncio.gather(*_collectors, return_exceptions=True)
+
+
+async def _collect_deliveries(deliveries: list, summary: dict, started: float, on_failed=None) -> None:
     """
-    Проверяет каждую минуту:
-    - Если до молитвы осталось меньше 20 минут, а уведомление ещё не отправлено (alarm=False) → отправляет "Скоро намаз".
-    - Если после молитвы прошло больше 10 минут, а уведомление ещё не отправлено (push=False) → отправляет "Намаз прошёл".
-    После отправки соответствующий флаг устанавливается в True.
+    Дожидается отправки уведомлений одной проверки: снимает флаги недоставленных одним пакетом,
+    передаёт их события в on_failed (для повтора) и пишет сводку.
     """
+    failed = []
+    failed_events = []
+    unavailable = 0
+    errors = {}
+    results = await asyncio.gather(*(future for _, _, future in deliveries), return_exceptions=True)
+    for (event, flag, _), result in zip(deliveries, results):
+        if isinstance(result, ChatUnavailable):
+            sampled(logger, "Notification %s for %s: chat %s unavailable", flag, event.prayer, event.user_id)
+            unavailable += 1
+        elif isinstance(result, BaseException):
+            sampled(logger, "Notification %s for %s to user %s failed: %r", flag, event.prayer, event.user_id, result)
+            errors[type(result).__name__] = errors.get(type(result).__name__, 0) + 1
+            setattr(event, flag, False)
+            failed.append((event.id, flag))
+            failed_events.append(event)
+        else:
+            sampled(logger, "Notification %s for %s sent to user %s", flag, event.prayer, event.user_id)
+
+    if failed:
+        # Недоставленные вернутся в очередь одним пакетом
+        try:
+            await db.release_event_flags(failed)
+        except Exception as e:
+            logger.exception(f"Failed to release {len(failed)} notification flags: {e}")
+        else:
+            if on_failed is not None:
+                on_failed(failed_events)
+    # Одна строка на проверку вместо строки на каждого пользователя
+    summary = dict(summary, sent=len(deliveries) - len(failed) - unavailable, failed=len(failed),
+                   unavailable=unavailable, delivered_in=round(time.perf_counter() - started, 3))
+    if errors:
+        summary['errors'] = errors
+    log = logger.warning if failed else logger.info
+    log("Notifications checked", extra={'data': summary})
+
+
+async def check_notifications(events: list = None, shards=None, on_failed=None) -> int:
+    """
+    Проверяет переданные события prayer_events (по умолчанию - те, что попали в окно уведомлений):
+    - Если до молитвы осталось меньше 20 минут, а уведомление ещё не отправлено (alarm_sent=False) → отправляет "Скоро намаз".
+    - Если после молитвы прошло больше 10 минут, а уведомление ещё не отправлено (push_sent=False) → отправляет "Намаз прошёл".
+    Перед отправкой уведомления занимаются в БД одной транзакцией (db.claim_event_flags): сообщение
+    отправляет только тот процесс, который установил флаг, поэтому повторов нет и при переходе шарда
+    к другому воркеру. Сообщения ставятся в очередь outbox ("скоро намаз" - в более приоритетную),
+    и функция сразу возвращается, не дожидаясь отправки: всплеск в тысячи сообщений не задерживает
+    следующие проверки. Результаты собирает фоновая задача: флаги недоставленных снимаются,
+    а их события передаются в on_failed для повтора. Если чат недоступен (ChatUnavailable -
+    бот заблокирован), флаг остаётся: повтор только тратил бы общий лимит отправки.
+
+    :param shards: при выборке событий по окну - только пользователи этих шардов
+    :param on_failed: вызывается со списком событий, уведомления которых не удалось доставить
+    :return: количество уведомлений, поставленных в очередь
+    """
+    started = time.perf_counter()
     now = datetime.now(timezone.utc)
-    users = await db.get_all_users()
-    for user in users:
-        print(user.user_id)
-        print(user.city_name)
-        updated = False
-        for field, (name_ru, alarm_field, push_field) in PRAYER_NAMES.items():
-            prayer_time = getattr(user, field, None)
-            if prayer_time is None:
-                continue
-            print(field)
-            print(prayer_time)
-            # Разница в минутах (положительная, если молитва в будущем)
-            if prayer_time.tzinfo is None:
-                prayer_time = prayer_time.replace(tzinfo=timezone.utc)
-            diff_minutes = (prayer_time - now).total_seconds() / 60.0
-            print(diff_minutes)
-
-            # 1. Уведомление за 20 минут до намаза (если ещё не отправляли)
-            if 0 < diff_minutes <= 20 and not getattr(user, alarm_field):
+    if events is None:
+        events = await db.get_due_events(now, ALARM_BEFORE, PUSH_AFTER, shards)
+    metrics.NOTIFIER_EVENTS_SCANNED.inc(len(events))
+    candidates = []
+    for event in events:
+        name_ru = PRAYER_NAMES[event.prayer]
+        prayer_time = _aware(event.utc_time)
+        # Разница в минутах (положительная, если молитва в будущем)
+        diff_minutes = (prayer_time - now).total_seconds() / 60.0
+
+        # 1. Уведомление за 20 минут до намаза (если ещё не отправляли)
+        if 0 < diff_minutes <= 20 and not event.alarm_sent:
+            candidates.append((event, 'alarm_sent', dict(
+                text=f"⚠️ До намаза {name_ru} осталось менее 20 минут!",
+                priority=Priority.ALARM
+            )))
+
+        # 2. Уведомление через 10 минут после намаза (если ещё не отправляли)
+        elif diff_minutes < -10 and not event.push_sent:
+            candidates.append((event, 'push_sent', dict(
+                text=f"✅ Вы совершили {name_ru}?",
+                priority=Priority.PUSH,
+                reply_markup=keyboard_namaz(event.prayer)
+            )))
+    if not candidates:
+        metrics.NOTIFIER_TICK_SECONDS.observe(time.perf_counter() - started)
+        return 0
+
+    claimed = await db.claim_event_flags([(event.id, flag) for event, flag, _ in candidates])
+    deliveries = []
+    for event, flag, message in candidates:
+        # Уведомление уже отправлено другим процессом - только отмечаем его
+        setattr(event, flag, True)
+        if (event.id, flag) in claimed:
+            future = outbox.send_message(event.user_id, **message)
+            future.add_done_callback(_delivery_observer(event, flag))
+            deliveries.append((event, flag, future))
+
+    elapsed = time.perf_counter() - started
+    metrics.NOTIFIER_TICK_SECONDS.observe(elapsed)
+    summary = {'scanned': len(events), 'due': len(candidates), 'claimed': len(deliveries), 'elapsed': round(elapsed, 3)}
+    if deliveries:
+        _track(_collect_deliveries(deliveries, summary, started, on_failed))
+    else:
+        logger.info("Notifications checked", extra={'data': summary})
+    return len(deliveries)
+
+
+def event_due_times(event, now: datetime) -> list:
+    """
+    Моменты срабатывания неотправленных уведомлений события: список (время UTC, 'alarm'/'push').
+    Просроченные получают время now - они должны сработать сразу.
+    """
+    prayer_time = _aware(event.utc_time)
+    due = []
+    # "Скоро намаз" имеет смысл только пока молитва не наступила
+    if not event.alarm_sent and prayer_time > now:
+        due.append((max(prayer_time - ALARM_BEFORE, now), 'alarm'))
+    # Окно "совершили?" открывается строго позже чем через 10 минут
+    if not event.push_sent:
+        due.append((max(prayer_time + PUSH_AFTER + timedelta(seconds=1), now), 'push'))
+    return due
+
+
+class NotificationScheduler:
+    """
+    Событийный планировщик уведомлений вместо опроса всей таблицы по таймеру.
+
+    Держит кучу (heapq) ближайших уведомлений "за 20 минут до" и "через 10 минут после"
+    по строкам prayer_events и спит до самого раннего. Когда время наступает,
+    check_notifications вызывается только для наступивших событий.
+    Изменения города/расписания приходят через db.on_user_changed: события
+    изменившихся пользователей перечитываются из БД пакетом. Записи кучи, которые больше не актуальны
+    (событие удалено, перенесено или уже отправлено), отбрасываются при извлечении.
+    При старте просроченные события проверяются один раз - так догоняются
+    уведомления, пропущенные пока бот был остановлен.
+
+    В воркере (worker.py) планировщик обслуживает только шарды из shards и узнаёт
+    о расписаниях, записанных процессом бота, через poll_new_events.
+    """
+
+    def __init__(self):
+        self.shards = None
+        self._last_event_id = 0
+        self._heap = []
+        # (event_id, kind) -> актуальное время срабатывания
+        self._queued = {}
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task = None
+        # Пользователи, чьи события нужно перечитать, и задача, которая их читает (см. user_changed)
+        self._changed = set()
+        self._reload_task: asyncio.Task = None
+
+    def _push(self, due: datetime, event_id: int, kind: str) -> None:
+        if self._queued.get((event_id, kind)) == due:
+            return
+        self._queued[(event_id, kind)] = due
+        self._seq += 1
+        head = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (due, self._seq, event_id, kind))
+        # Появилось событие раньше того, до которого спит цикл - будим
+        if head is None or due < head:
+            self._wakeup.set()
+
+    def schedule_events(self, events, now: datetime = None, retry_at: datetime = None) -> None:
+        """
+        Ставит в очередь неотправленные уведомления событий.
+
+        :param retry_at: куда перенести уже просроченные уведомления (повтор после неудачной отправки)
+        """
+        now = now or datetime.now(timezone.utc)
+        for event in events:
+            for due, kind in event_due_times(event, now):
+                if retry_at is not None and due <= now:
+                    due = retry_at
+                self._push(due, event.id, kind)
+
+    def retry_failed(self, events) -> None:
+        """on_failed для check_notifications: недоставленные уведомления повторяются через RETRY_DELAY."""
+        now = datetime.now(timezone.utc)
+        self.schedule_events(events, now, retry_at=now + RETRY_DELAY)
+
+    def user_changed(self, user_id: int) -> None:
+        """
+        Слушатель db.on_user_changed. События перечитываются не по одному пользователю, а пакетом:
+        смена даты записывает расписания тысяч пользователей подряд, и все, кто изменился
+        за время предыдущего запроса, загружаются следующим.
+        """
+        if self._task is None or not self.owns(user_id):
+            return
+        self._changed.add(user_id)
+        if self._reload_task is None:
+            self._reload_task = asyncio.get_running_loop().create_task(self._reload_changed())
+
+    async def _reload_changed(self) -> None:
+        try:
+            while self._changed:
+                user_ids, self._changed = self._changed, set()
                 try:
-                    await bot.send_message(
-                        user.user_id,
-                        f"⚠️ До намаза {name_ru} осталось менее 20 минут!"
-                    )
-                    setattr(user, alarm_field, True)
-                    updated = True
-                    logger.info(f"Уведомление о скором намазе {name_ru} отправлено пользователю {user.user_id}")
+                    events = await db.get_pending_events(user_ids)
                 except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления пользователю {user.user_id}: {e}")
+                    logger.exception(f"Failed to reload {len(user_ids)} users for scheduler: {e}")
+                    continue
+                self.schedule_events(events)
+        finally:
+            self._reload_task = None
+
+    def _pop_due(self, now: datetime) -> set:
+        event_ids = set()
+        while self._heap and self._heap[0][0] <= now:
+            due, _, event_id, kind = heapq.heappop(self._heap)
+            # Запись устарела, если событие с тех пор перепланировали
+            if self._queued.get((event_id, kind)) == due:
+                del self._queued[(event_id, kind)]
+                event_ids.add(event_id)
+        return event_ids
+
+    def owns(self, user_id: int) -> bool:
+        return self.shards is None or db.user_shard(user_id) in self.shards
+
+    async def set_shards(self, shards, gained=()) -> None:
+        """Меняет обслуживаемые шарды; для полученных догоняет просроченные и загружает будущие уведомления."""
+        self.shards = set(shards)
+        if gained and self._task is not None:
+            await check_notifications(shards=gained, on_failed=self.retry_failed)
+            now = datetime.now(timezone.utc)
+            self.schedule_events(await db.get_pending_events(shards=gained), now, retry_at=now + RETRY_DELAY)
+
+    async def poll_new_events(self) -> int:
+        """Ставит в очередь события, записанные после последней проверки (в том числе другими процессами)."""
+        events = await db.get_new_events(self._last_event_id, self.shards)
+        if events:
+            self._last_event_id = events[-1].id
+            self.schedule_events(events)
+        return len(events)
+
+    async def _process(self, event_ids) -> None:
+        # Удалённых (заменённых) событий в БД уже нет - они просто не вернутся;
+        # события шардов, перешедших к другому воркеру, пропускаем
+        events = [event for event in await db.get_events_by_ids(event_ids) if self.owns(event.user_id)]
+        # Недоставленные вернутся через retry_failed, когда станет известен результат отправки
+        await check_notifications(events, on_failed=self.retry_failed)
+        # Уведомления событий, которые ещё не наступили (например, "совершили?" после "скоро намаз")
+        now = datetime.now(timezone.utc)
+        self.schedule_events(events, now, retry_at=now + RETRY_DELAY)
 
-            # 2. Уведомление через 10 минут после намаза (если ещё не отправляли)
-            elif diff_minutes < -10 and not getattr(user, push_field):
+    async def run(self) -> None:
+        # Догоняем пропущенное и строим очередь по всем неотправленным событиям
+        self._last_event_id = await db.get_max_event_id()
+        await check_notifications(shards=self.shards, on_failed=self.retry_failed)
+        now = datetime.now(timezone.utc)
+        self.schedule_events(await db.get_pending_events(shards=self.shards), now, retry_at=now + RETRY_DELAY)
+        logger.info(f"Notification scheduler started with {len(self._heap)} events")
+
+        while True:
+            self._wakeup.clear()
+            now = datetime.now(timezone.utc)
+            event_ids = self._pop_due(now)
+            if event_ids:
                 try:
-                    await bot.send_message(
-                        user.user_id,
-                        f"✅ Вы совершили {name_ru}?",
-                        reply_markup=keyboard_namaz(field.replace('time_', ''))
-                    )
-                    setattr(user, push_field, True)
-                    updated = True
-                    logger.info(f"Уведомление о прошедшем намазе {name_ru} отправлено пользователю {user.user_id}")
+                    await self._process(event_ids)
                 except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления пользователю {user.user_id}: {e}")
+                    logger.exception(f"Notification scheduler tick failed: {e}")
+                    retry_at = now + RETRY_DELAY
+                    for event_id in event_ids:
+                        for kind in ('alarm', 'push'):
+                            self._push(retry_at, event_id, kind)
+                continue
+            timeout = (self._heap[0][0] - now).total_seconds() if self._heap else None
+            # Ограничиваем сон, чтобы не зависеть от перевода системных часов
+            timeout = MAX_SLEEP if timeout is None else min(timeout, MAX_SLEEP)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> asyncio.Task:
+        self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        for task in (self._task, self._reload_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._reload_task = None
+        self._changed.clear()
 
-        if updated:
-            # Сохраняем изменения в БД
-            async with db.Session() as session:
-                session.add(user)
-                await session.commit()
 
+notification_scheduler = NotificationScheduler()
+db.on_user_changed(notification_scheduler.user_changed)
 
-async def hourly_date_check():
-    logger.info("Starting hourly date check")
-    users = await db.get_all_users()
-    if not users:
-        logger.info("No users found")
-        return
 
+async def _rollover_user(user, local_date, timings) -> bool:
+    """
+    Записывает расписание на новую дату (флаги уведомлений новые).
+    Если дату уже сменил другой процесс, ничего не делает и возвращает False.
+    """
+    date_str = local_date.strftime('%d-%m-%Y')
+    # Local prayer times -> UTC (с учётом летнего времени зоны пользователя)
+    prayer_times = timings_to_utc(date_str, timings, db.user_tz(user))
+
+    # Apply updates to database (события за прошлые даты заменяются)
+    if not await db.update_user_prayers(user.user_id, local_date, prayer_times, only_if_stale=True):
+        sampled(logger, "User %s: date already changed to %s", user.user_id, local_date)
+        return False
+    sampled(logger, "Updated prayer times for user %s", user.user_id)
+    return True
+
+
+def _send_date_notices(updated: list) -> int:
+    """
+    Ставит в очередь (самую низкоприоритетную) сообщения о смене даты, не дожидаясь отправки:
+    при лимите 30 сообщений/с их рассылка занимает минуты, а расписания уже записаны.
+    Результаты отправки собирает фоновая задача (см. wait_deliveries).
+    """
+    if not updated:
+        return 0
+    futures = [outbox.send_message(user.user_id, f"Произошла смена даты - {local_date.strftime('%d-%m-%Y')}",
+                                   priority=Priority.BULK)
+               for user, local_date in updated]
+    _track(_collect_date_notices(futures))
+    return len(futures)
+
+
+async def _collect_date_notices(futures: list) -> None:
+    started = time.perf_counter()
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    counts = {'sent': 0, 'failed': 0, 'unavailable': 0}
+    for result in results:
+        if isinstance(result, ChatUnavailable):
+            counts['unavailable'] += 1
+        elif isinstance(result, BaseException):
+            counts['failed'] += 1
+        else:
+            counts['sent'] += 1
+    for result, count in counts.items():
+        metrics.ROLLOVER_NOTICES.inc(count, result=result)
+    log = logger.warning if counts['failed'] else logger.info
+    log("Date change notices delivered",
+        extra={'data': dict(counts, delivered_in=round(time.perf_counter() - started, 3))})
+
+
+async def hourly_date_check(concurrency: int = ROLLOVER_CONCURRENCY, tz=None, shards=None) -> dict:
+    """
+    Смена даты: для пользователей, у которых наступили новые местные сутки,
+    записывает новое расписание. Пользователи обрабатываются параллельно,
+    не более concurrency одновременно; ошибка одного не влияет на остальных.
+    Сообщения о смене даты ставятся в очередь после записи всех расписаний и не ожидаются:
+    их отправка не задерживает запись расписаний, а её ошибки считаются отдельно
+    (сводка "Date change notices delivered", метрика rollover_notices_total).
+
+    :param tz: обработать только группу с этой зоной IANA или смещением (по умолчанию - все)
+    :param shards: обработать только пользователей этих шардов (по умолчанию - всех)
+
+    :return: сводка {'checked', 'changed', 'updated', 'skipped', 'failed', 'notices', 'elapsed'}
+        (failed - ошибки записи расписания, notices - сообщений о смене даты поставлено в очередь)
+    """
+    started = time.monotonic()
+    report = {'checked': 0, 'changed': 0, 'updated': 0, 'skipped': 0, 'failed': 0, 'notices': 0, 'elapsed': 0.0}
+    errors = {}
     now_utc = datetime.now(timezone.utc)
-    updated_count = 0
+    # Только пользователи, у которых местная дата отличается от date_now
+    users = await db.get_users_with_stale_date(now_utc, None if tz is None else [tz], shards)
+    report['checked'] = len(users)
 
+    # Отбираем пользователей, у которых сменилась местная дата
+    changed = []
     for user in users:
-        logger.info(user.user_id)
-        try:
-            # Compute local date
-            local_datetime = now_utc + timedelta(hours=user.timezone)
-            local_date = local_datetime.date()
-            logger.info(local_datetime)
-            logger.info(user.date_now)
-            # If date hasn't changed, skip
-            if user.date_now == local_date:
-                continue
+        local_date = local_now(db.user_tz(user), now_utc).date()
+        if user.date_now != local_date:
+            sampled(logger, "User %s: date changed from %s to %s", user.user_id, user.date_now, local_date)
+            changed.append((user, local_date))
+    report['changed'] = len(changed)
 
-            logger.info(f"User {user.user_id}: date changed from {user.date_now} to {local_date}")
+    if changed:
+        # Расписания для всех сразу: кэш по ячейкам H3 и таблица prayer_schedule (заполняется заранее,
+        # см. extend_schedule_horizon), без внешних запросов
+        timings_list = await get_namaz_many([
+            (local_date.strftime('%d-%m-%Y'), user.latitude, user.longitude, db.user_tz(user))
+            for user, local_date in changed
+        ])
 
-            # Fetch new timings
-            date_str = local_datetime.strftime('%d-%m-%Y')
-            timings = None
-            for attempt in range(3):  # retry up to 3 times
-                timings = await get_namaz(date_str, user.latitude, user.longitude)
-                if timings:
-                    break
-                await asyncio.sleep(0.5)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        progress_step = max(1, len(changed) // 10)
+        updated = []
 
-            if not timings:
-                logger.error(f"Failed to fetch namaz times for user {user.user_id} after retries")
-                continue
+        async def worker(user, local_date, timings):
+            async with semaphore:
+                try:
+                    if await _rollover_user(user, local_date, timings):
+                        report['updated'] += 1
+                        updated.append((user, local_date))
+                    else:
+                        report['skipped'] += 1
+                except Exception as e:
+                    report['failed'] += 1
+                    # Трассировка - для первой ошибки каждого вида, остальные попадут в сводку
+                    if type(e).__name__ not in errors:
+                        logger.exception(f"Error processing user {user.user_id}: {e}")
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                done = report['updated'] + report['skipped'] + report['failed']
+                if done % progress_step == 0 and done < len(changed):
+                    logger.debug("Hourly date check progress: %s/%s", done, len(changed))
 
-            # Prepare updates
-            prayer_updates = {}
-            for prayer in NAMAZ:
-                prayer_time_str = timings.get(prayer)
-                if not prayer_time_str:
-                    continue
+        await asyncio.gather(*(
+            worker(user, local_date, timings)
+            for (user, local_date), timings in zip(changed, timings_list)
+        ))
+        report['notices'] = _send_date_notices(updated)
 
-                # Local prayer datetime (naive)
-                local_prayer = datetime.strptime(f"{date_str} {prayer_time_str}", "%d-%m-%Y %H:%M")
-
-                # Convert to UTC naive and then aware
-                prayer_utc_naive = local_prayer - timedelta(hours=user.timezone)
-                prayer_utc = prayer_utc_naive.replace(tzinfo=timezone.utc)
-
-                # Store in corresponding time_* field
-                prayer_updates[f"time_{prayer.lower()}"] = prayer_utc
-
-            # Reset all alarm and push flags
-            alarm_push_fields = [
-                'alarm_fajr', 'push_fajr',
-                'alarm_sunrise', 'push_sunrise',
-                'alarm_dhuhr', 'push_dhuhr',
-                'alarm_asr', 'push_asr',
-                'alarm_maghrib', 'push_maghrib',
-                'alarm_isha', 'push_isha'
-            ]
-            for field in alarm_push_fields:
-                prayer_updates[field] = False
-
-            # Update date_now
-            prayer_updates['date_now'] = local_date
-
-            # Apply updates to database
-            await db.update_user_prayers(user.user_id, prayer_updates)
-            updated_count += 1
-            logger.info(f"Updated prayer times for user {user.user_id}")
-            await bot.send_message(user.user_id, f'Произошла смена даты - {date_str}')
+    report['elapsed'] = round(time.monotonic() - started, 3)
+    metrics.ROLLOVER_RUN_SECONDS.observe(report['elapsed'])
+    for result in ('updated', 'skipped', 'failed'):
+        metrics.ROLLOVER_USERS.inc(report[result], result=result)
+    metrics.ROLLOVER_USERS.inc(report['checked'] - report['changed'], result='unchanged')
+    summary = dict(report, timezone='all' if tz is None else tz,
+                   timetable_cache_hit_rate=timetable_cache.stats()['hit_rate'])
+    if errors:
+        summary['errors'] = errors
+    # Одна строка на запуск вместо строк по каждому пользователю
+    log = logger.warning if report['failed'] else logger.info
+    log("Hourly date check completed", extra={'data': summary})
+    return report
+
+
+class RolloverScheduler:
+    """
+    Смена даты по группам часовых поясов: для каждой зоны IANA (или смещения у старых записей),
+    которая есть у пользователей, в APScheduler заводится задача, срабатывающая ровно
+    в местную полночь этой группы (с учётом перехода на летнее время) и обрабатывающая только её пользователей.
+    Индекс групп пополняется при смене города (через db.on_city_changed), а в воркере -
+    через refresh_groups; там же задачи обрабатывают только шарды из shards.
+    Если у кого-то из группы смена даты не удалась, группа проверяется снова через ROLLOVER_RETRY_DELAY
+    (пауза удваивается до ROLLOVER_RETRY_MAX): повторно обрабатываются только пользователи, у которых
+    дата так и осталась старой, - они не ждут со вчерашним расписанием следующей полуночи.
+    """
+
+    def __init__(self):
+        self.shards = None
+        self._groups = set()
+        self._scheduler: AsyncIOScheduler = None
+
+    @staticmethod
+    def job_id(tz) -> str:
+        return f'rollover_{tz}'
+
+    @staticmethod
+    def retry_job_id(tz) -> str:
+        return f"rollover_retry_{'all' if tz is None else tz}"
+
+    def add_group(self, tz) -> None:
+        if tz in self._groups or self._scheduler is None:
+            return
+        self._groups.add(tz)
+        # Местная полночь зоны; несколько секунд запаса на расхождение часов
+        self._scheduler.add_job(
+            self.run,
+            trigger=CronTrigger(hour=0, minute=0, second=5, timezone=get_zone(tz)),
+            kwargs={'tz': tz},
+            id=self.job_id(tz),
+            replace_existing=True,
+            misfire_grace_time=3600,
+            coalesce=True,
+        )
+        logger.info(f"Rollover job added for timezone {tz}")
+
+    async def run(self, tz=None, shards=None, attempt: int = 0) -> dict:
+        """
+        Смена даты для группы tz (None - для всех) в шардах shards (по умолчанию - в своих);
+        при ошибках ставит повтор.
+        """
+        report = await hourly_date_check(tz=tz, shards=self.shards if shards is None else shards)
+        if report['failed'] and self._scheduler is not None:
+            delay = min(ROLLOVER_RETRY_DELAY * 2 ** attempt, ROLLOVER_RETRY_MAX)
+            # Повтор - по текущим шардам воркера: за время паузы они могли смениться
+            self._scheduler.add_job(
+                self.run,
+                trigger='date',
+                run_date=datetime.now(timezone.utc) + timedelta(seconds=delay),
+                kwargs={'tz': tz, 'attempt': attempt + 1},
+                id=self.retry_job_id(tz),
+                replace_existing=True,
+                misfire_grace_time=None,
+            )
+            logger.warning(f"Rollover for {report['failed']} users failed, retry in {delay:.0f} s",
+                           extra={'data': {'timezone': 'all' if tz is None else tz, 'attempt': attempt + 1}})
+        return report
+
+    async def refresh_groups(self) -> None:
+        for tz in await db.get_timezones():
+            self.add_group(tz)
+
+    async def start(self, scheduler: AsyncIOScheduler) -> None:
+        """Заводит задачи для всех существующих групп и догоняет смену даты, пропущенную во время простоя."""
+        self._scheduler = scheduler
+        self.add_group(db.DEFAULT_CITY[4])
+        await self.refresh_groups()
+        await self.run()
+
+    def city_changed(self, user_id: int, tz) -> None:
+        """Слушатель db.on_city_changed: новая группа появляется, когда пользователь выбирает город."""
+        self.add_group(tz)
 
-        except Exception as e:
-            logger.exception(f"Error processing user {user.user_id}: {e}")
 
-    logger.info(f"Hourly date check completed. Updated {updated_count} users.")
\ No newline at end of file
+rollover_scheduler = RolloverScheduler()
+db.on_city_changed(rollover_scheduler.city_changed)
@@ -0,0 +1,232 @@
+import asyncio
+import itertools
+import time
+from enum import IntEnum
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, \
+    TelegramServerError
+from aiogram.methods import SendMessage
+from aiogram.methods.base import TelegramMethod
+
+from app.services import metrics
+from app.services.http_client import backoff_delay
+from config import OUTBOX_MAX_RETRIES, OUTBOX_PER_CHAT_BURST, OUTBOX_PER_CHAT_RATE, OUTBOX_RATE, OUTBOX_WORKERS
+from logger import logger
+
+
+class Priority(IntEnum):
+    """Очереди отправки: меньше значение - раньше отправка."""
+    REPLY = 0  # ответы на действия пользователя
+    ALARM = 1  # "до намаза осталось менее 20 минут"
+    PUSH = 2  # "вы совершили намаз?"
+    BULK = 3  # служебные рассылки (смена даты)
+
+
+class ChatUnavailable(Exception):
+    """
+    Сообщение не может быть доставлено и при повторе: пользователь заблокировал бота, удалил аккаунт
+    или чат не найден. Исходная ошибка Telegram - в __cause__.
+    """
+
+
+def is_chat_unavailable(error: Exception) -> bool:
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and 'chat not found' in error.message.lower()
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity накопленных."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать до появления токена (0 - токен есть)."""
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def set_rate(self, rate: float, capacity: float) -> None:
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = min(self.tokens, capacity)
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений Telegram.
+
+    Пул воркеров разбирает приоритетную очередь (см. Priority), соблюдая общий лимит
+    бота (OUTBOX_RATE сообщений/с) и лимит на чат. При TelegramRetryAfter отправка
+    приостанавливается на указанное Telegram время и сообщение возвращается в очередь;
+    сетевые ошибки повторяются с backoff. Результат отправки доступен через future;
+    если чат недоступен (бот заблокирован, чат не найден), future получает ChatUnavailable -
+    такое сообщение повторять бесполезно.
+    """
+
+    def __init__(self, rate: float = OUTBOX_RATE, per_chat_rate: float = OUTBOX_PER_CHAT_RATE,
+                 per_chat_burst: float = OUTBOX_PER_CHAT_BURST, workers: int = OUTBOX_WORKERS,
+                 max_retries: int = OUTBOX_MAX_RETRIES):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self.unavailable = 0
+        self._bucket = TokenBucket(rate, rate)
+        metrics.OUTBOX_RATE_LIMIT.set(rate)
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+        self._queue: asyncio.PriorityQueue = None
+        self._seq = itertools.count()
+        # Futures ещё не отправленных сообщений: в очереди, у воркера или ждущих повтора (call_later)
+        self._pending = set()
+        self._tasks = []
+        self._bot: Bot = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self, bot: Bot) -> None:
+        if self.running:
+            return
+        self._bot = bot
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f'Outbox started with {self.workers} workers')
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Неотправленные сообщения отменяются - и те, что были у воркеров или ждали повтора
+        for future in list(self._pending):
+            future.cancel()
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait()
+        logger.info(f'Outbox stopped: sent {self.sent}, failed {self.failed}, chat unavailable {self.unavailable}')
+
+    def enqueue(self, method: TelegramMethod, priority: Priority = Priority.REPLY) -> asyncio.Future:
+        """Ставит метод Bot API (SendMessage, EditMessageText, ...) в очередь и возвращает future с результатом."""
+        if not self.running:
+            raise RuntimeError('Outbox is not started')
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        self._put(priority, (method, 0, future))
+        return future
+
+    async def send(self, method: TelegramMethod, priority: Priority = Priority.REPLY):
+        """Ставит метод в очередь и ждёт результата отправки (исключение пробрасывается)."""
+        return await self.enqueue(method, priority)
+
+    def send_message(self, chat_id: int, text: str, priority: Priority = Priority.REPLY, **kwargs) -> asyncio.Future:
+        """Аналог bot.send_message через очередь; возвращает future."""
+        return self.enqueue(SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    @property
+    def rate(self) -> float:
+        return self._bucket.rate
+
+    def set_rate(self, rate: float) -> None:
+        """Меняет общий лимит процесса (сообщений/с) - когда лимит бота делится между процессами."""
+        if rate != self._bucket.rate:
+            logger.info(f'Outbox rate limit: {rate:.2f} msg/s')
+            self._bucket.set_rate(rate, max(rate, 1))
+            metrics.OUTBOX_RATE_LIMIT.set(rate)
+
+    def _put(self, priority: int, item: tuple) -> None:
+        if not self.running:
+            # Повтор, запланированный до остановки: future уже отменён
+            return
+        self._queue.put_nowait((priority, next(self._seq), item))
+        metrics.OUTBOX_QUEUE_SIZE.set(self._queue.qsize())
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Забываем чаты, у которых ведро уже полное - они ничем не ограничены
+                self._chat_buckets = {k: v for k, v in self._chat_buckets.items() if not v.full}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            priority, _, item = await self._queue.get()
+            metrics.OUTBOX_QUEUE_SIZE.set(self._queue.qsize())
+            method, attempt, future = item
+            if future.done():
+                continue
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+            chat_bucket = self._chat_bucket(getattr(method, 'chat_id', None))
+            chat_delay = chat_bucket.delay()
+            if chat_delay > 0:
+                # Чат пока занят - вернём сообщение позже, не занимая воркер
+                loop.call_later(chat_delay, self._put, priority, item)
+                continue
+            while (delay := self._bucket.delay()) > 0:
+                await asyncio.sleep(delay)
+            self._bucket.take()
+            chat_bucket.take()
+
+            try:
+                result = await self._bot(method)
+            except TelegramRetryAfter as e:
+                # Flood control: приостанавливаем всю отправку и повторяем это сообщение
+                logger.warning(f'Outbox: flood control, retry after {e.retry_after} s')
+                metrics.OUTBOX_MESSAGES.inc(result='retry_after')
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                self._put(priority, item)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt < self.max_retries:
+                    loop.call_later(backoff_delay(attempt), self._put, priority, (method, attempt + 1, future))
+                else:
+                    self.failed += 1
+                    metrics.OUTBOX_MESSAGES.inc(result='failed')
+                    if not future.done():
+                        future.set_exception(e)
+            except Exception as e:
+                if is_chat_unavailable(e):
+                    self.unavailable += 1
+                    metrics.OUTBOX_MESSAGES.inc(result='chat_unavailable')
+                    error = ChatUnavailable(str(e))
+                    error.__cause__ = e
+                else:
+                    self.failed += 1
+                    metrics.OUTBOX_MESSAGES.inc(result='failed')
+                    error = e
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                self.sent += 1
+                metrics.OUTBOX_MESSAGES.inc(result='sent')
+                if not future.done():
+                    future.set_result(result)
+
+
+outbox = Outbox()
@@ -0,0 +1,315 @@
+"""
+Локальный расчёт времени намазов по положению солнца.
+
+Алгоритм повторяет PrayTimes, на котором построен api.aladhan.com,
+с параметрами Muslim World League (method=3): Фаджр 18°, Иша 17°,
+Аср по стандартной (шафиитской) тени, коррекция высоких широт ANGLE_BASED.
+Время округляется до минуты так же, как у aladhan.
+
+calc_namaz считает одну точку на чистом math, calc_namaz_batch - сразу
+массив точек через numpy (для смены даты у всей базы пользователей).
+
+В полярный день и полярную ночь (широта выше ~65°) солнце не восходит или не заходит,
+и время восхода, заката или Асра не определено. Тогда все три берутся как на широте POLAR_LATITUDE
+той же долготы (метод ближайшей широты), а Фаджр и Иша считаются от них по ANGLE_BASED -
+у пользователя всегда есть все шесть времён.
+"""
+from datetime import datetime
+from math import acos, asin, atan, atan2, copysign, cos, degrees, floor, isnan, radians, sin, sqrt, tan
+
+import numpy as np
+
+# Параметры методов расчёта: угол Фаджра, угол Иши
+METHODS = {
+    3: {'fajr': 18.0, 'isha': 17.0},  # Muslim World League
+}
+DEFAULT_METHOD = 3
+ASR_FACTOR = 1  # 1 - стандартный (шафиитский), 2 - ханафитский
+IMSAK_MINUTES = 10
+# Широта для полярного дня/ночи: солнце восходит и заходит в любой день года, и Аср надёжно
+# раньше заката (ближе к полярному кругу в декабре солнце едва поднимается до угла Асра)
+POLAR_LATITUDE = 60.0
+
+
+# --- Тригонометрия в градусах ---
+
+def _dsin(d: float) -> float:
+    return sin(radians(d))
+
+
+def _dcos(d: float) -> float:
+    return cos(radians(d))
+
+
+def _dtan(d: float) -> float:
+    return tan(radians(d))
+
+
+def _darcsin(x: float) -> float:
+    return degrees(asin(x))
+
+
+def _darccos(x: float) -> float:
+    # За полярным кругом солнце может не достигать нужного угла
+    if x < -1.0 or x > 1.0:
+        return float('nan')
+    return degrees(acos(x))
+
+
+def _darctan2(y: float, x: float) -> float:
+    return degrees(atan2(y, x))
+
+
+def _darccot(x: float) -> float:
+    return degrees(atan(1.0 / x))
+
+
+def _fix(a: float, b: float) -> float:
+    # Остаток в Python всегда неотрицателен для b > 0, nan остаётся nan
+    return a % b
+
+
+def _fix_angle(a: float) -> float:
+    return _fix(a, 360.0)
+
+
+def _fix_hour(a: float) -> float:
+    return _fix(a, 24.0)
+
+
+def _time_diff(t1: float, t2: float) -> float:
+    return _fix_hour(t2 - t1)
+
+
+# --- Астрономия ---
+
+def julian_date(year: int, month: int, day: int) -> float:
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = floor(year / 100)
+    b = 2 - a + floor(a / 4)
+    return floor(365.25 * (year + 4716)) + floor(30.6001 * (month + 1)) + day + b - 1524.5
+
+
+def sun_position(jd: float) -> tuple:
+    """Возвращает (склонение солнца в градусах, уравнение времени в часах)."""
+    d = jd - 2451545.0
+    g = _fix_angle(357.529 + 0.98560028 * d)
+    q = _fix_angle(280.459 + 0.98564736 * d)
+    lon = _fix_angle(q + 1.915 * _dsin(g) + 0.020 * _dsin(2 * g))
+    e = 23.439 - 0.00000036 * d
+    ra = _darctan2(_dcos(e) * _dsin(lon), _dcos(lon)) / 15.0
+    eqt = q / 15.0 - _fix_hour(ra)
+    decl = _darcsin(_dsin(e) * _dsin(lon))
+    return decl, eqt
+
+
+class _Day:
+    """Расчёт на одни сутки для заданной точки."""
+
+    def __init__(self, jd: float, lat: float):
+        self.jd = jd
+        self.lat = lat
+
+    def mid_day(self, time: float) -> float:
+        _, eqt = sun_position(self.jd + time)
+        return _fix_hour(12 - eqt)
+
+    def sun_angle_time(self, angle: float, time: float, ccw: bool = False) -> float:
+        decl, _ = sun_position(self.jd + time)
+        noon = self.mid_day(time)
+        t = _darccos((-_dsin(angle) - _dsin(decl) * _dsin(self.lat)) /
+                     (_dcos(decl) * _dcos(self.lat))) / 15.0
+        return noon - t if ccw else noon + t
+
+    def asr_time(self, factor: int, time: float) -> float:
+        decl, _ = sun_position(self.jd + time)
+        angle = -_darccot(factor + _dtan(abs(self.lat - decl)))
+        return self.sun_angle_time(angle, time)
+
+
+def _adjust_high_lat(time: float, base: float, angle: float, night: float, ccw: bool = False) -> float:
+    """Коррекция ANGLE_BASED: доля ночи не больше angle/60."""
+    portion = angle / 60.0 * night
+    if isnan(time) or (_time_diff(time, base) if ccw else _time_diff(base, time)) > portion:
+        time = base + (-portion if ccw else portion)
+    return time
+
+
+def compute_hours(year: int, month: int, day: int, lat: float, lon: float, tz: float,
+                  method: int = DEFAULT_METHOD, elevation: float = 0.0) -> dict:
+    """
+    Время намазов в часах местного времени (float, может быть nan).
+
+    :param tz: смещение часового пояса от UTC в часах
+    """
+    params = METHODS[method]
+    jd = julian_date(year, month, day) - lon / (15 * 24.0)
+    d = _Day(jd, lat)
+    rise_set_angle = 0.833 + 0.0347 * sqrt(elevation)
+
+    # Начальные приближения (доли суток), одна итерация как в PrayTimes
+    fajr = d.sun_angle_time(params['fajr'], 5 / 24.0, ccw=True)
+    sunrise = d.sun_angle_time(rise_set_angle, 6 / 24.0, ccw=True)
+    dhuhr = d.mid_day(12 / 24.0)
+    asr = d.asr_time(ASR_FACTOR, 13 / 24.0)
+    sunset = d.sun_angle_time(rise_set_angle, 18 / 24.0)
+    isha = d.sun_angle_time(params['isha'], 18 / 24.0)
+
+    shift = tz - lon / 15.0
+    times = {
+        'Fajr': fajr + shift,
+        'Sunrise': sunrise + shift,
+        'Dhuhr': dhuhr + shift,
+        'Asr': asr + shift,
+        'Sunset': sunset + shift,
+        'Isha': isha + shift,
+    }
+
+    if abs(lat) > POLAR_LATITUDE and any(isnan(times[name]) for name in ('Sunrise', 'Asr', 'Sunset')):
+        nearest = compute_hours(year, month, day, copysign(POLAR_LATITUDE, lat), lon, tz, method, elevation)
+        for name in ('Sunrise', 'Asr', 'Sunset'):
+            times[name] = nearest[name]
+
+    night = _time_diff(times['Sunset'], times['Sunrise'])
+    times['Fajr'] = _adjust_high_lat(times['Fajr'], times['Sunrise'], params['fajr'], night, ccw=True)
+    times['Isha'] = _adjust_high_lat(times['Isha'], times['Sunset'], params['isha'], night)
+
+    times['Maghrib'] = times['Sunset']
+    times['Imsak'] = times['Fajr'] - IMSAK_MINUTES / 60.0
+    times['Midnight'] = times['Sunset'] + night / 2
+    return times
+
+
+def format_hours(time: float):
+    """Часы -> 'HH:MM' с округлением до ближайшей минуты; None если время не определено."""
+    if isnan(time):
+        return None
+    time = _fix_hour(time + 0.5 / 60)
+    hours = floor(time)
+    minutes = floor((time - hours) * 60)
+    return f'{hours:02d}:{minutes:02d}'
+
+
+def calc_namaz(date, lat: float, lon: float, tz: float, method: int = DEFAULT_METHOD) -> dict:
+    """
+    Аналог ответа aladhan `data.timings`: {'Fajr': 'HH:MM', ...}.
+
+    :param date: строка 'dd-mm-YYYY' или datetime.date
+    :param tz: смещение часового пояса от UTC в часах
+    """
+    if isinstance(date, str):
+        date = datetime.strptime(date, '%d-%m-%Y').date()
+    elif isinstance(date, datetime):
+        date = date.date()
+    hours = compute_hours(date.year, date.month, date.day, lat, lon, tz, method)
+    return {name: format_hours(value) for name, value in hours.items()}
+
+
+# --- Пакетный (векторизованный) расчёт ---
+
+def _np_sun_position(jd):
+    d = jd - 2451545.0
+    g = np.mod(357.529 + 0.98560028 * d, 360.0)
+    q = np.mod(280.459 + 0.98564736 * d, 360.0)
+    g_rad = np.radians(g)
+    lon = np.radians(np.mod(q + 1.915 * np.sin(g_rad) + 0.020 * np.sin(2 * g_rad), 360.0))
+    e = np.radians(23.439 - 0.00000036 * d)
+    ra = np.degrees(np.arctan2(np.cos(e) * np.sin(lon), np.cos(lon))) / 15.0
+    eqt = q / 15.0 - np.mod(ra, 24.0)
+    decl = np.degrees(np.arcsin(np.sin(e) * np.sin(lon)))
+    return decl, eqt
+
+
+def _np_mid_day(jd, time):
+    _, eqt = _np_sun_position(jd + time)
+    return np.mod(12 - eqt, 24.0)
+
+
+def _np_sun_angle_time(jd, lat, angle, time, ccw=False):
+    decl, _ = _np_sun_position(jd + time)
+    noon = _np_mid_day(jd, time)
+    decl_rad = np.radians(decl)
+    lat_rad = np.radians(lat)
+    x = (-np.sin(np.radians(angle)) - np.sin(decl_rad) * np.sin(lat_rad)) / (np.cos(decl_rad) * np.cos(lat_rad))
+    # За пределами [-1, 1] arccos даёт nan - это и нужно для полярных дня/ночи
+    with np.errstate(invalid='ignore'):
+        t = np.degrees(np.arccos(x)) / 15.0
+    return noon - t if ccw else noon + t
+
+
+def _np_asr_time(jd, lat, factor, time):
+    decl, _ = _np_sun_position(jd + time)
+    angle = -np.degrees(np.arctan(1.0 / (factor + np.tan(np.radians(np.abs(lat - decl))))))
+    return _np_sun_angle_time(jd, lat, angle, time)
+
+
+def _np_adjust_high_lat(time, base, angle, night, ccw=False):
+    portion = angle / 60.0 * night
+    diff = np.mod(base - time, 24.0) if ccw else np.mod(time - base, 24.0)
+    with np.errstate(invalid='ignore'):
+        replace = np.isnan(time) | (diff > portion)
+    return np.where(replace, base - portion if ccw else base + portion, time)
+
+
+def _np_julian_date(dates):
+    """dates: массив datetime64[D] -> юлианская дата полуночи UTC."""
+    # 1970-01-01 соответствует JD 2440587.5
+    return dates.astype('datetime64[D]').astype(np.int64) + 2440587.5
+
+
+def calc_namaz_batch(lats, lons, offsets, dates, method: int = DEFAULT_METHOD):
+    """
+    Расчёт расписаний для N точек за один векторизованный проход.
+
+    :param lats: широты, массив (N,)
+    :param lons: долготы, массив (N,)
+    :param offsets: смещения часовых поясов от UTC в часах, массив (N,)
+    :param dates: местные даты, массив (N,) datetime64[D] (или то, что к нему приводится)
+    :return: массив (N, 6) datetime64[m] с UTC-временем намазов в порядке
+             Fajr, Sunrise, Dhuhr, Asr, Maghrib, Isha (время после местной полуночи - уже
+             следующего дня); NaT если время не определено
+    """
+    params = METHODS[method]
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.float64)
+    dates = np.asarray(dates, dtype='datetime64[D]')
+
+    jd = _np_julian_date(dates) - lons / (15 * 24.0)
+    rise_set_angle = 0.833
+
+    shift = offsets - lons / 15.0
+    fajr = _np_sun_angle_time(jd, lats, params['fajr'], 5 / 24.0, ccw=True) + shift
+    sunrise = _np_sun_angle_time(jd, lats, rise_set_angle, 6 / 24.0, ccw=True) + shift
+    dhuhr = _np_mid_day(jd, 12 / 24.0) + shift
+    asr = _np_asr_time(jd, lats, ASR_FACTOR, 13 / 24.0) + shift
+    sunset = _np_sun_angle_time(jd, lats, rise_set_angle, 18 / 24.0) + shift
+    isha = _np_sun_angle_time(jd, lats, params['isha'], 18 / 24.0) + shift
+
+    # Полярный день/ночь: восход, закат и Аср - как на широте POLAR_LATITUDE (см. compute_hours)
+    polar = np.isnan(sunrise) | np.isnan(asr) | np.isnan(sunset)
+    if polar.any():
+        near_lats = np.clip(lats, -POLAR_LATITUDE, POLAR_LATITUDE)
+        sunrise = np.where(polar, _np_sun_angle_time(jd, near_lats, rise_set_angle, 6 / 24.0, ccw=True) + shift,
+                           sunrise)
+        asr = np.where(polar, _np_asr_time(jd, near_lats, ASR_FACTOR, 13 / 24.0) + shift, asr)
+        sunset = np.where(polar, _np_sun_angle_time(jd, near_lats, rise_set_angle, 18 / 24.0) + shift, sunset)
+
+    night = np.mod(sunrise - sunset, 24.0)
+    fajr = _np_adjust_high_lat(fajr, sunrise, params['fajr'], night, ccw=True)
+    isha = _np_adjust_high_lat(isha, sunset, params['isha'], night)
+
+    hours = np.stack([fajr, sunrise, dhuhr, asr, sunset, isha], axis=1)
+    # Округление до минуты, как в format_hours, но без приведения к суткам: часы отсчитываются
+    # от местной полуночи даты, и Магриб/Иша после полуночи (25:00 и т. п.) попадают на следующий день
+    hours = hours + 0.5 / 60
+    valid = ~np.isnan(hours)
+    whole = np.floor(np.where(valid, hours, 0.0))
+    local_minutes = whole * 60 + np.floor((np.where(valid, hours, 0.0) - whole) * 60)
+
+    utc_minutes = local_minutes - np.round(offsets * 60)[:, None]
+    result = dates.astype('datetime64[m]')[:, None] + utc_minutes.astype(np.int64).astype('timedelta64[m]')
+    result[~valid] = np.datetime64('NaT')
+    return result
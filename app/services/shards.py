@@ -0,0 +1,75 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+from app.services import db
+from app.services.outbox import outbox
+from config import LEASE_TTL, NOTIFIER_SHARDS, OUTBOX_RATE
+from logger import logger
+
+
+class ShardLeases:
+    """
+    Шарды пользователей, принадлежащие воркеру уведомлений.
+
+    Каждый вызов sync отмечает воркер живым, продлевает его аренды в таблице shard_leases
+    и выравнивает нагрузку: воркер держит не больше ceil(шардов / живых воркеров), лишние отпускает,
+    недостающие забирает из свободных и просроченных - так шарды упавшего воркера переходят
+    к остальным через LEASE_TTL.
+    """
+
+    def __init__(self, owner: str, shards: int = NOTIFIER_SHARDS, ttl: float = LEASE_TTL):
+        self.owner = owner
+        self.shards = shards
+        self.ttl = timedelta(seconds=ttl)
+        self.owned = set()
+
+    async def start(self) -> None:
+        await db.init_shard_leases(self.shards)
+
+    async def sync(self, now: datetime = None) -> tuple:
+        """
+        Продлевает и перераспределяет аренды.
+
+        :return: (полученные шарды, потерянные шарды)
+        """
+        now = now or datetime.now(timezone.utc)
+        expires_at = now + self.ttl
+        kept = await db.renew_leases(self.owner, expires_at)
+        free, workers = await db.get_lease_state(now)
+        target = math.ceil(self.shards / max(workers, 1))
+
+        if len(kept) > target:
+            extra = set(sorted(kept)[target:])
+            await db.release_leases(self.owner, extra)
+            kept -= extra
+        for shard in free:
+            if len(kept) >= target:
+                break
+            if await db.acquire_lease(shard, self.owner, now, expires_at):
+                kept.add(shard)
+
+        gained, lost = kept - self.owned, self.owned - kept
+        self.owned = kept
+        if gained or lost:
+            logger.info(f"Worker {self.owner}: shards {sorted(self.owned)} (gained {sorted(gained)}, "
+                        f"lost {sorted(lost)})")
+        return gained, lost
+
+    async def release(self) -> None:
+        await db.release_leases(self.owner)
+        self.owned = set()
+
+
+async def share_outbox_rate(now: datetime = None) -> float:
+    """
+    Делит общий лимит бота OUTBOX_RATE поровну между процессом бота и живыми воркерами:
+    ведро токенов у каждого процесса своё, и без деления суммарная скорость была бы (воркеров + 1) x OUTBOX_RATE.
+    Вызывается периодически в каждом процессе; пока остальные не пересчитали свою долю
+    (до WORKER_SYNC_INTERVAL после запуска или остановки воркера), лимит может ненадолго превышаться.
+
+    :return: лимит этого процесса (сообщений/с)
+    """
+    workers = await db.count_live_workers(now or datetime.now(timezone.utc))
+    rate = OUTBOX_RATE / (workers + 1)
+    outbox.set_rate(rate)
+    return rate
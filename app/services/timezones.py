@@ -0,0 +1,54 @@
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+
+@lru_cache(maxsize=1024)
+def get_zone(tz) -> tzinfo:
+    """
+    Часовой пояс пользователя как tzinfo.
+
+    :param tz: имя зоны IANA ('Europe/Moscow') или смещение в часах для старых записей без имени зоны
+    """
+    if isinstance(tz, str):
+        return ZoneInfo(tz)
+    return timezone(timedelta(hours=tz))
+
+
+def utc_offset_hours(tz, moment=None) -> float:
+    """
+    Смещение от UTC в часах с учётом летнего времени.
+
+    :param moment: datetime (naive считается UTC) или местная дата (берётся местный полдень);
+                   по умолчанию - текущий момент
+    """
+    zone = get_zone(tz)
+    if moment is None:
+        moment = datetime.now(timezone.utc)
+    if isinstance(moment, datetime):
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        offset = moment.astimezone(zone).utcoffset()
+    else:
+        offset = datetime.combine(moment, time(12), tzinfo=zone).utcoffset()
+    return offset.total_seconds() / 3600
+
+
+def local_now(tz, now: datetime = None) -> datetime:
+    """Текущее местное время (aware) в поясе tz."""
+    now = now or datetime.now(timezone.utc)
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=timezone.utc)
+    return now.astimezone(get_zone(tz))
+
+
+def local_to_utc(local: datetime, tz) -> datetime:
+    """Местное naive-время в поясе tz -> aware UTC."""
+    return local.replace(tzinfo=get_zone(tz)).astimezone(timezone.utc)
+
+
+def resolve_offset(tz, day: date) -> float:
+    """Смещение в часах на местную дату day: имя зоны пересчитывается, число возвращается как есть."""
+    if isinstance(tz, str):
+        return utc_offset_hours(tz, day)
+    return float(tz)
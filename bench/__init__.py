@@ -0,0 +1,14 @@
+"""
+Нагрузочные прогоны: python -m bench - смена даты, уведомления и запросы db.py (см. bench/__main__.py),
+python -m bench.load - обработчики сообщений через Dispatcher.feed_update (см. bench/load.py).
+"""
+import subprocess
+
+
+def git_revision() -> str:
+    """Текущий коммит - чтобы результаты прогонов можно было сопоставить с версиями кода."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
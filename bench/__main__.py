@@ -0,0 +1,91 @@
+"""
+Бенчмарк смены даты, уведомлений и запросов db.py на синтетических пользователях.
+
+    python -m bench --users 10000 100000 1000000 --output bench_results.json
+
+Каждый размер прогоняется в отдельном процессе на временной SQLite-базе. Bot API и расчёт
+расписаний заменены заглушками (bench.fakes) с задержкой --send-latency / --namaz-latency,
+лимиты outbox сняты (--outbox-rate, --outbox-workers), чтобы мерить код бота, а не ограничения Telegram.
+Результаты (время, пропускная способность, пиковый RSS, число SQL-запросов по каждой задаче)
+сохраняются в JSON - два файла можно сравнить между версиями.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from bench import git_revision
+
+
+def run_size(users: int, args, workdir: str) -> dict:
+    database = os.path.join(workdir, f'bench-{users}.sqlite3')
+    result_path = os.path.join(workdir, f'bench-{users}.json')
+    env = dict(
+        os.environ,
+        DB_URL=f'sqlite+aiosqlite:///{database}',
+        BOT_TOKEN=os.environ.get('BOT_TOKEN', '1:bench'),
+        OUTBOX_RATE=str(args.outbox_rate),
+        OUTBOX_PER_CHAT_RATE=str(args.outbox_rate),
+        OUTBOX_WORKERS=str(args.outbox_workers),
+        ROLLOVER_CONCURRENCY=str(args.rollover_concurrency),
+    )
+    command = [
+        sys.executable, '-m', 'bench.runner',
+        '--users', str(users),
+        '--send-latency', str(args.send_latency),
+        '--send-error-rate', str(args.send_error_rate),
+        '--namaz-latency', str(args.namaz_latency),
+        '--seed', str(args.seed),
+        '--result', result_path,
+    ]
+    subprocess.run(command, env=env, check=True)
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synthetic-load benchmark for notifier and rollover jobs')
+    parser.add_argument('--users', type=int, nargs='+', default=[10000], help='user counts to benchmark')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--send-latency', type=float, default=0.02, help='fake Bot API latency, s')
+    parser.add_argument('--send-error-rate', type=float, default=0.0, help='share of failed Bot API calls')
+    parser.add_argument('--namaz-latency', type=float, default=0.05, help='fake get_namaz_many latency, s')
+    parser.add_argument('--outbox-rate', type=float, default=100000, help='OUTBOX_RATE for the run')
+    parser.add_argument('--outbox-workers', type=int, default=64)
+    parser.add_argument('--rollover-concurrency', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help='directory for scratch databases (kept after the run)')
+    args = parser.parse_args()
+
+    report = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'workdir')},
+        'runs': [],
+    }
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        report['runs'] = [run_size(users, args, args.workdir) for users in args.users]
+    else:
+        with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+            report['runs'] = [run_size(users, args, workdir) for users in args.users]
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for run in report['runs']:
+        print(f"{run['users']} users")
+        for job in run['jobs']:
+            queries = sum(item['count'] for item in job['db_queries'].values())
+            print(f"  {job['job']:<32} {job['wall_seconds']:>9.3f} s  {job['throughput_per_second'] or 0:>10.1f}/s"
+                  f"  {job['peak_rss_mb']:>7.1f} MB  {queries} queries")
+    print(f'Results saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
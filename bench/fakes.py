@@ -0,0 +1,48 @@
+"""Заглушки внешних сервисов для бенчмарков: Bot API и расчёт расписаний с настраиваемой задержкой."""
+import asyncio
+import random
+
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.types import Chat, Message
+
+# Расписание, которое возвращает заглушка get_namaz_many (формат aladhan)
+TIMINGS = {'Fajr': '05:10', 'Sunrise': '06:40', 'Dhuhr': '12:30', 'Asr': '15:45', 'Maghrib': '18:20', 'Isha': '19:50'}
+
+
+class FakeBot:
+    """
+    Замена aiogram.Bot для outbox: каждый вызов метода Bot API ждёт latency секунд
+    и с вероятностью error_rate завершается сетевой ошибкой.
+    """
+
+    def __init__(self, latency: float = 0.02, error_rate: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+
+    async def __call__(self, method, request_timeout: int = None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            raise TelegramNetworkError(method=method, message='fake network error')
+        chat_id = getattr(method, 'chat_id', 0)
+        return Message(message_id=self.calls, date=0, chat=Chat(id=chat_id, type='private'),
+                       text=getattr(method, 'text', None))
+
+
+class FakeNamaz:
+    """Замена namaz_api.get_namaz_many: latency секунд на вызов, одно и то же расписание для всех мест."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.calls = 0
+        self.items = 0
+
+    async def __call__(self, items: list) -> list:
+        self.calls += 1
+        self.items += len(items)
+        await asyncio.sleep(self.latency)
+        return [dict(TIMINGS) for _ in items]
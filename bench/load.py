@@ -0,0 +1,70 @@
+"""
+Нагрузочный тест обработчиков сообщений и кнопок через Dispatcher.feed_update.
+
+    python -m bench.load --users 2000 --rate 300 --output load_results.json
+
+Прогон идёт в отдельном процессе на временной SQLite-базе; Telegram и TomTom заменены
+локальными aiohttp-серверами с задержками --bot-latency / --tomtom-latency.
+Лимиты outbox по умолчанию сняты, чтобы время обработки показывало код бота; --outbox-rate 30
+включает боевой лимит. Отчёт - p50/p95/p99 времени обработки и ошибки по видам обновлений.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench import git_revision
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load test of the chat handlers')
+    parser.add_argument('--users', type=int, default=500, help='virtual users, ~8 updates each')
+    parser.add_argument('--rate', type=float, default=200, help='updates per second')
+    parser.add_argument('--bot-latency', type=float, default=0.02, help='mock Bot API latency, s')
+    parser.add_argument('--tomtom-latency', type=float, default=0.15, help='mock TomTom latency, s')
+    parser.add_argument('--outbox-rate', type=float, default=100000, help='OUTBOX_RATE for the run')
+    parser.add_argument('--gazetteer', help='gazetteer index to search cities offline before TomTom')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='load_results.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='load-') as workdir:
+        result_path = os.path.join(workdir, 'result.json')
+        env = dict(
+            os.environ,
+            DB_URL=f"sqlite+aiosqlite:///{os.path.join(workdir, 'load.sqlite3')}",
+            BOT_TOKEN='1:load',
+            TOMTOM_API_KEY='load',
+            OUTBOX_RATE=str(args.outbox_rate),
+            OUTBOX_PER_CHAT_RATE=str(args.outbox_rate),
+            OUTBOX_PER_CHAT_BURST=str(args.outbox_rate),
+        )
+        command = [sys.executable, '-m', 'bench.load_runner', '--result', result_path]
+        for option in ('users', 'rate', 'bot_latency', 'tomtom_latency', 'gazetteer', 'seed'):
+            value = getattr(args, option)
+            if value is not None:
+                command += [f"--{option.replace('_', '-')}", str(value)]
+        subprocess.run(command, env=env, check=True)
+        with open(result_path) as f:
+            result = json.load(f)
+
+    result['revision'] = git_revision()
+    result['options'] = {key: value for key, value in vars(args).items() if key != 'output'}
+    with open(args.output, 'w') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"{result['updates']} updates from {result['users']} users in {result['wall_seconds']} s "
+          f"({result['throughput_per_second']}/s, target {result['target_rate']}/s)")
+    print(f"  {'kind':<14} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    for kind, stats in [*result['kinds'].items(), ('overall', result['overall'])]:
+        print(f"  {kind:<14} {stats['count']:>7} {stats.get('p50_ms', 0):>9} {stats.get('p95_ms', 0):>9} "
+              f"{stats.get('p99_ms', 0):>9} {stats.get('max_ms', 0):>9} {stats['errors'] + stats['unhandled']:>7}")
+    for sample in result['error_samples']:
+        print(f'  ! {sample}')
+    print(f"Mock requests: {result['mock_requests']}. Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+Нагрузочный прогон обработчиков (запускается из python -m bench.load отдельным процессом на временной базе).
+
+Виртуальные пользователи проходят сценарий /start -> кнопки расписаний -> смена города -> "совершил намаз";
+их обновления перемешиваются и подаются в Dispatcher.feed_update с заданной частотой. Обновления одного
+пользователя обрабатываются по порядку (как у настоящего чата), разных - параллельно. Bot API
+и TomTom - локальные заглушки (bench.mock_servers). Результат - перцентили времени обработки по видам
+обновлений, число ошибок и запросов к заглушкам - пишется в JSON-файл --result.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from app.handlers.common import common_router
+from app.handlers.location import location_router
+from app.services import db, map_api
+from app.services.db_writer import db_writer
+from app.services.fsm_storage import SQLiteStorage
+from app.services.gazetteer import load_gazetteer
+from app.services.http_client import http_client
+from app.services.models import PRAYERS
+from app.services.outbox import outbox
+from bench.mock_servers import AMBIGUOUS_QUERY, MockServices
+from bench.synthetic import CITIES
+from config import BOT_TOKEN
+
+BOT_USER = User(id=1, is_bot=True, first_name='Load test')
+# Ошибок с текстом сохраняется в отчёт не больше этого
+MAX_ERROR_SAMPLES = 20
+
+
+class UpdateFactory:
+    """Синтетические Update: сообщения с текстом и нажатия инлайн-кнопок."""
+
+    def __init__(self):
+        self._update_id = 0
+        self._message_id = 0
+
+    def _ids(self) -> tuple:
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(user_id: int) -> User:
+        return User(id=user_id, is_bot=False, first_name=f'User {user_id}', username=f'user{user_id}')
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id, message_id = self._ids()
+        return Update(update_id=update_id, message=Message(
+            message_id=message_id, date=datetime.now(timezone.utc), text=text,
+            chat=Chat(id=user_id, type='private'), from_user=self._user(user_id)))
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id, message_id = self._ids()
+        message = Message(message_id=message_id, date=datetime.now(timezone.utc), text='...',
+                          chat=Chat(id=user_id, type='private'), from_user=BOT_USER)
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id), from_user=self._user(user_id), chat_instance=str(user_id), data=data,
+            message=message))
+
+
+def scenario(factory: UpdateFactory, user_id: int, rng: random.Random) -> list:
+    """Обновления одного пользователя по порядку: [(вид, Update)]."""
+    city = rng.choices(CITIES, weights=[c[4] for c in CITIES])[0][0]
+    steps = [
+        ('start', factory.message(user_id, '/start')),
+        ('today', factory.message(user_id, '🕌 Сегодня')),
+        ('next', factory.message(user_id, '⏰ Следующий')),
+        ('tomorrow', factory.message(user_id, '🕋 Завтра')),
+        ('location', factory.message(user_id, '🌍 Место')),
+    ]
+    roll = rng.random()
+    if roll < 0.1:
+        # Опечатка - ничего не найдено, затем правильное название
+        steps.append(('city_search', factory.message(user_id, city + 'ъъ')))
+    elif roll < 0.2:
+        steps.append(('city_search', factory.message(user_id, AMBIGUOUS_QUERY.capitalize())))
+    steps.append(('city_search', factory.message(user_id, city)))
+    steps.append(('city_confirm', factory.callback(user_id, 'yes_city')))
+    steps.append(('prayer_done', factory.callback(user_id, f'yesna_{rng.choice(PRAYERS)}')))
+    return steps
+
+
+def _percentile(values: list, share: float) -> float:
+    # Метод ближайшего ранга
+    index = max(0, min(len(values) - 1, round(share * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def summarize(latencies: list) -> dict:
+    values = sorted(latencies)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': round(_percentile(values, 0.50) * 1000, 1),
+        'p95_ms': round(_percentile(values, 0.95) * 1000, 1),
+        'p99_ms': round(_percentile(values, 0.99) * 1000, 1),
+        'max_ms': round(values[-1] * 1000, 1),
+    }
+
+
+class LoadRun:
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.latencies = {}
+        self.errors = {}
+        self.unhandled = {}
+        self.error_samples = []
+        # Последнее обновление каждого пользователя: следующее ждёт его окончания
+        self._last = {}
+
+    async def _feed(self, kind: str, update: Update, previous: asyncio.Task) -> None:
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        started = time.perf_counter()
+        try:
+            result = await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            if len(self.error_samples) < MAX_ERROR_SAMPLES:
+                self.error_samples.append(f'{kind}: {e!r}')
+            return
+        finally:
+            self.latencies.setdefault(kind, []).append(time.perf_counter() - started)
+        if result is UNHANDLED:
+            self.unhandled[kind] = self.unhandled.get(kind, 0) + 1
+
+    async def run(self, updates: list, rate: float) -> float:
+        """Подаёт обновления [(пользователь, вид, Update)] с частотой rate в секунду; возвращает длительность."""
+        tasks = []
+        started = time.perf_counter()
+        for index, (user_id, kind, update) in enumerate(updates):
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self._feed(kind, update, self._last.get(user_id)))
+            self._last[user_id] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started
+
+
+def build_updates(users: int, seed: int) -> list:
+    """Сценарии всех пользователей, перемешанные с сохранением порядка внутри каждого."""
+    rng = random.Random(seed)
+    factory = UpdateFactory()
+    queues = [[(user_id, kind, update) for kind, update in scenario(factory, user_id, rng)]
+              for user_id in range(2 * 10 ** 9, 2 * 10 ** 9 + users)]
+    updates = []
+    while queues:
+        queue = queues[rng.randrange(len(queues))]
+        updates.append(queue.pop(0))
+        if not queue:
+            queues.remove(queue)
+    return updates
+
+
+async def run(args) -> dict:
+    services = MockServices(args.bot_latency, args.tomtom_latency)
+    await services.start()
+    # Внешние API - на заглушки
+    map_api.TOMTOM_GEOCODE_URL = f'{services.tomtom_url}/search/2/geocode/{{query}}.json'
+
+    await db.init_db(force=True)
+    if args.gazetteer:
+        load_gazetteer(args.gazetteer)
+    await asyncio.to_thread(map_api.preload_timezone_finder)
+    await http_client.start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(services.bot_api_url))
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode='HTML'))
+    storage = SQLiteStorage()
+    dp = Dispatcher(storage=storage)
+    dp.include_router(common_router)
+    dp.include_router(location_router)
+    storage.start()
+    outbox.start(bot)
+
+    updates = build_updates(args.users, args.seed)
+    load = LoadRun(dp, bot)
+    try:
+        wall = await load.run(updates, args.rate)
+    finally:
+        await outbox.stop()
+        await storage.close()
+        await db_writer.stop()
+        await http_client.close()
+        await bot.session.close()
+        await services.stop()
+
+    all_latencies = [value for values in load.latencies.values() for value in values]
+    kinds = {}
+    for kind, values in load.latencies.items():
+        kinds[kind] = summarize(values)
+        kinds[kind]['errors'] = load.errors.get(kind, 0)
+        kinds[kind]['unhandled'] = load.unhandled.get(kind, 0)
+    return {
+        'users': args.users,
+        'updates': len(updates),
+        'target_rate': args.rate,
+        'wall_seconds': round(wall, 3),
+        'throughput_per_second': round(len(updates) / wall, 1),
+        'overall': dict(summarize(all_latencies), errors=sum(load.errors.values()),
+                        unhandled=sum(load.unhandled.values())),
+        'kinds': kinds,
+        'mock_requests': services.requests,
+        'error_samples': load.error_samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Single load run (see python -m bench.load)')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=200)
+    parser.add_argument('--bot-latency', type=float, default=0.02)
+    parser.add_argument('--tomtom-latency', type=float, default=0.15)
+    parser.add_argument('--gazetteer')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--result', required=True)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(os.environ.get('BENCH_LOG_LEVEL', 'WARNING'))
+    result = asyncio.run(run(args))
+    with open(args.result, 'w') as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
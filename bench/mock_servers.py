@@ -0,0 +1,87 @@
+"""
+Локальные aiohttp-серверы вместо Telegram Bot API и TomTom для нагрузочных прогонов.
+У каждого сервиса своя задержка ответа и счётчик запросов.
+"""
+import asyncio
+import time
+
+from aiohttp import web
+
+from bench.synthetic import CITIES
+from logger import logger
+
+# Запрос, на который TomTom-заглушка отвечает несколькими городами
+AMBIGUOUS_QUERY = 'ивановка'
+
+
+def _message(chat_id, message_id: int, text: str = None) -> dict:
+    return {'message_id': message_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': int(chat_id or 0), 'type': 'private'}}
+
+
+def _tomtom_result(name: str, lat: float, lon: float, zone: str) -> dict:
+    return {
+        'type': 'Geography',
+        'entityType': 'Municipality',
+        'address': {'municipality': name, 'countrySubdivision': zone.split('/')[-1].replace('_', ' ')},
+        'position': {'lat': lat, 'lon': lon},
+    }
+
+
+class MockServices:
+    """Bot API и TomTom на 127.0.0.1; адреса - в bot_api_url, tomtom_url после start()."""
+
+    def __init__(self, bot_latency: float = 0.02, tomtom_latency: float = 0.15):
+        self.latency = {'bot_api': bot_latency, 'tomtom': tomtom_latency}
+        self.requests = {name: 0 for name in self.latency}
+        self.bot_api_url = self.tomtom_url = None
+        self._runners = []
+        self._message_id = 0
+
+    async def _serve(self, routes: list) -> str:
+        app = web.Application()
+        app.router.add_routes(routes)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host='127.0.0.1', port=0)
+        await site.start()
+        self._runners.append(runner)
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}'
+
+    async def start(self) -> None:
+        self.bot_api_url = await self._serve([web.post('/bot{token}/{method}', self._bot_api)])
+        self.tomtom_url = await self._serve([web.get('/search/2/geocode/{query}', self._tomtom)])
+        logger.info(f'Mock services: Bot API {self.bot_api_url}, TomTom {self.tomtom_url}')
+
+    async def stop(self) -> None:
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners = []
+
+    async def _delay(self, service: str) -> None:
+        self.requests[service] += 1
+        await asyncio.sleep(self.latency[service])
+
+    async def _bot_api(self, request: web.Request) -> web.Response:
+        await self._delay('bot_api')
+        method = request.match_info['method'].lower()
+        data = await request.post()
+        if method in ('sendmessage', 'editmessagetext'):
+            self._message_id += 1
+            result = _message(data.get('chat_id'), int(data.get('message_id') or self._message_id), data.get('text'))
+        elif method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Load test', 'username': 'load_test_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _tomtom(self, request: web.Request) -> web.Response:
+        await self._delay('tomtom')
+        query = request.match_info['query'].removesuffix('.json').casefold()
+        if query == AMBIGUOUS_QUERY:
+            results = [_tomtom_result('Ивановка', 50 + i, 40 + i, 'Europe/Moscow') for i in range(3)]
+        else:
+            results = [_tomtom_result(name, lat, lon, zone) for name, lat, lon, zone, _ in CITIES
+                       if name.casefold() == query]
+        return web.json_response({'summary': {'numResults': len(results)}, 'results': results})
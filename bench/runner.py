@@ -0,0 +1,144 @@
+"""
+Один прогон бенчмарка на заданном числе пользователей (запускается из python -m bench отдельным процессом:
+БД, кэши и пиковый RSS у каждого размера свои). Настройки приложения (DB_URL, OUTBOX_*) приходят
+через переменные окружения, результат пишется в JSON-файл --result.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from datetime import datetime, timezone
+
+from app.services import db, metrics, notifier
+from app.services.db_writer import db_writer
+from app.services.notifier import ALARM_BEFORE, PUSH_AFTER, check_notifications, hourly_date_check, wait_deliveries
+from app.services.outbox import outbox
+from bench.fakes import FakeBot, FakeNamaz
+from bench.synthetic import seed_database
+
+# Сколько случайных пользователей читать в замере get_user_city
+PROFILE_SAMPLE = 1000
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss в Linux - в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _db_totals() -> dict:
+    return {key[0]: value for key, value in metrics.DB_QUERY_SECONDS.totals().items()}
+
+
+async def measure(name: str, job) -> dict:
+    """
+    Выполняет job() и возвращает замер: время, пропускную способность (job возвращает число
+    обработанных элементов), пиковый RSS процесса и число/время SQL-запросов по типам.
+    """
+    before = _db_totals()
+    started = time.perf_counter()
+    items = await job()
+    wall = time.perf_counter() - started
+    queries = {}
+    for statement, (count, seconds) in _db_totals().items():
+        old_count, old_seconds = before.get(statement, (0, 0.0))
+        if count > old_count:
+            queries[statement] = {'count': count - old_count, 'seconds': round(seconds - old_seconds, 4)}
+    result = {
+        'job': name,
+        'items': items,
+        'wall_seconds': round(wall, 4),
+        'throughput_per_second': round(items / wall, 1) if wall > 0 else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'db_queries': queries,
+    }
+    print(f"{name}: {items} items in {result['wall_seconds']} s", file=sys.stderr)
+    return result
+
+
+async def run(users: int, send_latency: float, send_error_rate: float, namaz_latency: float, seed: int) -> dict:
+    await db.init_db(force=True)
+    bot = FakeBot(send_latency, send_error_rate, seed)
+    namaz = FakeNamaz(namaz_latency)
+    # Смена даты берёт расписания у заглушки, а не из prayer_schedule
+    notifier.get_namaz_many = namaz
+    outbox.start(bot)
+    now = datetime.now(timezone.utc)
+    sample = random.Random(seed).sample(range(users), min(users, PROFILE_SAMPLE))
+
+    async def seed_job():
+        return (await seed_database(users, now, seed))['users']
+
+    async def due_events_job():
+        return len(await db.get_due_events(now, ALARM_BEFORE, PUSH_AFTER))
+
+    async def stale_users_job():
+        return len(await db.get_users_with_stale_date(now))
+
+    async def pending_shard_job():
+        return len(await db.get_pending_events(shards={0}))
+
+    async def profiles_job():
+        for index in sample:
+            await db.get_user_city(10 ** 9 + index)
+        return len(sample)
+
+    async def notifications_job():
+        # Время - до доставки всех уведомлений, а не только до постановки в очередь
+        queued = await check_notifications()
+        await wait_deliveries()
+        return queued
+
+    async def rollover_job():
+        # Как и для уведомлений - до доставки сообщений о смене даты, иначе outbox.stop их отменит
+        updated = (await hourly_date_check())['updated']
+        await wait_deliveries()
+        return updated
+
+    jobs = [
+        ('seed', seed_job),
+        ('db.get_due_events', due_events_job),
+        ('db.get_users_with_stale_date', stale_users_job),
+        ('db.get_pending_events[shard 0]', pending_shard_job),
+        ('db.get_user_city', profiles_job),
+        ('check_notifications', notifications_job),
+        ('hourly_date_check', rollover_job),
+    ]
+    results = []
+    try:
+        for name, job in jobs:
+            results.append(await measure(name, job))
+    finally:
+        await outbox.stop()
+        await db_writer.stop()
+    return {
+        'users': users,
+        'jobs': results,
+        'bot_calls': bot.calls,
+        'bot_errors': bot.errors,
+        'namaz_calls': namaz.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Single benchmark run (see python -m bench)')
+    parser.add_argument('--users', type=int, required=True)
+    parser.add_argument('--send-latency', type=float, default=0.02)
+    parser.add_argument('--send-error-rate', type=float, default=0.0)
+    parser.add_argument('--namaz-latency', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--result', required=True)
+    args = parser.parse_args()
+    # Построчные INFO-сообщения по каждому пользователю не нужны в отчёте
+    logging.getLogger().setLevel(os.environ.get('BENCH_LOG_LEVEL', 'WARNING'))
+    result = asyncio.run(run(args.users, args.send_latency, args.send_error_rate, args.namaz_latency, args.seed))
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Синтетические пользователи и их события prayer_events для бенчмарков."""
+import random
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert
+
+from app.services.models import PRAYERS, PrayerEvent, User, WriteSession
+from app.services.timezones import local_now, utc_offset_hours
+
+# (город, широта, долгота, зона IANA, вес) - примерно как распределена аудитория бота:
+# в основном Россия и СНГ, заметная доля Ближнего Востока, Европы и Азии, немного обоих полушарий с летним временем
+CITIES = (
+    ('Москва', 55.7558, 37.6173, 'Europe/Moscow', 20),
+    ('Казань', 55.7963, 49.1088, 'Europe/Moscow', 10),
+    ('Махачкала', 42.9849, 47.5047, 'Europe/Moscow', 8),
+    ('Грозный', 43.3178, 45.6949, 'Europe/Moscow', 6),
+    ('Санкт-Петербург', 59.9343, 30.3351, 'Europe/Moscow', 6),
+    ('Нальчик', 43.4981, 43.6189, 'Europe/Moscow', 3),
+    ('Уфа', 54.7388, 55.9721, 'Asia/Yekaterinburg', 7),
+    ('Екатеринбург', 56.8389, 60.6057, 'Asia/Yekaterinburg', 3),
+    ('Новосибирск', 55.0084, 82.9357, 'Asia/Novosibirsk', 2),
+    ('Владивосток', 43.1198, 131.8869, 'Asia/Vladivostok', 1),
+    ('Ташкент', 41.2995, 69.2401, 'Asia/Tashkent', 5),
+    ('Алматы', 43.2220, 76.8512, 'Asia/Almaty', 4),
+    ('Бишкек', 42.8746, 74.5698, 'Asia/Bishkek', 2),
+    ('Душанбе', 38.5598, 68.7870, 'Asia/Dushanbe', 2),
+    ('Баку', 40.4093, 49.8671, 'Asia/Baku', 3),
+    ('Стамбул', 41.0082, 28.9784, 'Europe/Istanbul', 4),
+    ('Дубай', 25.2048, 55.2708, 'Asia/Dubai', 2),
+    ('Эр-Рияд', 24.7136, 46.6753, 'Asia/Riyadh', 1),
+    ('Каир', 30.0444, 31.2357, 'Africa/Cairo', 1),
+    ('Лондон', 51.5074, -0.1278, 'Europe/London', 2),
+    ('Берлин', 52.5200, 13.4050, 'Europe/Berlin', 2),
+    ('Нью-Йорк', 40.7128, -74.0060, 'America/New_York', 1),
+    ('Джакарта', -6.2088, 106.8456, 'Asia/Jakarta', 1),
+    ('Сидней', -33.8688, 151.2093, 'Australia/Sydney', 1),
+)
+# Разброс пользователей вокруг центра города, градусы (попадают в разные ячейки H3)
+SPREAD = 0.15
+# Интервал между событиями пользователя: за PERIOD примерно 40 минут окон уведомлений
+PERIOD = timedelta(minutes=150)
+# События старше этого считаются уже уведомлёнными
+SENT_AFTER = timedelta(minutes=30)
+INSERT_CHUNK = 20000
+
+
+def generate_users(count: int, now: datetime, seed: int = 1) -> list:
+    """
+    Строки таблицы users: город по весам CITIES, координаты с разбросом SPREAD.
+    date_now - вчерашняя местная дата, то есть смена даты нужна всем.
+    """
+    rng = random.Random(seed)
+    weights = [city[4] for city in CITIES]
+    zones = {city[3]: (utc_offset_hours(city[3], now), local_now(city[3], now).date()) for city in CITIES}
+    rows = []
+    for name, lat, lon, zone, _ in rng.choices(CITIES, weights=weights, k=count):
+        offset, today = zones[zone]
+        rows.append({
+            'user_id': 10 ** 9 + len(rows),
+            'city_name': name,
+            'latitude': round(lat + rng.uniform(-SPREAD, SPREAD), 5),
+            'longitude': round(lon + rng.uniform(-SPREAD, SPREAD), 5),
+            'timezone': offset,
+            'tz_name': zone,
+            'date_now': today - timedelta(days=1),
+        })
+    return rows
+
+
+def generate_events(users: list, now: datetime, seed: int = 1) -> list:
+    """
+    Строки prayer_events: шесть намазов каждого пользователя с шагом PERIOD, сдвинутые на случайное
+    время - в окна уведомлений в момент now попадает около 40/150 пользователей.
+    """
+    rng = random.Random(seed)
+    naive_now = now.replace(tzinfo=None)
+    rows = []
+    for user in users:
+        first = naive_now + timedelta(seconds=rng.uniform(-PERIOD.total_seconds(), 0)) - 2 * PERIOD
+        for index, prayer in enumerate(PRAYERS):
+            utc_time = first + index * PERIOD
+            sent = utc_time < naive_now - SENT_AFTER
+            rows.append({'user_id': user['user_id'], 'prayer': prayer, 'utc_time': utc_time,
+                         'alarm_sent': sent or utc_time < naive_now, 'push_sent': sent,
+                         'local_date': user['date_now']})
+    return rows
+
+
+async def _insert(model, rows: list) -> None:
+    # Напрямую через соединение писателя: одна большая транзакция, без очереди db_writer
+    async with WriteSession() as session:
+        for start in range(0, len(rows), INSERT_CHUNK):
+            await session.execute(insert(model), rows[start:start + INSERT_CHUNK])
+        await session.commit()
+
+
+async def seed_database(count: int, now: datetime = None, seed: int = 1) -> dict:
+    """Заполняет пустую БД count пользователями и их событиями; возвращает число строк."""
+    now = now or datetime.now(timezone.utc)
+    users = generate_users(count, now, seed)
+    await _insert(User, users)
+    events = generate_events(users, now, seed)
+    await _insert(PrayerEvent, events)
+    return {'users': len(users), 'events': len(events)}
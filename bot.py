@@ -1,18 +1,30 @@
 import asyncio
+import signal
 from logger import logger
 
-from aiogram import Bot, Dispatcher
+from aiogram import BaseMiddleware, Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.types import BotCommand
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.triggers.cron import CronTrigger
 
 from app.handlers.common import common_router
 from app.handlers.location import location_router
-from app.services.db import init_db
-from app.services.notifier import check_notifications, hourly_date_check
-from config import BOT_TOKEN, ADMIN_ID
+from app.services.db import delete_expired_geocodes, fill_missing_tz_names, init_db
+from app.services.db_writer import db_writer
+from app.services.fsm_storage import SQLiteStorage
+from app.services.gazetteer import load_gazetteer
+from app.services.http_client import http_client
+from app.services.map_api import get_loc_zone, preload_timezone_finder
+from app.services.metrics import start_metrics_server
+from app.services.namaz_api import extend_schedule_horizon, prewarm_tomorrow
+from app.services.notifier import notification_scheduler, rollover_scheduler, wait_deliveries
+from app.services.outbox import outbox
+from app.services.shards import share_outbox_rate
+from config import BOT_TOKEN, ADMIN_ID, BOT_MODE, GAZETTEER_PATH, METRICS_HOST, METRICS_PORT, NOTIFIER_MODE, SECRET, \
+    WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, WEBHOOK_SHUTDOWN_TIMEOUT, WEBHOOK_URL, WORKER_SYNC_INTERVAL
 
 
 
@@ -27,11 +39,88 @@ async def bot_started(bot: Bot):
     await bot.send_message(chat_id=ADMIN_ID, text='Бот Запущен')
 
 
+class UpdatesInProgress(BaseMiddleware):
+    """Внешний middleware диспетчера: считает обновления, обработка которых ещё не закончилась."""
+
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if self.count == 0:
+                self._idle.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Ждёт окончания обработки всех обновлений; False - не дождались за timeout сек."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+async def start_webhook(bot: Bot, dp: Dispatcher) -> tuple:
+    """
+    Запускает aiohttp-сервер, принимающий обновления на WEBHOOK_PATH (заголовок секрета сверяется с SECRET),
+    и регистрирует вебхук в Telegram, если задан WEBHOOK_URL.
+    Обновления обрабатываются в фоне - Telegram получает ответ сразу.
+
+    :return: (runner, site, in_progress) для остановки (см. stop_webhook)
+    """
+    if not SECRET:
+        logger.warning('SECRET is not set: webhook requests are not verified')
+    in_progress = UpdatesInProgress()
+    dp.update.outer_middleware(in_progress)
+    app = web.Application()
+    handler = SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=SECRET, handle_in_background=True)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT)
+    await site.start()
+    logger.info(f'Webhook server listening on {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}')
+    if WEBHOOK_URL:
+        await bot.set_webhook(f'{WEBHOOK_URL.rstrip("/")}{WEBHOOK_PATH}', secret_token=SECRET,
+                              allowed_updates=dp.resolve_used_update_types(), drop_pending_updates=True)
+    else:
+        logger.warning('WEBHOOK_URL is not set: webhook is not registered in Telegram')
+    return runner, site, in_progress
+
+
+async def wait_for_signal() -> None:
+    """Ждёт SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    logger.info('Stop signal received')
+
+
+async def stop_webhook(site: web.TCPSite, in_progress: UpdatesInProgress) -> None:
+    """Перестаёт принимать запросы и дожидается обработки уже принятых обновлений."""
+    await site.stop()
+    if in_progress.count:
+        logger.info(f'Waiting for {in_progress.count} updates in progress')
+        if not await in_progress.wait(WEBHOOK_SHUTDOWN_TIMEOUT):
+            logger.warning(f'{in_progress.count} updates still in progress after {WEBHOOK_SHUTDOWN_TIMEOUT} s')
+
+
 async def main():
     logger.info('Starting bot')
 
     bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
-    dp = Dispatcher(storage=MemoryStorage())
+    # Состояния FSM переживают перезапуск: кэш в памяти + отложенная запись в SQLite
+    storage = SQLiteStorage()
+    dp = Dispatcher(storage=storage)
 
 
     # Подключаем роутеры
@@ -41,27 +130,68 @@ async def main():
     await set_commands(bot)
     await bot_started(bot)
     await init_db()
+    db_writer.start()
+    await delete_expired_geocodes()
+    # Поиск городов без сети; TomTom - только если в справочнике ничего не нашлось
+    load_gazetteer(GAZETTEER_PATH)
+    # Полигоны часовых поясов загружаются один раз, а не при каждом выборе города
+    await asyncio.to_thread(preload_timezone_finder)
+    await fill_missing_tz_names(get_loc_zone)
+    await http_client.start()
+    storage.start()
+    # Все исходящие сообщения идут через очередь с ограничением скорости
+    outbox.start(bot)
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
 
     # Запуск планировщика
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(
-        check_notifications,
-        trigger=IntervalTrigger(seconds=20),
-        kwargs={'bot': bot},
-        id='prayer_notifier'
-    )
-    scheduler.add_job(
-        hourly_date_check,
-        trigger=IntervalTrigger(minutes=1),
-        id='hourly_date_check'
-    )
-    logger.info("Hourly date check scheduler added")
     scheduler.start()
-    logger.info("Планировщик уведомлений запущен")
-
-    # Удаляем вебхук и пропускаем накопившиеся обновления
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    # Расписания намазов на месяц вперёд: смена даты читает их из БД без расчётов и внешних запросов
+    await extend_schedule_horizon()
+    scheduler.add_job(extend_schedule_horizon, CronTrigger(hour=12, minute=30), id='schedule_horizon',
+                      replace_existing=True, misfire_grace_time=3600, coalesce=True)
+    # Расписания на завтра - в память за несколько часов до полуночи каждого пояса
+    scheduler.add_job(prewarm_tomorrow, CronTrigger(minute=15), id='prewarm_tomorrow',
+                      replace_existing=True, misfire_grace_time=600, coalesce=True)
+    if NOTIFIER_MODE == 'inline':
+        # Смена даты - в местную полночь каждой группы часовых поясов
+        await rollover_scheduler.start(scheduler)
+        logger.info("Rollover jobs scheduled")
+        # Уведомления о намазах - по событиям из очереди, без опроса таблицы
+        notification_scheduler.start()
+        logger.info("Планировщик уведомлений запущен")
+    else:
+        logger.info("Уведомления и смена даты выполняются процессами worker.py")
+        # Лимит отправки общий на бота - делим его с воркерами по мере их запуска и остановки
+        await share_outbox_rate()
+        scheduler.add_job(share_outbox_rate, 'interval', seconds=WORKER_SYNC_INTERVAL, id='share_outbox_rate',
+                          replace_existing=True, coalesce=True)
+
+    runner = None
+    try:
+        if BOT_MODE == 'webhook':
+            runner, site, in_progress = await start_webhook(bot, dp)
+            await wait_for_signal()
+            await stop_webhook(site, in_progress)
+        else:
+            # Удаляем вебхук и пропускаем накопившиеся обновления
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        scheduler.shutdown(wait=False)
+        await notification_scheduler.stop()
+        await outbox.stop()
+        # Флаги уведомлений, отменённых при остановке очереди, снимаются до остановки писателя БД
+        await wait_deliveries()
+        await storage.close()
+        # Записи, поставленные в очередь при остановке, успевают попасть в БД
+        await db_writer.stop()
+        await http_client.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if runner is not None:
+            # Закрывает и сессию бота - после остановки очереди сообщений
+            await runner.cleanup()
 
 
 if __name__ == '__main__':
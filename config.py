@@ -9,3 +9,103 @@ SECRET = os.environ.get('SECRET')
 ADMIN_ID = os.environ.get('ADMIN_ID')
 GEONAMES_USERNAME = os.environ.get('GEONAMES')
 TOMTOM_API_KEY = os.environ.get('TOMTOM_API_KEY')
+
+# База данных (URL SQLAlchemy)
+DB_URL = os.environ.get('DB_URL', 'sqlite+aiosqlite:///db.sqlite3')
+# SQLite в режиме WAL: synchronous FULL - fsync на каждый commit, и запись, которую дождался db_writer.write,
+# переживает отключение питания (NORMAL - fsync только при checkpoint: commit переживает падение процесса,
+# но последние транзакции могут пропасть при отключении питания); ожидание блокировки другим процессом (мс);
+# соединений для чтения. Все записи процесса идут через db_writer: операции, пришедшие
+# за DB_FLUSH_INTERVAL сек, выполняются одной транзакцией (не больше DB_WRITE_BATCH операций) - один fsync на пачку
+DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'FULL')
+DB_BUSY_TIMEOUT = int(os.environ.get('DB_BUSY_TIMEOUT', 5000))
+DB_READ_CONNECTIONS = int(os.environ.get('DB_READ_CONNECTIONS', 4))
+DB_FLUSH_INTERVAL = float(os.environ.get('DB_FLUSH_INTERVAL', 0.01))
+DB_WRITE_BATCH = int(os.environ.get('DB_WRITE_BATCH', 500))
+
+# Кэш расписаний намазов: разрешение сетки H3, размер и время жизни записей (сек).
+# Расписание одно на ячейку и считается для её центра. На разрешении 9 (ребро ~200 м) время отличается
+# от расчёта по точным координатам не больше чем на ~1.5 с (до 60° широты), и на минуту после округления
+# расходится только время у самой границы минуты (~3% мест, один намаз). Крупнее сетка - меньше
+# расчётов, но больше расхождений: на разрешении 6 (ребро ~3.7 км) - у ~40% мест
+H3_RESOLUTION = int(os.environ.get('H3_RESOLUTION', 9))
+NAMAZ_CACHE_SIZE = int(os.environ.get('NAMAZ_CACHE_SIZE', 20000))
+NAMAZ_CACHE_TTL = int(os.environ.get('NAMAZ_CACHE_TTL', 2 * 24 * 3600))
+
+# Общий HTTP-клиент для внешних API: размер пула, соединений на хост, таймаут (сек), число повторов
+HTTP_POOL_LIMIT = int(os.environ.get('HTTP_POOL_LIMIT', 100))
+HTTP_LIMIT_PER_HOST = int(os.environ.get('HTTP_LIMIT_PER_HOST', 10))
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 10))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', 3))
+
+# Смена даты: сколько пользователей обрабатывать одновременно; повтор для пользователей с ошибкой -
+# через ROLLOVER_RETRY_DELAY сек, с удвоением паузы до ROLLOVER_RETRY_MAX сек
+ROLLOVER_CONCURRENCY = int(os.environ.get('ROLLOVER_CONCURRENCY', 50))
+ROLLOVER_RETRY_DELAY = float(os.environ.get('ROLLOVER_RETRY_DELAY', 30))
+ROLLOVER_RETRY_MAX = float(os.environ.get('ROLLOVER_RETRY_MAX', 1800))
+
+# Очередь исходящих сообщений: общий лимит (сообщений/с), лимит на чат (сообщений/с и запас), воркеры, повторы
+OUTBOX_RATE = float(os.environ.get('OUTBOX_RATE', 30))
+OUTBOX_PER_CHAT_RATE = float(os.environ.get('OUTBOX_PER_CHAT_RATE', 1))
+OUTBOX_PER_CHAT_BURST = float(os.environ.get('OUTBOX_PER_CHAT_BURST', 3))
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 8))
+OUTBOX_MAX_RETRIES = int(os.environ.get('OUTBOX_MAX_RETRIES', 3))
+
+# Кэш геокодера (TomTom): время жизни найденных результатов и "ничего не найдено" (сек), размер кэша в памяти
+GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 30 * 24 * 3600))
+GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL', 24 * 3600))
+GEOCODE_MEMORY_SIZE = int(os.environ.get('GEOCODE_MEMORY_SIZE', 5000))
+
+# Кэш часовых поясов "ячейка координат (~1 км) -> зона IANA": размер и время жизни записей (сек)
+ZONE_CACHE_SIZE = int(os.environ.get('ZONE_CACHE_SIZE', 50000))
+ZONE_CACHE_TTL = int(os.environ.get('ZONE_CACHE_TTL', 30 * 24 * 3600))
+
+# Офлайн-справочник городов GeoNames (индекс строится командой python -m app.services.gazetteer build)
+GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH', 'gazetteer.idx')
+
+# Хранилище FSM: размер кэша в памяти, период записи изменений в БД и время жизни брошенных состояний (сек)
+FSM_CACHE_SIZE = int(os.environ.get('FSM_CACHE_SIZE', 10000))
+FSM_FLUSH_INTERVAL = float(os.environ.get('FSM_FLUSH_INTERVAL', 2))
+FSM_TTL = int(os.environ.get('FSM_TTL', 24 * 3600))
+
+# Кэш профилей пользователей (город, координаты, часовой пояс): размер и время жизни записей (сек)
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 50000))
+PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 3600))
+
+# Таблица prayer_schedule: на сколько дней вперёд заполнять расписание места и за сколько дней до конца продлевать
+SCHEDULE_DAYS = int(os.environ.get('SCHEDULE_DAYS', 31))
+SCHEDULE_MIN_AHEAD = int(os.environ.get('SCHEDULE_MIN_AHEAD', 7))
+
+# Подготовка расписаний на завтра: за сколько часов до местной полуночи и сколько мест за один шаг
+PREWARM_AHEAD_HOURS = float(os.environ.get('PREWARM_AHEAD_HOURS', 3))
+PREWARM_CHUNK = int(os.environ.get('PREWARM_CHUNK', 500))
+
+# Режим получения обновлений: 'polling' или 'webhook'. Для webhook - публичный адрес (без него вебхук
+# не регистрируется в Telegram, удобно для локальной отправки тестовых обновлений), путь, адрес и порт сервера
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+WEBAPP_HOST = os.environ.get('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.environ.get('WEBAPP_PORT', 8080))
+# Сколько секунд при остановке ждать обработки уже принятых обновлений
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.environ.get('WEBHOOK_SHUTDOWN_TIMEOUT', 10))
+
+# Уведомления и смена даты: 'inline' - в процессе бота, 'workers' - в отдельных процессах worker.py,
+# которые делят пользователей на NOTIFIER_SHARDS шардов (user_id % NOTIFIER_SHARDS) через аренду в БД.
+# Лимит OUTBOX_RATE в этом режиме делится поровну между ботом и живыми воркерами (см. shards.share_outbox_rate).
+NOTIFIER_MODE = os.environ.get('NOTIFIER_MODE', 'inline')
+NOTIFIER_SHARDS = int(os.environ.get('NOTIFIER_SHARDS', 16))
+# Аренда шарда истекает через LEASE_TTL сек без продления; воркер продлевает аренды и подхватывает
+# новые расписания каждые WORKER_SYNC_INTERVAL сек
+LEASE_TTL = float(os.environ.get('LEASE_TTL', 30))
+WORKER_SYNC_INTERVAL = float(os.environ.get('WORKER_SYNC_INTERVAL', 5))
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (порт 0 - не запускать).
+# У каждого процесса (бот, воркеры) должен быть свой порт
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9108))
+
+# Логирование: уровень, формат ('text' или 'json') и доля построчных DEBUG-сообщений о пользователях
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
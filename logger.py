@@ -1,7 +1,97 @@
+"""
+Настройка логирования: записи кладутся в очередь и пишутся в поток отдельным потоком (QueueListener),
+так что вызов logger.info в цикле событий не ждёт записи в stdout/stderr.
+
+Структурированные поля передаются через extra={'data': {...}}: в формате 'text' они дописываются
+в конец строки как key=value, в формате 'json' - отдельными ключами.
+Построчные сообщения о пользователях пишутся через sampled(): на уровне DEBUG и только
+для доли LOG_SAMPLE_RATE из них; задачи вместо них пишут одну сводку за запуск.
+"""
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
+
+from config import LOG_FORMAT, LOG_LEVEL, LOG_SAMPLE_RATE
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        data = getattr(record, 'data', None)
+        if data:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in data.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - один JSON-объект в строке."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'data', None) or {})
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Пропускает долю rate записей, помеченных extra={'sample': True}; остальные записи - все."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return not getattr(record, 'sample', False) or random.random() < self.rate
+
+
+_listener: logging.handlers.QueueListener = None
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, sample_rate: float = LOG_SAMPLE_RATE) -> None:
+    """Заменяет обработчики корневого логгера на QueueHandler; повторный вызов ничего не делает."""
+    global _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    # Отброшенные записи не попадают в очередь
+    handler.addFilter(SampleFilter(sample_rate))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Дописывает накопившиеся в очереди записи (вызывается при остановке процесса)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def sampled(log: logging.Logger, msg: str, *args, **data) -> None:
+    """Построчное DEBUG-сообщение о пользователе: пишется для доли LOG_SAMPLE_RATE вызовов."""
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(msg, *args, extra={'sample': True, 'data': data})
+
 
 logger: logging.Logger = logging.getLogger(__name__)
-logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s - %(levelname)s - %(name)s - %(message)s"
-        )
\ No newline at end of file
+setup_logging()
@@ -0,0 +1,48 @@
+"""
+Общие настройки тестов.
+
+Тесты работают с временной базой SQLite: DB_URL задаётся до импорта app.services.models
+(движок создаётся при импорте), а load_dotenv не перезаписывает уже заданные переменные окружения.
+"""
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='namaz-tests-'), 'test.sqlite3')
+os.environ['DB_URL'] = f'sqlite+aiosqlite:///{DB_PATH}'
+
+
+async def close_db() -> None:
+    """Останавливает db_writer и закрывает соединения: они привязаны к циклу событий теста."""
+    from app.services.db_writer import db_writer
+    from app.services.models import engine, read_engine
+
+    await db_writer.stop()
+    await engine.dispose()
+    await read_engine.dispose()
+
+
+@pytest.fixture
+def run():
+    """run(coro) - выполняет корутину в новом цикле событий и закрывает соединения с БД после неё."""
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await close_db()
+
+        return asyncio.run(main())
+
+    return run
+
+
+@pytest.fixture
+def db(run):
+    """Пустая база со всеми таблицами."""
+    from app.services import db
+
+    run(db.init_db(force=True))
+    return db
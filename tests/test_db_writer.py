@@ -0,0 +1,98 @@
+"""DBWriter: операции, пришедшие одновременно, пишутся одной транзакцией, каждая - в своём SAVEPOINT."""
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select
+
+from app.services.db_writer import DBWriter
+from app.services.models import GeocodeResult, Session
+
+EXPIRES = datetime(2030, 1, 1)
+
+
+def _insert(query: str, fail: bool = False, sessions: list = None):
+    async def operation(session):
+        if sessions is not None:
+            sessions.append(session)
+        await session.execute(insert(GeocodeResult).values(query=query, expires_at=EXPIRES))
+        if fail:
+            raise ValueError(query)
+        return query
+
+    return operation
+
+
+async def _stored() -> set:
+    async with Session() as session:
+        return set((await session.execute(select(GeocodeResult.query))).scalars().all())
+
+
+def test_failed_operation_rolls_back_only_its_savepoint(db, run):
+    async def scenario():
+        writer = DBWriter(flush_interval=0.05)
+        sessions = []
+        futures = [writer.submit(_insert('first', sessions=sessions)),
+                   writer.submit(_insert('broken', fail=True, sessions=sessions)),
+                   writer.submit(_insert('third', sessions=sessions))]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        await writer.stop()
+        return sessions, results, await _stored()
+
+    sessions, results, stored = run(scenario())
+    # Все три операции выполнялись в одной транзакции
+    assert len(sessions) == 3 and len({id(session) for session in sessions}) == 1
+    assert results[0] == 'first' and results[2] == 'third'
+    assert isinstance(results[1], ValueError)
+    assert stored == {'first', 'third'}
+
+
+def test_constraint_violation_rolls_back_only_that_operation(db, run):
+    async def scenario():
+        writer = DBWriter(flush_interval=0.05)
+        futures = [writer.submit(_insert('same')), writer.submit(_insert('same')), writer.submit(_insert('other'))]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        await writer.stop()
+        return results, await _stored()
+
+    results, stored = run(scenario())
+    # Второй INSERT нарушает первичный ключ: откатывается только он
+    assert results[0] == 'same' and results[2] == 'other'
+    assert isinstance(results[1], Exception)
+    assert stored == {'same', 'other'}
+
+
+def test_stop_commits_queued_operations(db, run):
+    async def scenario():
+        writer = DBWriter(flush_interval=0.05)
+        futures = [writer.submit(_insert(f'q{i}')) for i in range(5)]
+        await writer.stop()
+        return [future.result() for future in futures], await _stored()
+
+    results, stored = run(scenario())
+    assert results == [f'q{i}' for i in range(5)]
+    assert stored == {f'q{i}' for i in range(5)}
+
+
+def test_write_returns_after_commit(db, run):
+    async def scenario():
+        writer = DBWriter(flush_interval=0)
+        result = await writer.write(_insert('committed'))
+        # Читающее соединение (отдельный пул) уже видит запись
+        stored = await _stored()
+        await writer.stop()
+        return result, stored
+
+    assert run(scenario()) == ('committed', {'committed'})
+
+
+@pytest.mark.parametrize('size, max_batch, expected', [(7, 3, 3), (3, 10, 1)])
+def test_batches_are_limited_by_max_batch(db, run, size, max_batch, expected):
+    async def scenario():
+        writer = DBWriter(flush_interval=0.05, max_batch=max_batch)
+        sessions = []
+        await asyncio.gather(*(writer.submit(_insert(f'b{i}', sessions=sessions)) for i in range(size)))
+        await writer.stop()
+        return len({id(session) for session in sessions})
+
+    assert run(scenario()) == expected
@@ -0,0 +1,130 @@
+"""
+Миграция существующих баз при init_db: перенос расписаний из колонок users в prayer_events,
+пересоздание prayer_events с AUTOINCREMENT и добавление новых колонок. Каждая проверка
+запускает init_db дважды - повторный запуск ничего не меняет.
+"""
+import os
+import sqlite3
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import text
+
+from app.services import db
+from app.services.models import PRAYERS, engine
+
+# Схема users до prayer_events (первая версия бота): время и флаги уведомлений - колонками
+BASELINE_USERS = (
+    'CREATE TABLE users (id INTEGER NOT NULL, user_id BIGINT NOT NULL, city_name VARCHAR NOT NULL, '
+    'latitude FLOAT NOT NULL, longitude FLOAT NOT NULL, timezone INTEGER NOT NULL, '
+    + ''.join(f'time_{p} DATETIME, alarm_{p} BOOLEAN, push_{p} BOOLEAN, ' for p in PRAYERS)
+    + 'date_now DATE, PRIMARY KEY (id), UNIQUE (user_id))'
+)
+# prayer_events до AUTOINCREMENT: освободившиеся максимальные id выдавались повторно
+PLAIN_PRAYER_EVENTS = (
+    'CREATE TABLE prayer_events (id INTEGER NOT NULL, user_id BIGINT NOT NULL, prayer VARCHAR NOT NULL, '
+    'utc_time DATETIME NOT NULL, alarm_sent BOOLEAN NOT NULL, push_sent BOOLEAN NOT NULL, local_date DATE NOT NULL, '
+    'PRIMARY KEY (id), CONSTRAINT uq_prayer_events_user_date_prayer UNIQUE (user_id, local_date, prayer))',
+    'CREATE INDEX ix_prayer_events_utc_time ON prayer_events (utc_time)',
+)
+TIMES = {p: datetime(2026, 6, 21, 1 + 3 * i, 30) for i, p in enumerate(PRAYERS)}
+
+
+def _create_legacy_db(statements, rows=()) -> None:
+    """Заменяет тестовую базу файлом со старой схемой (соединения движка к этому моменту закрыты)."""
+    path = engine.url.database
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with sqlite3.connect(path) as conn:
+        for statement in statements:
+            conn.execute(statement)
+        for statement, params in rows:
+            conn.execute(statement, params)
+
+
+async def _init_twice() -> list:
+    snapshots = []
+    for _ in range(2):
+        await db.init_db()
+        async with engine.connect() as conn:
+            snapshots.append({
+                'users': (await conn.execute(text('SELECT * FROM users ORDER BY user_id'))).mappings().all(),
+                'events': (await conn.execute(text('SELECT * FROM prayer_events ORDER BY id'))).mappings().all(),
+                'events_sql': (await conn.execute(text(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'prayer_events'"))).scalar(),
+                'indexes': set((await conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'prayer_events' "
+                    "AND name NOT LIKE 'sqlite_%'"))).scalars().all()),
+            })
+    return snapshots
+
+
+def _check_schema(snapshot) -> None:
+    assert 'AUTOINCREMENT' in snapshot['events_sql'].upper()
+    assert snapshot['indexes'] == {'ix_prayer_events_utc_time', 'ix_prayer_events_alarm_sent_utc_time',
+                                   'ix_prayer_events_push_sent_utc_time'}
+    for user in snapshot['users']:
+        assert 'tz_name' in user.keys()
+        assert not any(column.startswith(('time_', 'alarm_', 'push_')) for column in user.keys())
+
+
+def test_baseline_users_columns_move_to_prayer_events(run):
+    columns = ', '.join(f'time_{p}, alarm_{p}, push_{p}' for p in PRAYERS)
+    placeholders = ', '.join('?' for _ in range(len(PRAYERS) * 3))
+    values = [value for p in PRAYERS for value in (TIMES[p].isoformat(' '), p == 'fajr', p in ('fajr', 'dhuhr'))]
+    _create_legacy_db([BASELINE_USERS], [
+        (f'INSERT INTO users (user_id, city_name, latitude, longitude, timezone, {columns}, date_now) '
+         f'VALUES (?, ?, ?, ?, ?, {placeholders}, ?)', [1, 'Москва', 55.75, 37.61, 3, *values, '2026-06-21']),
+        # Пользователь без расписания: событий у него нет
+        ('INSERT INTO users (user_id, city_name, latitude, longitude, timezone) VALUES (?, ?, ?, ?, ?)',
+         [2, 'Казань', 55.79, 49.1, 3]),
+    ])
+
+    first, second = run(_init_twice())
+
+    _check_schema(first)
+    assert [(u['user_id'], u['city_name'], u['timezone'], u['tz_name']) for u in first['users']] == \
+        [(1, 'Москва', 3, None), (2, 'Казань', 3, None)]
+    events = {e['prayer']: e for e in first['events']}
+    assert set(events) == set(PRAYERS) and all(e['user_id'] == 1 for e in first['events'])
+    for prayer, event in events.items():
+        assert datetime.fromisoformat(event['utc_time']) == TIMES[prayer]
+        assert bool(event['alarm_sent']) == (prayer == 'fajr')
+        assert bool(event['push_sent']) == (prayer in ('fajr', 'dhuhr'))
+        assert date.fromisoformat(event['local_date']) == date(2026, 6, 21)
+    assert second == first
+
+
+def test_prayer_events_rebuilt_with_autoincrement_keeping_rows(run):
+    _create_legacy_db([BASELINE_USERS, *PLAIN_PRAYER_EVENTS], [
+        ('INSERT INTO users (user_id, city_name, latitude, longitude, timezone) VALUES (?, ?, ?, ?, ?)',
+         [1, 'Москва', 55.75, 37.61, 3]),
+        *[('INSERT INTO prayer_events VALUES (?, ?, ?, ?, ?, ?, ?)',
+           [10 + i, 1, p, TIMES[p].isoformat(' '), i % 2, 0, '2026-06-21']) for i, p in enumerate(PRAYERS)],
+    ])
+
+    first, second = run(_init_twice())
+
+    _check_schema(first)
+    assert [(e['id'], e['prayer'], e['alarm_sent']) for e in first['events']] == \
+        [(10 + i, p, i % 2) for i, p in enumerate(PRAYERS)]
+    assert second == first
+
+
+@pytest.mark.parametrize('schema', [[BASELINE_USERS], [BASELINE_USERS, *PLAIN_PRAYER_EVENTS]],
+                         ids=['baseline', 'without autoincrement'])
+def test_migrated_table_does_not_reuse_ids(run, schema):
+    _create_legacy_db(schema, [('INSERT INTO users (user_id, city_name, latitude, longitude, timezone) '
+                                'VALUES (?, ?, ?, ?, ?)', [1, 'Москва', 55.75, 37.61, 3])])
+
+    async def scenario():
+        await db.init_db()
+        await db.update_user_prayers(1, date(2026, 6, 21), {'fajr': TIMES['fajr']})
+        before = await db.get_max_event_id()
+        # Новое расписание удаляет прежнее событие - его id не должен достаться новой строке
+        await db.update_user_prayers(1, date(2026, 6, 21), {'fajr': TIMES['fajr']})
+        return before, await db.get_max_event_id()
+
+    before, after = run(scenario())
+    assert after > before
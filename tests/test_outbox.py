@@ -0,0 +1,171 @@
+"""Очередь исходящих сообщений: лимиты отправки, приоритеты, flood control и ошибки без повтора."""
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, \
+    TelegramRetryAfter
+
+from app.services.outbox import ChatUnavailable, Outbox, Priority
+
+# Лимиты, которые в тестах не должны мешать (проверяется другой лимит)
+UNLIMITED = 10 ** 6
+
+
+class ScriptedBot:
+    """
+    Замена aiogram.Bot: записывает вызовы (время, chat_id, текст); errors[текст] - список исключений,
+    которые по очереди получат отправки этого текста, дальше - успех. Пока gate не открыт, вызовы ждут.
+    """
+
+    def __init__(self, errors: dict = None):
+        self.errors = {text: list(items) for text, items in (errors or {}).items()}
+        self.calls = []
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def __call__(self, method, request_timeout: int = None):
+        self.calls.append((asyncio.get_running_loop().time(), method.chat_id, method.text))
+        await self.gate.wait()
+        pending = self.errors.get(method.text)
+        if pending:
+            raise pending.pop(0)
+        return method.text
+
+    def texts(self) -> list:
+        return [text for _, _, text in self.calls]
+
+
+async def _with_outbox(bot, scenario, **options):
+    outbox = Outbox(**{'rate': UNLIMITED, 'per_chat_rate': UNLIMITED, 'per_chat_burst': UNLIMITED,
+                       'workers': 4, **options})
+    outbox.start(bot)
+    try:
+        return await scenario(outbox)
+    finally:
+        await outbox.stop()
+
+
+def test_global_rate_limit():
+    bot = ScriptedBot()
+
+    async def scenario(outbox):
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(outbox.send_message(chat, 'hi') for chat in range(60)))
+        return asyncio.get_running_loop().time() - started
+
+    elapsed = asyncio.run(_with_outbox(bot, scenario, rate=40))
+    # Запас ведра - 40 сообщений сразу, остальные 20 - со скоростью 40/с
+    assert 0.45 <= elapsed < 1.0
+    # В любом промежутке отправлено не больше запаса ведра плюс rate x длительность
+    times = sorted(moment for moment, _, _ in bot.calls)
+    assert all(j - i + 1 <= 40 + 40 * (times[j] - times[i]) + 1
+               for i in range(len(times)) for j in range(i + 1, len(times)))
+
+
+def test_per_chat_rate_limit_does_not_block_other_chats():
+    bot = ScriptedBot()
+
+    async def scenario(outbox):
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(outbox.send_message(1, f'one {i}') for i in range(3)),
+                             outbox.send_message(2, 'two'))
+        return started
+
+    started = asyncio.run(_with_outbox(bot, scenario, per_chat_rate=5, per_chat_burst=1))
+    # Сообщения одного чата - не чаще 5 в секунду, другой чат не ждёт
+    one = sorted(moment - started for moment, chat, _ in bot.calls if chat == 1)
+    two = [moment - started for moment, chat, _ in bot.calls if chat == 2]
+    assert two[0] < 0.05
+    assert one[1] - one[0] >= 0.15 and one[2] - one[1] >= 0.15
+
+
+def test_higher_priority_lanes_go_first():
+    bot = ScriptedBot()
+
+    async def scenario(outbox):
+        # Единственный воркер занят первым сообщением, пока копится очередь
+        bot.gate.clear()
+        first = outbox.send_message(0, 'busy')
+        await asyncio.sleep(0.01)
+        futures = [outbox.send_message(1, 'bulk 1', Priority.BULK), outbox.send_message(2, 'push', Priority.PUSH),
+                   outbox.send_message(3, 'bulk 2', Priority.BULK), outbox.send_message(4, 'alarm', Priority.ALARM),
+                   outbox.send_message(5, 'reply', Priority.REPLY)]
+        bot.gate.set()
+        await asyncio.gather(first, *futures)
+
+    asyncio.run(_with_outbox(bot, scenario, workers=1))
+    assert bot.texts() == ['busy', 'reply', 'alarm', 'push', 'bulk 1', 'bulk 2']
+
+
+def test_retry_after_pauses_sending_and_retries_message():
+    bot = ScriptedBot({'flood': [TelegramRetryAfter(method=None, message='Too Many Requests', retry_after=1)]})
+
+    async def scenario(outbox):
+        flood = outbox.send_message(1, 'flood')
+        await asyncio.sleep(0.05)
+        # Во время паузы ждут и другие сообщения
+        other = outbox.send_message(2, 'other')
+        return await asyncio.gather(flood, other)
+
+    assert asyncio.run(_with_outbox(bot, scenario, workers=1)) == ['flood', 'other']
+    (first, _, _), (retry, _, retried), (after, _, _) = bot.calls
+    assert retried == 'flood' and retry - first >= 0.95
+    assert after >= retry
+
+
+@pytest.mark.parametrize('error', [
+    TelegramForbiddenError(method=None, message='Forbidden: bot was blocked by the user'),
+    TelegramBadRequest(method=None, message='Bad Request: chat not found'),
+], ids=['blocked', 'chat not found'])
+def test_unavailable_chat_is_not_retried(error):
+    bot = ScriptedBot({'gone': [error, error]})
+
+    async def scenario(outbox):
+        with pytest.raises(ChatUnavailable) as raised:
+            await outbox.send_message(1, 'gone')
+        await asyncio.sleep(0.1)
+        return raised.value, outbox.unavailable
+
+    raised, unavailable = asyncio.run(_with_outbox(bot, scenario))
+    assert raised.__cause__ is error
+    assert unavailable == 1
+    assert bot.texts() == ['gone']
+
+
+def test_network_error_is_retried():
+    bot = ScriptedBot({'flaky': [TelegramNetworkError(method=None, message='timeout')]})
+
+    async def scenario(outbox):
+        return await outbox.send_message(1, 'flaky')
+
+    assert asyncio.run(_with_outbox(bot, scenario, max_retries=2)) == 'flaky'
+    assert bot.texts() == ['flaky', 'flaky']
+
+
+def test_other_bad_request_fails_without_retry():
+    error = TelegramBadRequest(method=None, message='Bad Request: message text is empty')
+    bot = ScriptedBot({'bad': [error]})
+
+    async def scenario(outbox):
+        with pytest.raises(TelegramBadRequest):
+            await outbox.send_message(1, 'bad')
+        return outbox.failed
+
+    assert asyncio.run(_with_outbox(bot, scenario)) == 1
+    assert bot.texts() == ['bad']
+
+
+def test_stop_cancels_unsent_messages():
+    bot = ScriptedBot()
+
+    async def scenario():
+        outbox = Outbox(rate=1, per_chat_rate=UNLIMITED, per_chat_burst=UNLIMITED, workers=2)
+        outbox.start(bot)
+        futures = [outbox.send_message(chat, 'hi') for chat in range(5)]
+        await asyncio.sleep(0.05)
+        await outbox.stop()
+        return futures
+
+    futures = asyncio.run(scenario())
+    assert sum(future.cancelled() for future in futures) == 4
+    assert len(bot.calls) == 1
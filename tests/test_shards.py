@@ -0,0 +1,79 @@
+"""Аренда шардов воркерами уведомлений: захват, продление и переход просроченных шардов."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.services.shards import ShardLeases
+
+NOW = datetime(2026, 6, 21, 12, 0, tzinfo=timezone.utc)
+TTL = 30
+
+
+def test_two_workers_race_for_one_shard(db, run):
+    async def scenario():
+        await db.init_shard_leases(1)
+        expires_at = NOW + timedelta(seconds=TTL)
+        first = await asyncio.gather(db.acquire_lease(0, 'a', NOW, expires_at),
+                                     db.acquire_lease(0, 'b', NOW, expires_at))
+        # Пока аренда не истекла, второй воркер шард не получает, а владелец её продлевает
+        later = NOW + timedelta(seconds=TTL / 2)
+        retry = await db.acquire_lease(0, 'b', later, later + timedelta(seconds=TTL))
+        renewed = await db.renew_leases('a', later + timedelta(seconds=TTL))
+        # Владелец перестал продлевать - после истечения аренды шард переходит ко второму
+        expired = later + timedelta(seconds=TTL)
+        takeover = await db.acquire_lease(0, 'b', expired, expired + timedelta(seconds=TTL))
+        kept = await db.renew_leases('a', expired + timedelta(seconds=TTL))
+        return first, retry, renewed, takeover, kept
+
+    first, retry, renewed, takeover, kept = run(scenario())
+    assert sorted(first) == [False, True]
+    assert retry is False and renewed == {0}
+    assert takeover is True and kept == set()
+
+
+def test_concurrent_sync_splits_shards_without_overlap(db, run):
+    async def scenario():
+        a, b = ShardLeases('a', shards=4, ttl=TTL), ShardLeases('b', shards=4, ttl=TTL)
+        await a.start()
+        await asyncio.gather(a.sync(NOW), b.sync(NOW))
+        first = (set(a.owned), set(b.owned))
+        # Следующий раунд выравнивает нагрузку: у каждого не больше ceil(4 / 2)
+        later = NOW + timedelta(seconds=5)
+        await a.sync(later)
+        await b.sync(later)
+        return first, (set(a.owned), set(b.owned))
+
+    (a_first, b_first), (a_owned, b_owned) = run(scenario())
+    assert not a_first & b_first
+    assert not a_owned & b_owned
+    assert a_owned | b_owned == {0, 1, 2, 3}
+    assert len(a_owned) == len(b_owned) == 2
+
+
+def test_shards_of_stopped_worker_move_after_ttl(db, run):
+    async def scenario():
+        a, b = ShardLeases('a', shards=4, ttl=TTL), ShardLeases('b', shards=4, ttl=TTL)
+        await a.start()
+        await a.sync(NOW)
+        await b.sync(NOW)
+        before_expiry = (set(a.owned), set(b.owned))
+        # Воркер a упал и больше не продлевает аренды
+        gained, lost = await b.sync(NOW + timedelta(seconds=TTL + 1))
+        return before_expiry, gained, lost, set(b.owned)
+
+    (a_owned, b_owned), gained, lost, b_after = run(scenario())
+    assert a_owned == {0, 1, 2, 3} and b_owned == set()
+    assert gained == {0, 1, 2, 3} and lost == set()
+    assert b_after == {0, 1, 2, 3}
+
+
+def test_release_frees_shards_and_heartbeat(db, run):
+    async def scenario():
+        a, b = ShardLeases('a', shards=2, ttl=TTL), ShardLeases('b', shards=2, ttl=TTL)
+        await a.start()
+        await a.sync(NOW)
+        await a.release()
+        workers = await db.count_live_workers(NOW)
+        await b.sync(NOW)
+        return workers, set(b.owned)
+
+    assert run(scenario()) == (0, {0, 1})
@@ -0,0 +1,94 @@
+"""
+Воркер уведомлений и смены даты (NOTIFIER_MODE=workers): запускается отдельным процессом,
+сколько угодно экземпляров - python worker.py. Пользователи делятся между воркерами по шардам
+(см. ShardLeases), бот в этом режиме только отвечает на сообщения.
+"""
+import asyncio
+import os
+import signal
+import socket
+from logger import logger
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from app.services.db import init_db
+from app.services.db_writer import db_writer
+from app.services.http_client import http_client
+from app.services.metrics import start_metrics_server
+from app.services.notifier import notification_scheduler, rollover_scheduler, wait_deliveries
+from app.services.outbox import outbox
+from app.services.shards import ShardLeases, share_outbox_rate
+from config import BOT_TOKEN, METRICS_HOST, METRICS_PORT, WORKER_SYNC_INTERVAL
+
+
+async def sync(leases: ShardLeases) -> None:
+    """Продлевает аренды и подхватывает изменения, сделанные процессом бота."""
+    gained, lost = await leases.sync()
+    await share_outbox_rate()
+    rollover_scheduler.shards = set(leases.owned)
+    await notification_scheduler.set_shards(leases.owned, gained)
+    if gained:
+        # Смена даты для перешедших шардов могла не произойти, пока их владелец не работал
+        await rollover_scheduler.run(shards=gained)
+    await notification_scheduler.poll_new_events()
+    await rollover_scheduler.refresh_groups()
+
+
+async def main():
+    worker_id = os.environ.get('WORKER_ID') or f'{socket.gethostname()}-{os.getpid()}'
+    logger.info(f'Starting worker {worker_id}')
+
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
+    await init_db()
+    db_writer.start()
+    await http_client.start()
+    outbox.start(bot)
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+    leases = ShardLeases(worker_id)
+    await leases.start()
+    await leases.sync()
+    await share_outbox_rate()
+    rollover_scheduler.shards = set(leases.owned)
+    notification_scheduler.shards = set(leases.owned)
+
+    scheduler = AsyncIOScheduler()
+    scheduler.start()
+    await rollover_scheduler.start(scheduler)
+    notification_scheduler.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=WORKER_SYNC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if stop.is_set():
+                break
+            try:
+                await sync(leases)
+            except Exception as e:
+                logger.exception(f'Worker sync failed: {e}')
+    finally:
+        scheduler.shutdown(wait=False)
+        await notification_scheduler.stop()
+        # Шарды сразу достаются остальным воркерам, не дожидаясь истечения аренды
+        await leases.release()
+        await outbox.stop()
+        await wait_deliveries()
+        await db_writer.stop()
+        await http_client.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+        logger.info(f'Worker {worker_id} stopped')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())